@@ -0,0 +1,47 @@
+import gevent
+import logging
+import os
+import signal
+
+from gevent import pywsgi
+from geventwebsocket.handler import WebSocketHandler
+
+import client_web
+import texasholdem_poker_service
+import traditional_poker_service
+from poker.game_server_memory import GameServerMemory
+from poker.lobby import LobbyMemory
+from poker.player_client import PlayerClientConnectorMemory
+
+# Web gateway and game services in a single process: no broker between the websockets and the games
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG if 'DEBUG' in os.environ else logging.INFO)
+    logger = logging.getLogger()
+
+    servers = []
+    for connection_channel, service in (
+        ("texas-holdem-poker:lobby", texasholdem_poker_service),
+        ("traditional-poker:lobby", traditional_poker_service),
+    ):
+        lobby = LobbyMemory()
+        servers.append(GameServerMemory(lobby, service.create_room_factory(logger), logger))
+        client_web.player_connectors[connection_channel] = PlayerClientConnectorMemory(lobby, client_web.app.logger)
+
+    greenlets = [gevent.spawn(server.start) for server in servers]
+
+    http_server = pywsgi.WSGIServer(
+        ("", int(os.environ.get("PORT", 5000))),
+        client_web.app,
+        handler_class=WebSocketHandler
+    )
+
+    def shutdown():
+        http_server.stop()
+        for server in servers:
+            server.drain()
+
+    gevent.signal_handler(signal.SIGTERM, shutdown)
+    http_server.serve_forever()
+    gevent.joinall(greenlets)
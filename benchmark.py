@@ -0,0 +1,397 @@
+import argparse
+import json
+import logging
+import platform
+import random
+import sys
+import time
+import timeit
+import uuid
+from typing import Callable, Dict, List, Optional
+
+import gevent
+import gevent.event
+
+from poker.card import Card
+from poker.channel import Channel
+from poker.channel_memory import ChannelMemory
+from poker.channel_redis import ChannelRedis
+from poker.deck import Deck
+from poker.game_room import GameRoom, GameRoomFactory
+from poker.game_server_memory import GameServerMemory
+from poker.lobby import LobbyMemory
+from poker.player import Player
+from poker.player_server import PlayerServer
+from poker.poker_game import GameBetRounder, GameEventDispatcher, GameFactory, GamePacer, GamePlayers, GamePots, \
+    GameSubscriber
+from poker.poker_game_holdem import HoldemPokerGameFactory
+from poker.score_detector import HoldemPokerScoreDetector, TraditionalPokerScoreDetector
+
+# Benchmarks of the game engine (micro), of the game rooms and of the player channels (macro).
+# Every benchmark reports a number of operations per second (higher is better):
+# results are saved as JSON and compared with a baseline saved by a previous run, e.g.
+#   python benchmark.py --output benchmark_baseline.json
+#   python benchmark.py --baseline benchmark_baseline.json
+
+logger = logging.getLogger("benchmark")
+
+# Seeding the card generators, so that every run scores the same hands
+SEED = 42
+
+
+class Benchmark:
+    def __init__(self, name: str, unit: str, run: Callable[["BenchmarkSettings"], float]):
+        self.name: str = name
+        self.unit: str = unit
+        self._run: Callable[["BenchmarkSettings"], float] = run
+
+    @property
+    def group(self) -> str:
+        return self.name.split(".")[0]
+
+    def run(self, settings: "BenchmarkSettings") -> float:
+        """Operations per second"""
+        return self._run(settings)
+
+
+class BenchmarkSettings:
+    def __init__(self, duration: float = 2.0, repeat: int = 5, redis_url: Optional[str] = None):
+        # Seconds each macro benchmark is run for
+        self.duration: float = duration
+        # Timings of each micro benchmark (the fastest one is kept)
+        self.repeat: int = repeat
+        self.redis_url: Optional[str] = redis_url
+
+
+def time_function(function: Callable[[], None], repeat: int) -> float:
+    """Calls per second of the fastest timing, each timing lasting at least 0.2 seconds"""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return number / min(timer.repeat(repeat=repeat, number=number))
+
+
+def random_hands(num_cards: int, lowest_rank: int, count: int = 1000) -> List[List[Card]]:
+    generator = random.Random(SEED)
+    cards = [Card(rank, suit) for rank in range(lowest_rank, 15) for suit in range(0, 4)]
+    return [generator.sample(cards, num_cards) for _ in range(count)]
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Game engine
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def bench_card_create(settings: BenchmarkSettings) -> float:
+    return time_function(lambda: Card(14, 3), settings.repeat)
+
+
+def bench_card_sort(settings: BenchmarkSettings) -> float:
+    hands = random_hands(7, 2)
+    return len(hands) * time_function(lambda: [sorted(cards, reverse=True) for cards in hands], settings.repeat)
+
+
+def bench_deck_pop_cards(settings: BenchmarkSettings) -> float:
+    # A new deck for every hand: popping the cards of a 10 players hold'em hand (2 each, then 3, 1 and 1 shared)
+    def deal():
+        deck = Deck(2)
+        for _ in range(10):
+            deck.pop_cards(2)
+        deck.pop_cards(3)
+        deck.pop_cards(1)
+        deck.pop_cards(1)
+    return time_function(deal, settings.repeat)
+
+
+def bench_holdem_score(settings: BenchmarkSettings) -> float:
+    detector = HoldemPokerScoreDetector()
+    hands = random_hands(7, 2)
+    return len(hands) * time_function(lambda: [detector.get_score(cards) for cards in hands], settings.repeat)
+
+
+def bench_traditional_score(settings: BenchmarkSettings) -> float:
+    detector = TraditionalPokerScoreDetector(7)
+    hands = random_hands(5, 7)
+    return len(hands) * time_function(lambda: [detector.get_score(cards) for cards in hands], settings.repeat)
+
+
+def bench_pots_add_bets(settings: BenchmarkSettings) -> float:
+    # Four bet rounds of six players, two of them going all-in with different stacks
+    def add_bets():
+        players = [Player("player-{}".format(i), "Player {}".format(i), 1000.0 * (i + 1)) for i in range(6)]
+        game_players = GamePlayers(players)
+        pots = GamePots(game_players)
+        pots.add_bets({player.id: 1000.0 for player in players})
+        game_players.fold("player-5")
+        pots.add_bets({player.id: 1000.0 for player in players[1:5]})
+        pots.add_bets({player.id: 500.0 for player in players[2:5]})
+        pots.add_bets({player.id: 0.0 for player in players[2:5]})
+    return time_function(add_bets, settings.repeat)
+
+
+def bench_bet_round(settings: BenchmarkSettings) -> float:
+    # Pre-flop bet round of ten players: the first one raises, everyone else calls
+    def bet_round():
+        players = [Player("player-{}".format(i), "Player {}".format(i), 1000.0) for i in range(10)]
+        bet_rounder = GameBetRounder(GamePlayers(players))
+        bet_rounder.bet_round(
+            "player-2",
+            {"player-0": 20.0, "player-1": 40.0},
+            lambda player, min_bet, max_bet, bets: min_bet + 40.0 if player.id == "player-2" else min_bet
+        )
+    return time_function(bet_round, settings.repeat)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Game rooms
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class NoWaitPacer(GamePacer):
+    """Moves on straight away: hands are played as fast as the bots answer"""
+    def wait(self, players: List[Player], event_dispatcher: GameEventDispatcher, seconds: float):
+        gevent.sleep(0)
+
+
+class HandCounter(GameSubscriber):
+    def __init__(self):
+        self.hands: int = 0
+
+    def game_event(self, event, event_data):
+        if event == "game-over":
+            self.hands += 1
+
+
+class BotPlayer:
+    """Client end of a player: calls most of the time, sometimes folds or raises"""
+    def __init__(self, player_id: str, channel: Channel, generator: random.Random):
+        self._player_id: str = player_id
+        self._channel: Channel = channel
+        self._generator: random.Random = generator
+
+    def play(self):
+        while True:
+            message = self._channel.recv_message()
+            if message.get("event") == "player-action" and message["player"]["id"] == self._player_id:
+                self._channel.send_message({"message_type": "bet", "bet": self._bet(message)})
+
+    def _bet(self, message) -> float:
+        choice = self._generator.random()
+        if choice < 0.1 and message["min_bet"] > 0:
+            return -1
+        if choice > 0.8:
+            return min(message["min_bet"] + 40.0, message["max_bet"])
+        return message["min_bet"]
+
+
+def bench_hands(settings: BenchmarkSettings) -> float:
+    """Hold'em hands per second of 10 rooms of 6 bots playing over in-memory channels"""
+    counter = HandCounter()
+    game_factory = HoldemPokerGameFactory(big_blind=40.0, small_blind=20.0, logger=logger, game_subscribers=[counter])
+    generator = random.Random(SEED)
+    rooms, bots = [], []
+    for room_key in range(10):
+        room = GameRoom("room-{}".format(room_key), False, game_factory, room_size=6, logger=logger, pacer=NoWaitPacer())
+        for seat in range(6):
+            player_id = "player-{}-{}".format(room_key, seat)
+            server_end, client_end = ChannelMemory.pair()
+            # Deep pockets: nobody runs out of money during the benchmark
+            room.join(PlayerServer(server_end, logger, id=player_id, name=player_id, money=1e9))
+            bots.append(gevent.spawn(BotPlayer(player_id, client_end, generator).play))
+        rooms.append(room)
+
+    started_at = time.time()
+    greenlets = [gevent.spawn(room.activate) for room in rooms]
+    gevent.sleep(settings.duration)
+    hands = counter.hands
+    elapsed = time.time() - started_at
+
+    for room in rooms:
+        room.drain()
+    gevent.joinall(greenlets)
+    gevent.killall(bots)
+    return hands / elapsed
+
+
+class IdleGame:
+    GAME_TYPE = "idle"
+
+    def __init__(self, released: gevent.event.Event):
+        self.event_dispatcher = GameEventDispatcher(str(uuid.uuid4()), logger)
+        self._released: gevent.event.Event = released
+
+    def play_hand(self, dealer_id: str):
+        self._released.wait()
+
+
+class IdleGameFactory(GameFactory):
+    """Games doing nothing until released: only the admission is measured"""
+    def __init__(self):
+        self.released = gevent.event.Event()
+
+    def create_game(self, players: List[PlayerServer], pacer: Optional[GamePacer] = None):
+        return IdleGame(self.released)
+
+
+def bench_admission(settings: BenchmarkSettings) -> float:
+    """Players seated per second by a game server reading an in-process lobby (10 seats rooms)"""
+    num_players = 2000
+    lobby = LobbyMemory()
+    game_factory = IdleGameFactory()
+    server = GameServerMemory(lobby, GameRoomFactory(room_size=10, game_factory=game_factory), logger)
+    client_ends = []
+    for i in range(num_players):
+        client_end, server_end = ChannelMemory.pair()
+        lobby.push(
+            {
+                "message_type": "connect",
+                "timeout_epoch": time.time() + 60,
+                "player": {"id": "player-{}".format(i), "name": "Player {}".format(i), "money": 1000.0},
+                "session_id": str(uuid.uuid4()),
+                "room_id": None
+            },
+            server_end
+        )
+        client_ends.append(client_end)
+
+    started_at = time.time()
+    greenlet = gevent.spawn(server.start)
+    while server.count_players() < num_players:
+        gevent.sleep(0)
+    elapsed = time.time() - started_at
+
+    server.drain()
+    game_factory.released.set()
+    greenlet.join()
+    return num_players / elapsed
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Channels
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Typical broadcast game event
+GAME_EVENT = {
+    "message_type": "game-update",
+    "event": "bet",
+    "game_id": "0c7a7b9e-8f0e-4a3e-9d55-2a4c3b0f6a11",
+    "event_id": 1234,
+    "player": {"id": "player-1", "name": "Player 1", "money": 960.0},
+    "bet": 40.0,
+    "bet_type": "raise",
+    "bets": {"player-1": 40.0, "player-2": 20.0, "player-3": 0.0}
+}
+
+
+def channel_throughput(sender: Channel, receiver: Channel, duration: float, batch: int = 100) -> float:
+    """Messages per second sent and received, batch by batch"""
+    messages = 0
+    started_at = time.time()
+    while time.time() - started_at < duration:
+        for _ in range(batch):
+            sender.send_message(GAME_EVENT)
+        for _ in range(batch):
+            receiver.recv_message(time.time() + 5)
+        messages += batch
+    return messages / (time.time() - started_at)
+
+
+def bench_channel_memory(settings: BenchmarkSettings) -> float:
+    sender, receiver = ChannelMemory.pair()
+    return channel_throughput(sender, receiver, settings.duration)
+
+
+def bench_channel_redis(settings: BenchmarkSettings) -> float:
+    from poker.redis_shards import create_redis
+    redis_client = create_redis(settings.redis_url)
+    queue_name = "poker5:benchmark-{}".format(uuid.uuid4())
+    sender = ChannelRedis(redis_client, queue_name + ":in", queue_name + ":out")
+    receiver = ChannelRedis(redis_client, queue_name + ":out", queue_name + ":in")
+    try:
+        return channel_throughput(sender, receiver, settings.duration)
+    finally:
+        redis_client.delete(queue_name + ":in", queue_name + ":out")
+
+
+BENCHMARKS = [
+    Benchmark("micro.card_create", "cards/s", bench_card_create),
+    Benchmark("micro.card_sort", "sorts/s", bench_card_sort),
+    Benchmark("micro.deck_pop_cards", "deals/s", bench_deck_pop_cards),
+    Benchmark("micro.holdem_score", "scores/s", bench_holdem_score),
+    Benchmark("micro.traditional_score", "scores/s", bench_traditional_score),
+    Benchmark("micro.pots_add_bets", "hands/s", bench_pots_add_bets),
+    Benchmark("micro.bet_round", "rounds/s", bench_bet_round),
+    Benchmark("macro.hands", "hands/s", bench_hands),
+    Benchmark("macro.admission", "players/s", bench_admission),
+    Benchmark("macro.channel_memory", "messages/s", bench_channel_memory),
+    Benchmark("macro.channel_redis", "messages/s", bench_channel_redis),
+]
+
+
+def run_benchmarks(benchmarks: List[Benchmark], settings: BenchmarkSettings) -> Dict:
+    results = {}
+    for benchmark in benchmarks:
+        if benchmark.name == "macro.channel_redis" and settings.redis_url is None:
+            print("{:<28} skipped (no --redis-url)".format(benchmark.name))
+            continue
+        value = benchmark.run(settings)
+        results[benchmark.name] = {"value": value, "unit": benchmark.unit}
+        print("{:<28} {:>14,.1f} {}".format(benchmark.name, value, benchmark.unit))
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S+0000", time.gmtime()),
+        "benchmarks": results
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Prints the change of every benchmark run in both, returns the benchmarks slower by more than tolerance"""
+    regressions = []
+    for name, result in sorted(results["benchmarks"].items()):
+        if name not in baseline["benchmarks"]:
+            continue
+        change = result["value"] / baseline["benchmarks"][name]["value"] - 1
+        regressed = change < -tolerance
+        if regressed:
+            regressions.append(name)
+        print("{:<28} {:>+8.1%}{}".format(name, change, "  REGRESSION" if regressed else ""))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Poker engine, rooms and channels benchmarks")
+    parser.add_argument("--only", action="append", default=[],
+                        help="Benchmarks to run, by name or group (micro, macro): all of them by default")
+    parser.add_argument("--output", help="JSON file the results are saved to")
+    parser.add_argument("--baseline", help="JSON file of a previous run to compare the results with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Slowdown reported as a regression (0.2 = 20%%)")
+    parser.add_argument("--duration", type=float, default=2.0, help="Seconds each macro benchmark is run for")
+    parser.add_argument("--repeat", type=int, default=5, help="Timings of each micro benchmark")
+    parser.add_argument("--redis-url", help="Redis used by the Redis channel benchmark (skipped if missing)")
+    args = parser.parse_args(argv)
+
+    benchmarks = [
+        benchmark for benchmark in BENCHMARKS
+        if not args.only or benchmark.name in args.only or benchmark.group in args.only
+    ]
+    if not benchmarks:
+        parser.error("No benchmark matching {}".format(", ".join(args.only)))
+
+    results = run_benchmarks(benchmarks, BenchmarkSettings(args.duration, args.repeat, args.redis_url))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        print("\nCompared with {} (python {}, {}):".format(args.baseline, baseline.get("python"), baseline.get("time")))
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("{} regression(s): {}".format(len(regressions), ", ".join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main())
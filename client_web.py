@@ -1,25 +1,60 @@
 import os
 import uuid
+from typing import Dict
 
 import gevent
-import redis
 from flask import Flask, render_template, redirect, session, url_for, request
 from flask_sockets import Sockets
 from geventwebsocket.websocket import WebSocket
 
 from poker.channel import ChannelError, MessageFormatError, MessageTimeout
+from poker.channel_inbox import Inbox
 from poker.channel_websocket import ChannelWebSocket
+from poker.metrics import registry, MetricsServer
 from poker.player import Player
-from poker.player_client import PlayerClientConnector
+from poker.player_client import PlayerClientConnector, PlayerClientConnectorMemory
+from poker.redis_shards import RedisShards, create_redis
+from poker.tracing import GatewayTracer, tracer
 
 app = Flask(__name__)
-app.config["SECRET_KEY"] = "!!_-pyp0k3r-_!!"
+# Shared with client_web_async.py, which reads the same session cookie
+app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "!!_-pyp0k3r-_!!")
 app.debug = True
 
 sockets = Sockets(app)
 
-redis_url = os.environ["REDIS_URL"]
-redis = redis.from_url(redis_url)
+# Not needed when the game services run in this process (all-in-one deployment)
+redis = create_redis(os.environ["REDIS_URL"]) if "REDIS_URL" in os.environ else None
+# Player sessions spread over several Redis endpoints (same endpoints as the game services)
+session_redis = RedisShards.from_urls(os.environ["REDIS_SHARD_URLS"].split(",")) \
+    if "REDIS_SHARD_URLS" in os.environ else redis
+
+HEARTBEAT_INTERVAL = 5
+# Must match the number of lobby shards of the game services
+LOBBY_SHARDS = int(os.environ.get("LOBBY_SHARDS", 1))
+
+# Game service channels: "inbox" (one multiplexed inbox per process), "stream" (Redis streams) or "queue"
+CHANNEL = os.environ.get("CHANNEL", "inbox")
+
+# Messages from the game services to every player connected to this process
+inbox = Inbox(session_redis, "poker5:gateway-{}:inbox".format(uuid.uuid4()), app.logger) \
+    if CHANNEL == "inbox" and redis is not None else None
+
+# Connectors to the game services running in this process, by lobby name
+player_connectors: Dict[str, PlayerClientConnectorMemory] = {}
+
+GATEWAY_CONNECTIONS = registry.gauge("poker_gateway_connections", "Websockets connected to a game service")
+GATEWAY_CONNECTION_FAILURES = registry.counter(
+    "poker_gateway_connection_failures_total", "Websockets which could not be connected to a game service"
+)
+GATEWAY_MESSAGES = registry.counter("poker_gateway_messages_total", "Messages forwarded", ["source"])
+
+if "METRICS_PORT" in os.environ:
+    # Local endpoint only
+    MetricsServer(int(os.environ["METRICS_PORT"]), logger=app.logger).start()
+
+# One player action traced every TRACE_SAMPLING (game events are sampled by the game services)
+tracer.set_sampling(int(os.environ.get("TRACE_SAMPLING", 0)))
 
 
 @app.route("/")
@@ -56,7 +91,7 @@ def traditional_poker_game(ws: WebSocket):
 
 
 def poker_game(ws: WebSocket, connection_channel: str):
-    client_channel = ChannelWebSocket(ws)
+    client_channel = ChannelWebSocket(ws, pong_timeout=3 * HEARTBEAT_INTERVAL)
 
     if "player-id" not in session:
         client_channel.send_message({"message_type": "error", "error": "Unrecognized user"})
@@ -70,7 +105,12 @@ def poker_game(ws: WebSocket, connection_channel: str):
     player_money = session["player-money"]
     room_id = session["room-id"]
 
-    player_connector = PlayerClientConnector(redis, connection_channel, app.logger)
+    player_connector = player_connectors.get(connection_channel)
+    if player_connector is None:
+        player_connector = PlayerClientConnector(
+            redis, connection_channel, app.logger, lobby_shards=LOBBY_SHARDS, inbox=inbox,
+            streams=CHANNEL == "stream", session_redis=session_redis
+        )
 
     try:
         server_channel = player_connector.connect(
@@ -85,8 +125,10 @@ def poker_game(ws: WebSocket, connection_channel: str):
 
     except (ChannelError, MessageFormatError, MessageTimeout) as e:
         app.logger.error("Unable to connect player {} to a poker5 server: {}".format(player_id, e.args[0]))
+        GATEWAY_CONNECTION_FAILURES.inc()
 
     else:
+        GATEWAY_CONNECTIONS.inc()
         # Forwarding connection to the client
         client_channel.send_message(server_channel.connection_message)
 
@@ -94,30 +136,64 @@ def poker_game(ws: WebSocket, connection_channel: str):
         #  Game service communication
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-        def message_handler(channel1, channel2):
-            # Forward messages received from channel1 to channel2
+        session_tracer = GatewayTracer(player_id)
+
+        def client_message_handler():
+            # Forward client messages to the game service
+            forwarded = GATEWAY_MESSAGES.labels("client")
             try:
                 while True:
-                    message = channel1.recv_message()
+                    message = client_channel.recv_message()
                     if "message_type" in message and message["message_type"] == "disconnect":
                         raise ChannelError
-                    channel2.send_message(message)
+                    # Last seen when the websocket frame was read
+                    message = session_tracer.client_message(message, client_channel.last_seen)
+                    server_channel.send_message(message)
+                    session_tracer.client_message_pushed(message)
+                    forwarded.inc()
             except (ChannelError, MessageFormatError):
                 pass
 
-        greenlets = [
-            # Forward client messages to the game service
-            gevent.spawn(message_handler, client_channel, server_channel),
+        def server_message_handler():
             # Forward game service messages to the client
-            gevent.spawn(message_handler, server_channel, client_channel)
+            forwarded = GATEWAY_MESSAGES.labels("server")
+            try:
+                while True:
+                    message = server_channel.recv_message()
+                    if "message_type" in message and message["message_type"] == "disconnect":
+                        raise ChannelError
+                    message, trace = session_tracer.server_message(message)
+                    client_channel.send_message(message)
+                    if trace is not None:
+                        session_tracer.server_message_written(message, trace)
+                    forwarded.inc()
+            except (ChannelError, MessageFormatError):
+                pass
+
+        def heartbeat_handler():
+            # Websocket level ping to the client (disconnected once its pongs stop coming),
+            # the game service is told the player is still there
+            try:
+                while True:
+                    client_channel.heartbeat()
+                    server_channel.heartbeat()
+                    gevent.sleep(HEARTBEAT_INTERVAL)
+            except ChannelError:
+                pass
+
+        greenlets = [
+            gevent.spawn(client_message_handler),
+            gevent.spawn(server_message_handler),
+            # Keep the connection alive
+            gevent.spawn(heartbeat_handler)
         ]
 
         def closing_handler(*args, **kwargs):
             # Kill other active greenlets
             gevent.killall(greenlets, ChannelError)
 
-        greenlets[0].link(closing_handler)
-        greenlets[1].link(closing_handler)
+        for greenlet in greenlets:
+            greenlet.link(closing_handler)
 
         gevent.joinall(greenlets)
 
@@ -135,4 +211,5 @@ def poker_game(ws: WebSocket, connection_channel: str):
         finally:
             server_channel.close()
 
+        GATEWAY_CONNECTIONS.dec()
         app.logger.info("player {} connection closed".format(player_id))
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Optional, Dict, Tuple
+
+import redis.asyncio
+from aiohttp import web, WSMsgType
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+from poker.channel import ChannelError, MessageFormatError, MessageTimeout
+from poker.channel_inbox_async import AsyncInbox, AsyncChannelInbox
+from poker.lobby import LobbyShards
+from poker.tracing import GatewayTracer, tracer
+
+# Websocket gateway running on asyncio, alternative to the websocket endpoints of client_web.py.
+# The pages (login and game) are still served by client_web.py: the session cookie it signs is read from here,
+# so the secret key must be the same.
+
+HEARTBEAT_INTERVAL = 5
+CONNECTION_TIMEOUT = 30
+# Must match the number of lobby shards of the game services
+LOBBY_SHARDS = int(os.environ.get("LOBBY_SHARDS", 1))
+
+logger = logging.getLogger("client_web_async")
+
+# One player action traced every TRACE_SAMPLING (game events are sampled by the game services)
+tracer.set_sampling(int(os.environ.get("TRACE_SAMPLING", 0)))
+
+# Only used to decode the session cookies
+flask_app = Flask(__name__)
+flask_app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "!!_-pyp0k3r-_!!")
+
+
+def session_serializer():
+    return SecureCookieSessionInterface().get_signing_serializer(flask_app)
+
+
+def load_session(request: web.Request) -> Optional[Dict]:
+    cookie = request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if not cookie:
+        return None
+    try:
+        return session_serializer().loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except Exception:
+        # Tampered or expired
+        return None
+
+
+async def texasholdem_poker_game(request: web.Request) -> web.WebSocketResponse:
+    return await poker_game(request, "texas-holdem-poker:lobby")
+
+
+async def traditional_poker_game(request: web.Request) -> web.WebSocketResponse:
+    return await poker_game(request, "traditional-poker:lobby")
+
+
+async def connect(inbox: AsyncInbox, connection_channel: str, session: Dict,
+                  session_id: str) -> Tuple[AsyncChannelInbox, Dict]:
+    """Requests a new connection, returns the game server channel and the connection message"""
+    lobby = LobbyShards(connection_channel, LOBBY_SHARDS)
+    player_id = session["player-id"]
+    room_id = session["room-id"]
+    # The game server inbox is known once the connection is acknowledged
+    server_channel = inbox.open_channel(session_id)
+    try:
+        await inbox.push(
+            lobby.shard_name(lobby.shard_of(player_id=player_id, room_id=room_id)),
+            {
+                "message_type": "connect",
+                "timeout_epoch": time.time() + CONNECTION_TIMEOUT,
+                "player": {
+                    "id": player_id,
+                    "name": session["player-name"],
+                    "money": session["player-money"]
+                },
+                "session_id": session_id,
+                "room_id": room_id,
+                "requested_at": time.time(),
+                "reply_to": inbox.name,
+                "channel": "queue"
+            }
+        )
+        connection_message = await server_channel.recv_message(time.time() + CONNECTION_TIMEOUT)
+        MessageFormatError.validate_message_type(connection_message, "connect")
+    except:
+        await server_channel.close()
+        raise
+    return server_channel, connection_message
+
+
+async def poker_game(request: web.Request, connection_channel: str) -> web.WebSocketResponse:
+    # Websocket level pings to the client are sent by aiohttp
+    ws = web.WebSocketResponse(heartbeat=HEARTBEAT_INTERVAL)
+    await ws.prepare(request)
+
+    session = load_session(request)
+    if session is None or "player-id" not in session:
+        await ws.send_json({"message_type": "error", "error": "Unrecognized user"})
+        await ws.close()
+        return ws
+
+    player_id = session["player-id"]
+    session_id = str(uuid.uuid4())
+
+    try:
+        server_channel, connection_message = await connect(request.app["inbox"], connection_channel, session, session_id)
+    except (ChannelError, MessageFormatError, MessageTimeout) as e:
+        logger.error("Unable to connect player {} to a poker5 server: {}".format(player_id, e.args[0]))
+        await ws.close()
+        return ws
+
+    # Forwarding connection to the client
+    await ws.send_json(connection_message)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    #  Game service communication
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    session_tracer = GatewayTracer(player_id)
+
+    async def client_message_handler():
+        # Forward client messages to the game service
+        try:
+            async for ws_message in ws:
+                received_at = time.time()
+                if ws_message.type != WSMsgType.TEXT:
+                    break
+                message = json.loads(ws_message.data)
+                if "message_type" in message and message["message_type"] == "disconnect":
+                    break
+                message = session_tracer.client_message(message, received_at)
+                await server_channel.send_message(message)
+                session_tracer.client_message_pushed(message)
+        except (ChannelError, ValueError):
+            pass
+
+    async def server_message_handler():
+        # Forward game service messages to the client
+        try:
+            while True:
+                message = await server_channel.recv_message()
+                if "message_type" in message and message["message_type"] == "disconnect":
+                    break
+                message, trace = session_tracer.server_message(message)
+                await ws.send_json(message)
+                if trace is not None:
+                    session_tracer.server_message_written(message, trace)
+        except (ChannelError, ConnectionError):
+            pass
+
+    # Heartbeats to the game service are sent by the inbox, for every session at once
+    handlers = [asyncio.ensure_future(client_message_handler()), asyncio.ensure_future(server_message_handler())]
+    try:
+        await asyncio.wait(handlers, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for handler in handlers:
+            handler.cancel()
+
+    try:
+        await ws.send_json({"message_type": "disconnect"})
+    except:
+        pass
+    finally:
+        await ws.close()
+
+    try:
+        await server_channel.send_message({"message_type": "disconnect"})
+    except ChannelError:
+        pass
+    finally:
+        await server_channel.close()
+
+    logger.info("player {} connection closed".format(player_id))
+    return ws
+
+
+async def on_startup(app: web.Application):
+    app["redis"] = redis.asyncio.from_url(os.environ["REDIS_URL"])
+    # Messages from the game services to every player connected to this process
+    app["inbox"] = AsyncInbox(app["redis"], "poker5:gateway-{}:inbox".format(uuid.uuid4()), logger)
+
+
+async def on_cleanup(app: web.Application):
+    await app["inbox"].stop()
+    await app["redis"].close()
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/poker/texas-holdem", texasholdem_poker_game)
+    app.router.add_get("/poker/traditional", traditional_poker_game)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG if 'DEBUG' in os.environ else logging.INFO)
+    web.run_app(create_app(), port=int(os.environ.get("PORT", 5000)))
@@ -0,0 +1,404 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+# Load test of a whole deployment (client_web.py, game services and Redis) with simulated players:
+# every client logs in through /join, keeps its HTTP session to open the game websocket,
+# answers the pings and plays according to a bet strategy and a cards-change strategy.
+# Reports the connection success rate, the latency of each action and the saturation of the servers
+# (metrics endpoints of the gateways and game services, CPU usage of local processes).
+
+
+def percentile(values: List[float], percent: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Strategies
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class BetStrategy:
+    """Bet answered to a player-action message: -1 to fold, min_bet to check or call, more to raise"""
+    def bet(self, min_bet: float, max_bet: float, generator: random.Random) -> float:
+        raise NotImplementedError
+
+    @staticmethod
+    def create(name: str) -> "BetStrategy":
+        if name == "call":
+            return CallBetStrategy()
+        elif name == "random":
+            return RandomBetStrategy()
+        elif name == "aggressive":
+            return AggressiveBetStrategy()
+        elif name == "fold":
+            return FoldBetStrategy()
+        raise ValueError("Unknown bet strategy '{}'".format(name))
+
+
+class CallBetStrategy(BetStrategy):
+    def bet(self, min_bet: float, max_bet: float, generator: random.Random) -> float:
+        return min_bet
+
+
+class RandomBetStrategy(BetStrategy):
+    FOLD_RATIO = 0.15
+    RAISE_RATIO = 0.2
+
+    def bet(self, min_bet: float, max_bet: float, generator: random.Random) -> float:
+        choice = generator.random()
+        if choice < self.FOLD_RATIO and min_bet > 0:
+            return -1
+        if choice > 1 - self.RAISE_RATIO and max_bet > min_bet:
+            return round(generator.uniform(min_bet, min(max_bet, min_bet * 3 + 40)))
+        return min_bet
+
+
+class AggressiveBetStrategy(BetStrategy):
+    def bet(self, min_bet: float, max_bet: float, generator: random.Random) -> float:
+        return max_bet
+
+
+class FoldBetStrategy(BetStrategy):
+    """Checks when possible, folds otherwise"""
+    def bet(self, min_bet: float, max_bet: float, generator: random.Random) -> float:
+        return 0 if min_bet == 0 else -1
+
+
+class CardsChangeStrategy:
+    """Indexes of the cards to change (traditional poker), given the (rank, suit) of the player cards"""
+    def discard(self, cards: List[Tuple[int, int]], generator: random.Random) -> List[int]:
+        raise NotImplementedError
+
+    @staticmethod
+    def create(name: str) -> "CardsChangeStrategy":
+        if name == "keep":
+            return KeepCardsChangeStrategy()
+        elif name == "random":
+            return RandomCardsChangeStrategy()
+        elif name == "keep-pairs":
+            return KeepPairsCardsChangeStrategy()
+        raise ValueError("Unknown cards-change strategy '{}'".format(name))
+
+
+class KeepCardsChangeStrategy(CardsChangeStrategy):
+    def discard(self, cards: List[Tuple[int, int]], generator: random.Random) -> List[int]:
+        return []
+
+
+class RandomCardsChangeStrategy(CardsChangeStrategy):
+    def discard(self, cards: List[Tuple[int, int]], generator: random.Random) -> List[int]:
+        return sorted(generator.sample(range(len(cards)), generator.randint(0, min(4, len(cards)))))
+
+
+class KeepPairsCardsChangeStrategy(CardsChangeStrategy):
+    """Changes the cards not matching the rank of any other card (four at most)"""
+    def discard(self, cards: List[Tuple[int, int]], generator: random.Random) -> List[int]:
+        ranks = collections.Counter(rank for rank, _ in cards)
+        return [key for key, (rank, _) in enumerate(cards) if ranks[rank] == 1][:4]
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Clients
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class Stats:
+    def __init__(self):
+        self.connections: collections.Counter = collections.Counter()
+        self.latencies: Dict[str, List[float]] = collections.defaultdict(list)
+        self.errors: collections.Counter = collections.Counter()
+        self.messages: collections.Counter = collections.Counter()
+
+
+class Client:
+    """Simulated player, with its own HTTP session"""
+    CONNECTION_TIMEOUT = 60
+
+    def __init__(self, name: str, args, connector: aiohttp.BaseConnector, stats: Stats,
+                 bet_strategy: BetStrategy, cards_change_strategy: CardsChangeStrategy):
+        self._name: str = name
+        self._args = args
+        self._stats: Stats = stats
+        self._bet_strategy: BetStrategy = bet_strategy
+        self._cards_change_strategy: CardsChangeStrategy = cards_change_strategy
+        self._generator = random.Random()
+        # The session cookie set by /join is sent along with the websocket handshake
+        self._http = aiohttp.ClientSession(connector=connector, connector_owner=False,
+                                           cookie_jar=aiohttp.CookieJar(unsafe=True))
+        self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self._player_id: Optional[str] = None
+        self._cards: List[Tuple[int, int]] = []
+        # Action waiting for the server to broadcast it: (event, time sent)
+        self._pending_action: Optional[Tuple[str, float]] = None
+
+    async def connect(self) -> bool:
+        self._stats.connections["attempted"] += 1
+        started_at = time.perf_counter()
+        try:
+            response = await self._http.post(
+                self._args.url + "/join",
+                data={"name": self._name, "room-id": self._args.room or ""},
+                allow_redirects=False
+            )
+            response.release()
+            if response.status >= 400 or "session" not in {cookie.key for cookie in self._http.cookie_jar}:
+                self._stats.connections["join failed"] += 1
+                return False
+            self._stats.latencies["join"].append(time.perf_counter() - started_at)
+
+            started_at = time.perf_counter()
+            self._ws = await self._http.ws_connect(self._args.url.replace("http", "ws", 1) + self._args.endpoint)
+            message = await self._ws.receive_json(timeout=self.CONNECTION_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._stats.connections["timed out"] += 1
+            return False
+        except (aiohttp.ClientError, TypeError, ValueError):
+            self._stats.connections["websocket failed"] += 1
+            return False
+
+        if message.get("message_type") != "connect":
+            self._stats.connections["refused"] += 1
+            return False
+        self._stats.latencies["connect"].append(time.perf_counter() - started_at)
+        self._stats.connections["connected"] += 1
+        self._player_id = message["player"]["id"]
+        return True
+
+    async def play(self, until: float):
+        try:
+            while time.time() < until:
+                try:
+                    message = await self._ws.receive_json(timeout=max(0.1, until - time.time()))
+                except asyncio.TimeoutError:
+                    break
+                self._stats.messages[message.get("message_type")] += 1
+                await self._on_message(message)
+        except (aiohttp.ClientError, TypeError, ValueError):
+            # Closed by the server (or not a JSON message)
+            self._stats.connections["dropped"] += 1
+
+    async def _on_message(self, message: Dict[str, Any]):
+        message_type = message.get("message_type")
+        if message_type == "ping":
+            await self._ws.send_json({"message_type": "pong"})
+        elif message_type == "error":
+            self._stats.errors[message.get("error")] += 1
+        elif message_type == "disconnect":
+            raise aiohttp.ClientError("Disconnected by the server")
+        elif message_type == "game-update":
+            await self._on_game_update(message)
+            if self._args.ack and "event_id" in message:
+                await self._ws.send_json({"message_type": "ack", "event_id": message["event_id"]})
+
+    async def _on_game_update(self, message: Dict[str, Any]):
+        event = message.get("event")
+        player_id = (message.get("player") or {}).get("id")
+
+        if event == "cards-assignment":
+            self._cards = [tuple(card) for card in message["cards"]]
+        elif self._pending_action is not None and player_id == self._player_id and event in ("bet", "fold", "cards-change"):
+            # Our action made it through the gateway and the game service
+            action, sent_at = self._pending_action
+            self._stats.latencies[action].append(time.perf_counter() - sent_at)
+            self._pending_action = None
+        elif event == "player-action" and player_id == self._player_id:
+            await self._think()
+            if message["action"] == "bet":
+                action = {
+                    "message_type": "bet",
+                    "bet": self._bet_strategy.bet(message["min_bet"], message["max_bet"], self._generator)
+                }
+            else:
+                action = {
+                    "message_type": "cards-change",
+                    "cards": self._cards_change_strategy.discard(self._cards, self._generator)
+                }
+            self._pending_action = (action["message_type"], time.perf_counter())
+            await self._ws.send_json(action)
+
+    async def _think(self):
+        if self._args.think_time > 0:
+            await asyncio.sleep(self._generator.uniform(0, self._args.think_time))
+
+    async def close(self):
+        try:
+            if self._ws is not None and not self._ws.closed:
+                await self._ws.send_json({"message_type": "disconnect"})
+                await self._ws.close()
+        except (aiohttp.ClientError, ConnectionError):
+            pass
+        await self._http.close()
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Server side saturation
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def parse_metrics(text: str) -> Dict[str, float]:
+    """Samples of a Prometheus text exposition, keyed by name and labels"""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name, _, value = line.rpartition(" ")
+        try:
+            samples[name] = float(value)
+        except ValueError:
+            pass
+    return samples
+
+
+def process_cpu_seconds(pid: int) -> float:
+    with open("/proc/{}/stat".format(pid)) as stat:
+        # Fields after the command name (which might contain spaces): utime and stime are the 14th and 15th
+        fields = stat.read().rpartition(")")[2].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class SaturationMonitor:
+    """Scrapes the metrics endpoints and the CPU usage of the server processes while the test is running"""
+    # Gauges reported at their peak
+    GAUGES = ("poker_lobby_depth", "poker_rooms", "poker_seated_players", "poker_gateway_connections")
+    # Histograms reported as averages over the test
+    HISTOGRAMS = ("poker_admission_seconds", "poker_bet_decision_seconds", "poker_event_fanout_seconds")
+    INTERVAL = 1
+
+    def __init__(self, http: aiohttp.ClientSession, metrics_urls: List[str], pids: List[int]):
+        self._http: aiohttp.ClientSession = http
+        self._metrics_urls: List[str] = metrics_urls
+        self._pids: List[int] = pids
+        self._first: Dict[str, Dict[str, float]] = {}
+        self._last: Dict[str, Dict[str, float]] = {}
+        self.peaks: Dict[str, float] = {}
+        self.cpu: Dict[int, List[float]] = {}
+        self.failed_scrapes: int = 0
+
+    async def run(self):
+        started_at = time.time()
+        cpu_start = {pid: process_cpu_seconds(pid) for pid in self._pids}
+        try:
+            while True:
+                await self._scrape()
+                await asyncio.sleep(self.INTERVAL)
+                elapsed = time.time() - started_at
+                for pid in self._pids:
+                    self.cpu.setdefault(pid, []).append((process_cpu_seconds(pid) - cpu_start[pid]) / elapsed)
+        except asyncio.CancelledError:
+            pass
+
+    async def _scrape(self):
+        for url in self._metrics_urls:
+            try:
+                async with self._http.get(url) as response:
+                    samples = parse_metrics(await response.text())
+            except aiohttp.ClientError:
+                self.failed_scrapes += 1
+                continue
+            self._first.setdefault(url, samples)
+            self._last[url] = samples
+            for name, value in samples.items():
+                if name.startswith(self.GAUGES):
+                    self.peaks[name] = max(value, self.peaks.get(name, value))
+
+    def averages(self) -> Dict[str, float]:
+        """Average of each histogram over the samples observed during the test, all endpoints together"""
+        totals = collections.defaultdict(lambda: [0.0, 0.0])
+        for url, last in self._last.items():
+            first = self._first[url]
+            for name in self.HISTOGRAMS:
+                for suffix, key in (("_sum", 0), ("_count", 1)):
+                    for sample, value in last.items():
+                        if sample.split("{")[0] == name + suffix:
+                            totals[name][key] += value - first.get(sample, 0.0)
+        return {name: total / count for name, (total, count) in totals.items() if count}
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+async def run_client(client: Client, until: float):
+    try:
+        if await client.connect():
+            await client.play(until)
+    finally:
+        await client.close()
+
+
+async def run(args):
+    stats = Stats()
+    bet_strategy = BetStrategy.create(args.bet_strategy)
+    cards_change_strategy = CardsChangeStrategy.create(args.cards_change_strategy)
+    connector = aiohttp.TCPConnector(limit=0)
+
+    async with aiohttp.ClientSession() as http:
+        monitor = SaturationMonitor(http, args.metrics_url, args.pid)
+        monitoring = asyncio.ensure_future(monitor.run())
+
+        started_at = time.time()
+        until = started_at + args.clients / args.rate + args.duration
+        tasks = []
+        for key in range(args.clients):
+            client = Client("load-{}".format(key), args, connector, stats, bet_strategy, cards_change_strategy)
+            tasks.append(asyncio.ensure_future(run_client(client, until)))
+            # Ramping up at the given rate
+            await asyncio.sleep(max(0.0, started_at + (key + 1) / args.rate - time.time()))
+        await asyncio.gather(*tasks)
+
+        monitoring.cancel()
+        await monitoring
+    await connector.close()
+
+    attempted = stats.connections["attempted"]
+    print("connections: {} attempted, {} connected ({:.1%})".format(
+        attempted, stats.connections["connected"], stats.connections["connected"] / attempted if attempted else 0.0
+    ))
+    for failure in ("join failed", "websocket failed", "refused", "timed out", "dropped"):
+        if stats.connections[failure]:
+            print("  {}: {}".format(failure, stats.connections[failure]))
+
+    print("latencies (ms):")
+    for action, latencies in sorted(stats.latencies.items()):
+        print("  {:<14} count {:>8}  p50 {:>8.1f}  p90 {:>8.1f}  p99 {:>8.1f}  max {:>8.1f}".format(
+            action, len(latencies),
+            *[percentile(latencies, percent) * 1000 for percent in (50, 90, 99)], max(latencies) * 1000
+        ))
+
+    print("messages received: {}".format(json.dumps(dict(stats.messages), sort_keys=True)))
+    for error, count in stats.errors.most_common(10):
+        print("  error {!r}: {}".format(error, count))
+
+    if args.metrics_url:
+        print("server peaks:")
+        for name, value in sorted(monitor.peaks.items()):
+            print("  {} {:g}".format(name, value))
+        for name, average in sorted(monitor.averages().items()):
+            print("  {} average {:.1f} ms".format(name, average * 1000))
+        if monitor.failed_scrapes:
+            print("  failed scrapes: {}".format(monitor.failed_scrapes))
+    for pid, usage in sorted(monitor.cpu.items()):
+        print("cpu of process {}: average {:.0%}, peak {:.0%}".format(pid, usage[-1], max(usage)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test with simulated players")
+    parser.add_argument("--url", default="http://localhost:5000", help="Web application (client_web.py)")
+    parser.add_argument("--endpoint", default="/poker/texas-holdem", choices=["/poker/texas-holdem", "/poker/traditional"])
+    parser.add_argument("--room", help="Private room joined by every client (public rooms by default)")
+    parser.add_argument("--clients", type=int, default=1000, help="Simulated players")
+    parser.add_argument("--rate", type=float, default=100, help="Clients connecting per second")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds played once every client connected")
+    parser.add_argument("--bet-strategy", default="random", choices=["call", "random", "aggressive", "fold"])
+    parser.add_argument("--cards-change-strategy", default="keep-pairs", choices=["keep", "random", "keep-pairs"])
+    parser.add_argument("--think-time", type=float, default=0.5, help="Maximum seconds before answering an action")
+    parser.add_argument("--ack", action="store_true", help="Acknowledge the game events (PACING=ack or turbo)")
+    parser.add_argument("--metrics-url", action="append", default=[],
+                        help="Metrics endpoint of a gateway or game service (METRICS_PORT), can be repeated")
+    parser.add_argument("--pid", type=int, action="append", default=[],
+                        help="Local server process whose CPU usage is reported, can be repeated")
+    asyncio.run(run(parser.parse_args()))
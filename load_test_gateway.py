@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from typing import List, Optional
+
+import aiohttp
+import redis.asyncio
+
+from client_web_async import session_serializer
+from poker.lobby import LobbyShards
+
+# Load test of a websocket gateway (client_web.py or client_web_async.py, inbox channels):
+# idle websockets are opened to measure the memory used by each of them,
+# then a subset of them send messages echoed back by a fake game service to measure the forwarding latency
+# (websocket -> gateway -> Redis -> game service -> Redis -> gateway -> websocket).
+
+
+def rss_bytes(pid: int) -> int:
+    with open("/proc/{}/status".format(pid)) as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    raise ValueError("Unable to read the memory usage of process {}".format(pid))
+
+
+def percentile(values: List[float], percent: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+async def echo_service(redis_client, lobby: LobbyShards):
+    """Fake game service acknowledging every connection and echoing every message"""
+    inbox = "poker5:load-test-{}:inbox".format(uuid.uuid4())
+    queues = lobby.shard_names() + [inbox]
+
+    async def send(remote_inbox, session_id, message):
+        await redis_client.lpush(
+            remote_inbox,
+            json.dumps({"session_id": session_id, "reply_to": inbox, "message": message}).encode("utf-8")
+        )
+
+    while True:
+        response = await redis_client.brpop(queues, timeout=1)
+        if response is None:
+            continue
+        queue, data = response[0].decode("utf-8"), json.loads(response[1])
+        if queue != inbox:
+            if data.get("reply_to") is None:
+                raise ValueError("The gateway must use inbox channels (CHANNEL=inbox)")
+            await send(data["reply_to"], data["session_id"], {
+                "message_type": "connect",
+                "server_id": "load-test",
+                "player": data["player"]
+            })
+        elif "message" in data:
+            await send(data["reply_to"], data["session_id"], data["message"])
+
+
+class Client:
+    def __init__(self, http: aiohttp.ClientSession, url: str):
+        self._http = http
+        self._url = url
+        self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self.latencies: List[float] = []
+
+    async def connect(self):
+        cookie = session_serializer().dumps({
+            "player-id": str(uuid.uuid4()),
+            "player-name": "load-test",
+            "player-money": 1000,
+            "room-id": None
+        })
+        self._ws = await self._http.ws_connect(self._url, headers={"Cookie": "session={}".format(cookie)})
+        connection_message = await self._ws.receive_json()
+        if connection_message.get("message_type") != "connect":
+            raise ValueError("Connection refused: {}".format(connection_message))
+
+    async def send_messages(self, count: int, interval: float):
+        for sequence in range(count):
+            sent_at = time.perf_counter()
+            await self._ws.send_json({"message_type": "echo", "sequence": sequence})
+            while True:
+                message = await self._ws.receive_json()
+                if message.get("sequence") == sequence:
+                    break
+            self.latencies.append(time.perf_counter() - sent_at)
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        await self._ws.close()
+
+
+async def run(args):
+    redis_client = redis.asyncio.from_url(args.redis_url)
+    echo = asyncio.ensure_future(echo_service(redis_client, LobbyShards(args.lobby, args.lobby_shards)))
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as http:
+        clients = [Client(http, args.url) for _ in range(args.sockets)]
+        memory_before = rss_bytes(args.gateway_pid) if args.gateway_pid else None
+
+        for start in range(0, len(clients), args.connect_batch):
+            await asyncio.gather(*[client.connect() for client in clients[start:start + args.connect_batch]])
+        # Letting the gateway settle
+        await asyncio.sleep(1)
+
+        if memory_before is not None:
+            memory_per_socket = (rss_bytes(args.gateway_pid) - memory_before) / len(clients)
+            print("memory per socket: {:.1f} KiB".format(memory_per_socket / 1024))
+
+        active = clients[:args.active]
+        await asyncio.gather(*[client.send_messages(args.messages, args.interval) for client in active])
+        latencies = [latency for client in active for latency in client.latencies]
+        print("messages: {}".format(len(latencies)))
+        print("latency p50: {:.2f} ms".format(percentile(latencies, 50) * 1000))
+        print("latency p99: {:.2f} ms".format(percentile(latencies, 99) * 1000))
+
+        await asyncio.gather(*[client.close() for client in clients])
+
+    echo.cancel()
+    await redis_client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Websocket gateway load test")
+    parser.add_argument("--url", default="ws://localhost:5000/poker/texas-holdem")
+    parser.add_argument("--redis-url", default="redis://localhost:6379")
+    parser.add_argument("--lobby", default="texas-holdem-poker:lobby")
+    parser.add_argument("--lobby-shards", type=int, default=1)
+    parser.add_argument("--gateway-pid", type=int, help="Process of the gateway, to measure its memory")
+    parser.add_argument("--sockets", type=int, default=1000, help="Websockets opened")
+    parser.add_argument("--active", type=int, default=100, help="Websockets sending messages")
+    parser.add_argument("--messages", type=int, default=100, help="Messages sent by each active websocket")
+    parser.add_argument("--interval", type=float, default=0.1, help="Seconds between two messages")
+    parser.add_argument("--connect-batch", type=int, default=100, help="Websockets opened concurrently")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+import signal
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import gevent
+from redis import exceptions, Redis
+
+from poker.game_event_stream import GAME_EVENTS_STREAM
+from poker.metrics import MetricsRegistry, MetricsServer
+from poker.redis_shards import create_redis
+
+# Real-time observer: reads the game events published by every game node (PUBLISH_GAME_EVENTS)
+# and keeps rolling aggregates in memory, served as JSON (/stats) and as metrics (/metrics) to a dashboard.
+# Memory doesn't depend on the number of tables: events are folded into a fixed number of time buckets.
+# Observers only read the stream, adding observers costs nothing to the game nodes.
+
+
+class RollingWindow:
+    """Count, sum and maximum of the values observed over the last window_seconds, in fixed-size buckets"""
+    def __init__(self, window_seconds: float = 300, num_buckets: int = 30):
+        self._window_seconds: float = window_seconds
+        self._bucket_seconds: float = window_seconds / num_buckets
+        # [bucket number, count, sum, max] of each bucket, indexed by bucket number modulo the number of buckets
+        self._buckets: List[List[float]] = [[-1, 0, 0.0, 0.0] for _ in range(num_buckets)]
+
+    @property
+    def window_seconds(self) -> float:
+        return self._window_seconds
+
+    def _bucket(self, at: float) -> Tuple[int, List[float]]:
+        number = int(at // self._bucket_seconds)
+        return number, self._buckets[number % len(self._buckets)]
+
+    def add(self, value: float = 1.0, at: Optional[float] = None):
+        number, bucket = self._bucket(time.time() if at is None else at)
+        if bucket[0] != number:
+            if bucket[0] > number:
+                # Older than the window
+                return
+            bucket[:] = [number, 0, 0.0, value]
+        bucket[1] += 1
+        bucket[2] += value
+        bucket[3] = max(bucket[3], value)
+
+    def snapshot(self, now: Optional[float] = None) -> Dict[str, float]:
+        current, _ = self._bucket(time.time() if now is None else now)
+        buckets = [bucket for bucket in self._buckets if current - len(self._buckets) < bucket[0] <= current]
+        count = sum(bucket[1] for bucket in buckets)
+        total = sum(bucket[2] for bucket in buckets)
+        return {
+            "count": count,
+            "per_minute": count * 60 / self._window_seconds,
+            "sum": total,
+            "average": total / count if count else 0.0,
+            "max": max((bucket[3] for bucket in buckets), default=0.0)
+        }
+
+
+class GameObserver:
+    """Rolling aggregates of the events published by the game nodes"""
+    # Seconds after which a node that stopped publishing is no longer counted
+    NODE_TTL = 10
+
+    WINDOWS = {
+        "new-game": "hands_started",
+        "game-over": "hands",
+        "winner-designation": "pots",
+        "dead-player": "timeouts",
+        "player-added": "joins",
+        "player-removed": "leaves",
+        "player-rejoined": "reconnects",
+    }
+
+    def __init__(self, window_seconds: float = 300, num_buckets: int = 30):
+        self._windows: Dict[str, RollingWindow] = {
+            name: RollingWindow(window_seconds, num_buckets) for name in self.WINDOWS.values()
+        }
+        # Last report of every node: {"cluster", "tables", "dropped", "time"}
+        self._nodes: Dict[str, Dict[str, Any]] = {}
+        self._game_types: Dict[str, RollingWindow] = {}
+        self._window_seconds: float = window_seconds
+        self._num_buckets: int = num_buckets
+
+    def observe(self, record: Dict[str, Any]):
+        event = record.get("event")
+        at = record.get("time")
+        if event == "node":
+            self._nodes[record["node"]] = record
+        elif event == "winner-designation":
+            self._windows["pots"].add(float(record["pot"]), at)
+        elif event in self.WINDOWS:
+            self._windows[self.WINDOWS[event]].add(1.0, at)
+            if event == "new-game" and record.get("game_type") is not None:
+                if record["game_type"] not in self._game_types:
+                    self._game_types[record["game_type"]] = RollingWindow(self._window_seconds, self._num_buckets)
+                self._game_types[record["game_type"]].add(float(record.get("players", 0)), at)
+
+    def expire_nodes(self, now: Optional[float] = None):
+        expire_time = (time.time() if now is None else now) - self.NODE_TTL
+        for node_id in [node_id for node_id, node in self._nodes.items() if node.get("time", 0) < expire_time]:
+            del self._nodes[node_id]
+
+    def stats(self, now: Optional[float] = None) -> Dict[str, Any]:
+        now = time.time() if now is None else now
+        self.expire_nodes(now)
+        windows = {name: window.snapshot(now) for name, window in self._windows.items()}
+        return {
+            "window_seconds": self._window_seconds,
+            "nodes": len(self._nodes),
+            "active_tables": sum(node.get("tables", 0) for node in self._nodes.values()),
+            "dropped_events": sum(node.get("dropped", 0) for node in self._nodes.values()),
+            "hands_per_minute": windows["hands"]["per_minute"],
+            "hands_started_per_minute": windows["hands_started"]["per_minute"],
+            "pot_average": windows["pots"]["average"],
+            "pot_max": windows["pots"]["max"],
+            "timeouts_per_minute": windows["timeouts"]["per_minute"],
+            "reconnects_per_minute": windows["reconnects"]["per_minute"],
+            "joins_per_minute": windows["joins"]["per_minute"],
+            "leaves_per_minute": windows["leaves"]["per_minute"],
+            "game_types": {
+                game_type: {
+                    "hands_per_minute": snapshot["per_minute"],
+                    "players_average": snapshot["average"]
+                }
+                for game_type, snapshot in ((name, window.snapshot(now)) for name, window in self._game_types.items())
+            }
+        }
+
+
+class GameEventReader:
+    """
+    Follows the game events stream from its end (every observer reads every event).
+    The stream is polled without blocking, as the process serves the stats in the meantime (not monkey-patched).
+    """
+    POLL_INTERVAL = 0.1
+    BATCH_SIZE = 500
+    RETRY_INTERVAL = 1
+
+    def __init__(self, redis: Redis, observer: GameObserver, logger=None, stream: str = GAME_EVENTS_STREAM):
+        self._redis: Redis = redis
+        self._observer: GameObserver = observer
+        self._stream: str = stream
+        self._logger = logger if logger else logging
+        # Id of the last entry read, the current end of the stream once read for the first time
+        self._last_id: Optional[str] = None
+
+    def read(self) -> int:
+        """Reads the next entries (without waiting), returns the number of entries read"""
+        if self._last_id is None:
+            last_entries = self._redis.xrevrange(self._stream, count=1)
+            self._last_id = last_entries[0][0] if last_entries else "0-0"
+        response = self._redis.xread({self._stream: self._last_id}, count=self.BATCH_SIZE)
+        read = 0
+        for _, entries in response or []:
+            for entry_id, fields in entries:
+                self._last_id = entry_id
+                read += 1
+                try:
+                    records = json.loads(fields[b"events"])
+                except (KeyError, ValueError):
+                    self._logger.error("Invalid entry {} in {}".format(entry_id, self._stream))
+                    continue
+                for record in records:
+                    try:
+                        self._observer.observe(record)
+                    except (KeyError, TypeError, ValueError):
+                        self._logger.error("Invalid game event {}".format(record))
+        return read
+
+    def run(self):
+        while True:
+            try:
+                if self.read() < self.BATCH_SIZE:
+                    gevent.sleep(self.POLL_INTERVAL)
+            except exceptions.RedisError as e:
+                self._logger.error("Unable to read {}: {}".format(self._stream, e.args[0]))
+                gevent.sleep(self.RETRY_INTERVAL)
+
+
+def create_metrics(observer: GameObserver) -> MetricsRegistry:
+    metrics = MetricsRegistry()
+    for name, key, description in (
+        ("poker_observer_active_tables", "active_tables", "Tables playing a hand"),
+        ("poker_observer_hands_per_minute", "hands_per_minute", "Hands played per minute"),
+        ("poker_observer_pot_average", "pot_average", "Average pot"),
+        ("poker_observer_pot_max", "pot_max", "Largest pot"),
+        ("poker_observer_timeouts_per_minute", "timeouts_per_minute", "Players dropped for not betting per minute"),
+        ("poker_observer_reconnects_per_minute", "reconnects_per_minute", "Players joining their room again per minute"),
+    ):
+        metrics.gauge(name, description).set_function(lambda key=key: observer.stats()[key])
+    return metrics
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG if 'DEBUG' in os.environ else logging.INFO)
+    logger = logging.getLogger()
+
+    observer = GameObserver(window_seconds=float(os.environ.get("OBSERVER_WINDOW", 300)))
+    reader = GameEventReader(create_redis(os.environ["REDIS_URL"]), observer, logger)
+
+    server = MetricsServer(
+        int(os.environ.get("PORT", 8000)),
+        host=os.environ.get("HOST", "127.0.0.1"),
+        metrics=create_metrics(observer),
+        logger=logger,
+        routes={"/stats": lambda query: ("application/json", json.dumps(observer.stats()).encode("utf-8"))}
+    )
+    server.start()
+
+    reading = gevent.spawn(reader.run)
+    gevent.signal_handler(signal.SIGTERM, reading.kill)
+    reading.join()
+    server.stop()
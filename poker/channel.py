@@ -37,8 +37,26 @@ class Channel:
     def recv_message(self, timeout_epoch: Optional[float] = None) -> Any:
         raise NotImplementedError
 
-    def send_message(self, message: Any):
+    def send_message(self, message: Any) -> Optional[int]:
+        """Sends a message and optionally returns the number of messages still waiting to be consumed remotely"""
         raise NotImplementedError
 
+    def outbound_backlog(self) -> int:
+        """Number of sent messages not consumed yet by the remote end (if known)"""
+        return 0
+
+    def heartbeat(self):
+        """Signals the remote end that this end is still alive"""
+        pass
+
+    def last_heartbeat(self) -> Optional[float]:
+        """Time of the last heartbeat received from the remote end (None if heartbeats are not supported)"""
+        return None
+
+    @property
+    def round_trips(self) -> int:
+        """Number of round trips to the message broker made so far (if counted)"""
+        return 0
+
     def close(self):
         pass
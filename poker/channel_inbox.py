@@ -0,0 +1,164 @@
+import logging
+import time
+from typing import Optional, Any, Dict
+
+import gevent
+import gevent.queue
+from redis import Redis
+
+from .channel import Channel, ChannelError, MessageTimeout
+from .channel_redis import MessageQueue
+
+
+class Inbox:
+    """
+    Single Redis queue receiving the messages of every session handled by a process.
+    Messages travel in envelopes (session id, sender inbox and payload) and are dispatched to the session channels
+    by a single poller greenlet.
+    """
+    BATCH_SIZE = 100
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, redis: Redis, name: str, logger=None):
+        self._redis: Redis = redis
+        self._queue: MessageQueue = MessageQueue(redis, name)
+        self._channels: Dict[str, "ChannelInbox"] = {}
+        self._poller: Optional[gevent.Greenlet] = None
+        self._logger = logger if logger else logging
+
+    @property
+    def name(self) -> str:
+        return self._queue.name
+
+    def open_channel(self, session_id: str, remote_inbox: Optional[str] = None) -> "ChannelInbox":
+        """
+        Channel of a session. Without a remote inbox, messages can't be sent until
+        the first message from the remote end is received.
+        """
+        channel = ChannelInbox(self, session_id, remote_inbox)
+        self._channels[session_id] = channel
+        if self._poller is None:
+            self._poller = gevent.spawn(self._poll)
+        return channel
+
+    def close_channel(self, session_id: str):
+        self._channels.pop(session_id, None)
+
+    def stop(self):
+        if self._poller is not None:
+            self._poller.kill()
+            self._poller = None
+
+    def envelope(self, session_id: str, **payload) -> Any:
+        envelope = {"session_id": session_id, "reply_to": self.name}
+        envelope.update(payload)
+        return envelope
+
+    def send(self, remote_inbox: str, session_id: str, **payload):
+        MessageQueue(self._redis, remote_inbox).push(self.envelope(session_id, **payload))
+
+    def pipeline_send(self, pipeline, remote_inbox: str, session_id: str, **payload):
+        MessageQueue(self._redis, remote_inbox).pipeline_push(pipeline, self.envelope(session_id, **payload))
+
+    def _poll(self):
+        while True:
+            try:
+                envelopes = self._queue.pop_many(self.BATCH_SIZE)
+            except ChannelError as e:
+                self._logger.error("Inbox {}: unable to receive messages: {}".format(self.name, e.args[0]))
+                gevent.sleep(1)
+                continue
+            for envelope in envelopes:
+                try:
+                    channel = self._channels.get(envelope["session_id"])
+                except (KeyError, TypeError):
+                    continue
+                if channel is not None:
+                    channel.deliver(envelope)
+            if len(envelopes) < self.BATCH_SIZE:
+                gevent.sleep(self.POLL_INTERVAL)
+
+
+class ChannelInbox(Channel):
+    """Session channel multiplexed over the inbox of each end"""
+    def __init__(self, inbox: Inbox, session_id: str, remote_inbox: Optional[str]):
+        self._inbox: Inbox = inbox
+        self._session_id: str = session_id
+        self._remote_inbox: Optional[str] = remote_inbox
+        self._messages = gevent.queue.Queue()
+        self._last_heartbeat: float = time.time()
+        self._closed: bool = False
+        # Messages are received by the poller of the inbox: sends only
+        self._round_trips: int = 0
+
+    @property
+    def session_id(self) -> str:
+        return self._session_id
+
+    @property
+    def round_trips(self) -> int:
+        return self._round_trips
+
+    @property
+    def remote_inbox(self) -> Optional[str]:
+        return self._remote_inbox
+
+    def deliver(self, envelope: Any):
+        # The remote end might have moved (room migrated to another game server)
+        self._remote_inbox = envelope.get("reply_to", self._remote_inbox)
+        if envelope.get("closed"):
+            self._last_heartbeat = 0.0
+            self._messages.put(ChannelError("Channel closed by the remote end"))
+            return
+        self._last_heartbeat = time.time()
+        if "message" in envelope:
+            self._messages.put(envelope["message"])
+
+    def _check_remote(self):
+        if self._closed:
+            raise ChannelError("Channel closed")
+        if self._remote_inbox is None:
+            raise ChannelError("Remote end unknown")
+
+    def send_message(self, message: Any):
+        self._check_remote()
+        self._round_trips += 1
+        self._inbox.send(self._remote_inbox, self._session_id, message=message)
+
+    def pipeline_send(self, pipeline, message: Any):
+        self._check_remote()
+        self._inbox.pipeline_send(pipeline, self._remote_inbox, self._session_id, message=message)
+
+    def recv_message(self, timeout_epoch: Optional[float] = None) -> Any:
+        if self._closed:
+            raise ChannelError("Channel closed")
+        try:
+            message = self._messages.get(timeout=None if timeout_epoch is None else max(0.0, timeout_epoch - time.time()))
+        except gevent.queue.Empty:
+            raise MessageTimeout("Timed out")
+        if isinstance(message, ChannelError):
+            raise message
+        return message
+
+    def heartbeat(self):
+        self._check_remote()
+        self._round_trips += 1
+        self._inbox.send(self._remote_inbox, self._session_id, heartbeat=True)
+
+    def last_heartbeat(self) -> float:
+        return self._last_heartbeat
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._inbox.close_channel(self._session_id)
+        if self._remote_inbox is not None:
+            # Letting the remote end know straight away that this end is gone
+            try:
+                self._inbox.send(self._remote_inbox, self._session_id, closed=True)
+            except ChannelError:
+                pass
+
+    def export(self) -> Dict:
+        return {"session_id": self._session_id, "remote_inbox": self._remote_inbox}
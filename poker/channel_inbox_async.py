@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Optional, Any, Dict, List
+
+from redis import exceptions
+from redis.asyncio import Redis
+
+from .channel import ChannelError, MessageTimeout
+
+
+class AsyncInbox:
+    """
+    asyncio counterpart of Inbox, speaking the same envelope protocol.
+    A single task waits on the inbox with blocking reads and dispatches the envelopes to the session channels,
+    and a single task sends the heartbeats of every session in one round trip: an idle session costs nothing but its queue.
+    """
+    BATCH_SIZE = 100
+    # Seconds a blocking read waits for messages
+    BLOCK_TIMEOUT = 1
+    HEARTBEAT_INTERVAL = 5
+
+    def __init__(self, redis: Redis, name: str, logger=None, expire: int = 300):
+        self._redis: Redis = redis
+        self._name: str = name
+        self._expire: int = expire
+        self._channels: Dict[str, "AsyncChannelInbox"] = {}
+        self._tasks: List[asyncio.Future] = []
+        self._logger = logger if logger else logging
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def __len__(self):
+        return len(self._channels)
+
+    def open_channel(self, session_id: str, remote_inbox: Optional[str] = None) -> "AsyncChannelInbox":
+        """
+        Channel of a session. Without a remote inbox, messages can't be sent until
+        the first message from the remote end is received.
+        """
+        channel = AsyncChannelInbox(self, session_id, remote_inbox)
+        self._channels[session_id] = channel
+        if not self._tasks:
+            self._tasks = [asyncio.ensure_future(self._poll()), asyncio.ensure_future(self._send_heartbeats())]
+        return channel
+
+    def close_channel(self, session_id: str):
+        self._channels.pop(session_id, None)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def envelope(self, session_id: str, **payload) -> Any:
+        envelope = {"session_id": session_id, "reply_to": self._name}
+        envelope.update(payload)
+        return envelope
+
+    async def push(self, queue_name: str, message: Any):
+        """Pushes a message to a Redis queue read by the game services (MessageQueue format)"""
+        try:
+            async with self._redis.pipeline(transaction=False) as pipeline:
+                pipeline.lpush(queue_name, json.dumps(message).encode("utf-8"))
+                pipeline.expire(queue_name, self._expire)
+                await pipeline.execute()
+        except exceptions.RedisError as e:
+            raise ChannelError(e.args[0])
+
+    async def send(self, remote_inbox: str, session_id: str, **payload):
+        await self.push(remote_inbox, self.envelope(session_id, **payload))
+
+    def _dispatch(self, response):
+        try:
+            envelope = json.loads(response)
+            channel = self._channels.get(envelope["session_id"])
+        except (KeyError, TypeError, ValueError):
+            return
+        if channel is not None:
+            channel.deliver(envelope)
+
+    async def _poll(self):
+        while True:
+            try:
+                response = await self._redis.brpop([self._name], timeout=self.BLOCK_TIMEOUT)
+                if response is None:
+                    continue
+                responses = [response[1]]
+                # Whatever else arrived in the meantime, without waiting
+                responses.extend(await self._redis.rpop(self._name, self.BATCH_SIZE) or [])
+            except exceptions.RedisError as e:
+                self._logger.error("Inbox {}: unable to receive messages: {}".format(self._name, e.args[0]))
+                await asyncio.sleep(1)
+                continue
+            for response in responses:
+                self._dispatch(response)
+
+    async def _send_heartbeats(self):
+        while True:
+            await asyncio.sleep(self.HEARTBEAT_INTERVAL)
+            channels = [channel for channel in self._channels.values() if channel.remote_inbox is not None]
+            if not channels:
+                continue
+            try:
+                async with self._redis.pipeline(transaction=False) as pipeline:
+                    for channel in channels:
+                        pipeline.lpush(
+                            channel.remote_inbox,
+                            json.dumps(self.envelope(channel.session_id, heartbeat=True)).encode("utf-8")
+                        )
+                        pipeline.expire(channel.remote_inbox, self._expire)
+                    await pipeline.execute(raise_on_error=False)
+            except exceptions.RedisError as e:
+                self._logger.error("Inbox {}: unable to send heartbeats: {}".format(self._name, e.args[0]))
+
+
+class AsyncChannelInbox:
+    """Session channel multiplexed over the inbox of each end (coroutine methods)"""
+    def __init__(self, inbox: AsyncInbox, session_id: str, remote_inbox: Optional[str]):
+        self._inbox: AsyncInbox = inbox
+        self._session_id: str = session_id
+        self._remote_inbox: Optional[str] = remote_inbox
+        self._messages: asyncio.Queue = asyncio.Queue()
+        self._last_heartbeat: float = time.time()
+        self._closed: bool = False
+
+    @property
+    def session_id(self) -> str:
+        return self._session_id
+
+    @property
+    def remote_inbox(self) -> Optional[str]:
+        return self._remote_inbox
+
+    def deliver(self, envelope: Any):
+        # The remote end might have moved (room migrated to another game server)
+        self._remote_inbox = envelope.get("reply_to", self._remote_inbox)
+        if envelope.get("closed"):
+            self._last_heartbeat = 0.0
+            self._messages.put_nowait(ChannelError("Channel closed by the remote end"))
+            return
+        self._last_heartbeat = time.time()
+        if "message" in envelope:
+            self._messages.put_nowait(envelope["message"])
+
+    def _check_remote(self):
+        if self._closed:
+            raise ChannelError("Channel closed")
+        if self._remote_inbox is None:
+            raise ChannelError("Remote end unknown")
+
+    async def send_message(self, message: Any):
+        self._check_remote()
+        await self._inbox.send(self._remote_inbox, self._session_id, message=message)
+
+    async def recv_message(self, timeout_epoch: Optional[float] = None) -> Any:
+        if self._closed:
+            raise ChannelError("Channel closed")
+        try:
+            message = await asyncio.wait_for(
+                self._messages.get(),
+                None if timeout_epoch is None else max(0.0, timeout_epoch - time.time())
+            )
+        except asyncio.TimeoutError:
+            raise MessageTimeout("Timed out")
+        if isinstance(message, ChannelError):
+            raise message
+        return message
+
+    def last_heartbeat(self) -> float:
+        return self._last_heartbeat
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._inbox.close_channel(self._session_id)
+        if self._remote_inbox is not None:
+            # Letting the remote end know straight away that this end is gone
+            try:
+                await self._inbox.send(self._remote_inbox, self._session_id, closed=True)
+            except ChannelError:
+                pass
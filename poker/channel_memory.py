@@ -0,0 +1,61 @@
+import time
+from typing import Optional, Any, Tuple
+
+import gevent.queue
+
+from .channel import Channel, ChannelError, MessageTimeout
+
+
+class ChannelMemory(Channel):
+    """
+    End of a channel between two greenlets of the same process.
+    Messages are handed over to the other end by reference (no serialization): they must not be modified once sent.
+    """
+    def __init__(self):
+        self._messages = gevent.queue.Queue()
+        self._remote: Optional[ChannelMemory] = None
+        self._last_heartbeat: float = time.time()
+        self._closed: bool = False
+
+    @staticmethod
+    def pair() -> Tuple["ChannelMemory", "ChannelMemory"]:
+        """Two connected ends"""
+        end1, end2 = ChannelMemory(), ChannelMemory()
+        end1._remote, end2._remote = end2, end1
+        return end1, end2
+
+    def send_message(self, message: Any) -> int:
+        if self._closed or self._remote._closed:
+            raise ChannelError("Unable to send data to the remote end (not connected)")
+        self._remote._messages.put(message)
+        return self._remote._messages.qsize()
+
+    def outbound_backlog(self) -> int:
+        return self._remote._messages.qsize()
+
+    def recv_message(self, timeout_epoch: Optional[float] = None) -> Any:
+        if self._closed:
+            raise ChannelError("Channel closed")
+        try:
+            message = self._messages.get(timeout=None if timeout_epoch is None else max(0.0, timeout_epoch - time.time()))
+        except gevent.queue.Empty:
+            raise MessageTimeout("Timed out")
+        if isinstance(message, ChannelError):
+            raise message
+        return message
+
+    def heartbeat(self):
+        if self._closed or self._remote._closed:
+            raise ChannelError("Unable to send data to the remote end (not connected)")
+        self._remote._last_heartbeat = time.time()
+
+    def last_heartbeat(self) -> float:
+        return self._last_heartbeat
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        # Waking up the remote end straight away
+        self._remote._last_heartbeat = 0.0
+        self._remote._messages.put(ChannelError("Channel closed by the remote end"))
@@ -1,7 +1,7 @@
 import json
 import signal
 import time
-from typing import Optional, Any
+from typing import Optional, Any, List, Dict
 
 import gevent
 from redis import exceptions, Redis
@@ -65,50 +65,151 @@ class RedisPubSub(Channel):
 
 
 class MessageQueue:
+    HEARTBEAT_EXPIRE = 60
+
     def __init__(self, redis: Redis, queue_name: str, expire: int = 300):
         self._redis: Redis = redis
         self._queue_name: str = queue_name
+        self._heartbeat_key: str = queue_name + ":heartbeat"
         self._expire: int = expire
+        self._round_trips: int = 0
 
     @property
     def name(self):
         return self._queue_name
 
-    def push(self, message: Any):
+    @property
+    def round_trips(self) -> int:
+        return self._round_trips
+
+    def push(self, message: Any) -> int:
+        self._round_trips += 1
+        try:
+            pipeline = self._redis.pipeline(transaction=False)
+            self.pipeline_push(pipeline, message)
+            # Number of messages in the queue
+            return pipeline.execute()[0]
+        except exceptions.RedisError as e:
+            raise ChannelError(e.args[0])
+
+    def pipeline_push(self, pipeline, message: Any):
+        """Adds the commands pushing a message to a pipeline (two commands)"""
         msg_serialized = json.dumps(message)
         msg_encoded = msg_serialized.encode("utf-8")
+        pipeline.lpush(self._queue_name, msg_encoded)
+        pipeline.expire(self._queue_name, self._expire)
+
+    def heartbeat(self):
+        """Signals the consumer that the producer is still alive"""
+        self._round_trips += 1
         try:
-            self._redis.lpush(self._queue_name, msg_encoded)
-            self._redis.expire(self._queue_name, self._expire)
+            self._redis.set(self._heartbeat_key, time.time(), ex=MessageQueue.HEARTBEAT_EXPIRE)
         except exceptions.RedisError as e:
             raise ChannelError(e.args[0])
 
+    def last_heartbeat(self) -> float:
+        self._round_trips += 1
+        try:
+            heartbeat = self._redis.get(self._heartbeat_key)
+        except exceptions.RedisError as e:
+            raise ChannelError(e.args[0])
+        return float(heartbeat) if heartbeat is not None else 0.0
+
+    def clear_heartbeat(self):
+        self._round_trips += 1
+        try:
+            self._redis.delete(self._heartbeat_key)
+        except exceptions.RedisError as e:
+            raise ChannelError(e.args[0])
+
+    def size(self) -> int:
+        self._round_trips += 1
+        try:
+            return self._redis.llen(self._queue_name)
+        except exceptions.RedisError as e:
+            raise ChannelError(e.args[0])
+
+    def pop_many(self, count: int) -> List[Any]:
+        """Pops up to count messages without waiting (requires Redis 6.2)"""
+        self._round_trips += 1
+        try:
+            responses = self._redis.rpop(self._queue_name, count)
+        except exceptions.RedisError as ex:
+            raise ChannelError(ex.args[0])
+        messages = []
+        for response in responses or []:
+            try:
+                messages.append(json.loads(response))
+            except ValueError:
+                # Invalid json: not letting it spoil the whole batch
+                pass
+        return messages
+
     def pop(self, timeout_epoch: Optional[float] = None) -> Any:
-        while timeout_epoch is None or time.time() < timeout_epoch:
+        # The queue is checked at least once, even when the timeout already expired
+        while True:
+            self._round_trips += 1
             try:
                 response = self._redis.rpop(self._queue_name)
-                if response is not None:
-                    try:
-                        # Deserialize and return the message
-                        return json.loads(response)
-                    except ValueError:
-                        # Invalid json
-                        raise MessageFormatError(desc="Unable to decode the JSON message")
-                else:
-                    # Context switching
-                    gevent.sleep(0.01)
             except exceptions.RedisError as ex:
                 raise ChannelError(ex.args[0])
-        raise MessageTimeout("Timed out")
+            if response is not None:
+                try:
+                    # Deserialize and return the message
+                    return json.loads(response)
+                except ValueError:
+                    # Invalid json
+                    raise MessageFormatError(desc="Unable to decode the JSON message")
+            if timeout_epoch is not None and time.time() >= timeout_epoch:
+                raise MessageTimeout("Timed out")
+            # Context switching
+            gevent.sleep(0.01)
 
 
 class ChannelRedis(Channel):
     def __init__(self, redis: Redis, channel_in: str, channel_out: str):
         self._queue_in = MessageQueue(redis, channel_in)
         self._queue_out = MessageQueue(redis, channel_out)
+        self._heartbeat_sent: bool = False
+
+    @property
+    def channel_in(self) -> str:
+        return self._queue_in.name
+
+    @property
+    def channel_out(self) -> str:
+        return self._queue_out.name
+
+    def export(self) -> Dict:
+        return {"channel_in": self.channel_in, "channel_out": self.channel_out}
 
-    def send_message(self, message: Any):
-        self._queue_out.push(message)
+    def send_message(self, message: Any) -> int:
+        return self._queue_out.push(message)
+
+    def pipeline_send(self, pipeline, message: Any):
+        self._queue_out.pipeline_push(pipeline, message)
+
+    def outbound_backlog(self) -> int:
+        return self._queue_out.size()
+
+    def heartbeat(self):
+        self._queue_out.heartbeat()
+        self._heartbeat_sent = True
+
+    def last_heartbeat(self) -> float:
+        return self._queue_in.last_heartbeat()
+
+    def close(self):
+        if self._heartbeat_sent:
+            # Letting the remote end know straight away that this end is gone
+            try:
+                self._queue_out.clear_heartbeat()
+            except ChannelError:
+                pass
 
     def recv_message(self, timeout_epoch: Optional[float] = None) -> Any:
         return self._queue_in.pop(timeout_epoch)
+
+    @property
+    def round_trips(self) -> int:
+        return self._queue_in.round_trips + self._queue_out.round_trips
@@ -0,0 +1,249 @@
+import collections
+import json
+import time
+from typing import Optional, Any, List, Tuple, Deque, Dict
+
+import gevent
+from redis import exceptions, Redis
+
+from .channel import Channel, MessageFormatError, MessageTimeout, ChannelError
+
+
+class MessageStream:
+    """
+    Redis stream read through a consumer group: messages stay pending until acknowledged,
+    and the pending messages of a crashed consumer can be claimed by another one.
+    The stream is trimmed by length or, if a maximum age is given, by time.
+    """
+    GROUP = "poker5"
+    MAX_LENGTH = 1000
+    # Milliseconds after which messages pending for another consumer are claimed
+    CLAIM_IDLE_TIME = 30000
+
+    def __init__(self, redis: Redis, stream_name: str, max_length: Optional[int] = None,
+                 max_age: Optional[float] = None, expire: int = 300):
+        self._redis: Redis = redis
+        self._stream_name: str = stream_name
+        self._max_length: int = self.MAX_LENGTH if max_length is None else max_length
+        self._max_age: Optional[float] = max_age
+        self._expire: int = expire
+        self._group_created: bool = False
+        self._round_trips: int = 0
+
+    @property
+    def name(self) -> str:
+        return self._stream_name
+
+    @property
+    def round_trips(self) -> int:
+        return self._round_trips
+
+    def push(self, message: Any) -> str:
+        msg_encoded = json.dumps(message).encode("utf-8")
+        if self._max_age is not None:
+            trimming = {"minid": "{}-0".format(int((time.time() - self._max_age) * 1000))}
+        else:
+            trimming = {"maxlen": self._max_length}
+        self._round_trips += 1
+        try:
+            pipeline = self._redis.pipeline(transaction=False)
+            pipeline.xadd(self._stream_name, {"data": msg_encoded}, approximate=True, **trimming)
+            pipeline.expire(self._stream_name, self._expire)
+            return self._decode(pipeline.execute()[0])
+        except exceptions.RedisError as e:
+            raise ChannelError(e.args[0])
+
+    def read(self, consumer: str, count: int, pending: bool = False) -> List[Tuple[str, Any]]:
+        """
+        Reads up to count new messages (or the messages already delivered to the consumer and not acknowledged)
+        in a single round trip, without blocking.
+        """
+        response = self._group_command(
+            lambda: self._redis.xreadgroup(
+                self.GROUP, consumer, {self._stream_name: "0" if pending else ">"}, count=count
+            )
+        )
+        return [entry for _, entries in response or [] for entry in self._decode_entries(entries)]
+
+    def claim(self, consumer: str, count: int) -> List[Tuple[str, Any]]:
+        """Takes over the messages left pending by other consumers for too long"""
+        response = self._group_command(
+            lambda: self._redis.xautoclaim(
+                self._stream_name, self.GROUP, consumer, self.CLAIM_IDLE_TIME, count=count
+            )
+        )
+        return self._decode_entries(response[1])
+
+    def ack(self, *message_ids: str):
+        if not message_ids:
+            return
+        self._round_trips += 1
+        try:
+            self._redis.xack(self._stream_name, self.GROUP, *message_ids)
+        except exceptions.RedisError as e:
+            raise ChannelError(e.args[0])
+
+    def read_after(self, position: str, count: int) -> List[Tuple[str, Any]]:
+        """Messages following the given position, regardless of the consumer group (catch-up reads)"""
+        self._round_trips += 1
+        try:
+            entries = self._redis.xrange(self._stream_name, "({}".format(position), "+", count=count)
+        except exceptions.RedisError as e:
+            raise ChannelError(e.args[0])
+        return self._decode_entries(entries)
+
+    def _group_command(self, command):
+        """
+        Runs a consumer group command, creating the group first if needed.
+        The group lives in the stream key, which expires once nothing has been pushed for a while:
+        the group is then created again.
+        """
+        self._create_group()
+        for attempt in range(2):
+            self._round_trips += 1
+            try:
+                return command()
+            except exceptions.ResponseError as e:
+                if "NOGROUP" not in str(e) or attempt > 0:
+                    raise ChannelError(e.args[0])
+                self._group_created = False
+                self._create_group()
+            except exceptions.RedisError as e:
+                raise ChannelError(e.args[0])
+
+    def _create_group(self):
+        if self._group_created:
+            return
+        self._round_trips += 1
+        try:
+            # Messages sent before the group was created are delivered too
+            self._redis.xgroup_create(self._stream_name, self.GROUP, id="0", mkstream=True)
+        except exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise ChannelError(e.args[0])
+        except exceptions.RedisError as e:
+            raise ChannelError(e.args[0])
+        self._group_created = True
+
+    def _decode_entries(self, entries) -> List[Tuple[str, Any]]:
+        messages = []
+        for message_id, fields in entries or []:
+            if not fields:
+                # Trimmed while pending
+                continue
+            try:
+                data = fields.get(b"data", fields.get("data"))
+                messages.append((self._decode(message_id), json.loads(data)))
+            except (TypeError, ValueError):
+                raise MessageFormatError(desc="Unable to decode the JSON message")
+        return messages
+
+    @staticmethod
+    def _decode(value) -> str:
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class ChannelRedisStream(Channel):
+    """
+    Channel backed by Redis streams, delivering messages at least once:
+    a message is acknowledged only when the next one is requested, so that messages received by a consumer
+    crashing in the meantime are delivered again.
+    """
+    BATCH_SIZE = 100
+    POLL_INTERVAL = 0.01
+    HEARTBEAT_EXPIRE = 60
+
+    def __init__(self, redis: Redis, stream_in: str, stream_out: str, consumer: str,
+                 max_length: Optional[int] = None, max_age: Optional[float] = None):
+        self._redis: Redis = redis
+        self._stream_in = MessageStream(redis, stream_in, max_length, max_age)
+        self._stream_out = MessageStream(redis, stream_out, max_length, max_age)
+        self._consumer: str = consumer
+        self._received: Deque[Tuple[str, Any]] = collections.deque()
+        # Message returned by the last recv_message call, acknowledged on the following call
+        self._unacked: Optional[str] = None
+        self._position: Optional[str] = None
+        self._recovered: bool = False
+        self._heartbeat_sent: bool = False
+        # Round trips made by the channel itself (heartbeats)
+        self._round_trips: int = 0
+
+    @property
+    def round_trips(self) -> int:
+        return self._round_trips + self._stream_in.round_trips + self._stream_out.round_trips
+
+    @property
+    def position(self) -> Optional[str]:
+        """Id of the last message received, to be used for catch-up reads"""
+        return self._position
+
+    def send_message(self, message: Any):
+        self._stream_out.push(message)
+
+    def recv_message(self, timeout_epoch: Optional[float] = None) -> Any:
+        if self._unacked is not None:
+            self._stream_in.ack(self._unacked)
+            self._unacked = None
+
+        while not self._received:
+            self._received.extend(self._read())
+            if self._received:
+                break
+            if timeout_epoch is not None and time.time() >= timeout_epoch:
+                raise MessageTimeout("Timed out")
+            # Context switching
+            gevent.sleep(self.POLL_INTERVAL)
+
+        message_id, message = self._received.popleft()
+        self._unacked = self._position = message_id
+        return message
+
+    def catch_up(self, position: str) -> List[Any]:
+        """Messages received after the given position (acknowledged or not)"""
+        messages = []
+        while True:
+            entries = self._stream_in.read_after(position, self.BATCH_SIZE)
+            messages.extend(message for _, message in entries)
+            if len(entries) < self.BATCH_SIZE:
+                return messages
+            position = entries[-1][0]
+
+    def _read(self) -> List[Tuple[str, Any]]:
+        if not self._recovered:
+            self._recovered = True
+            # Messages delivered before a crash, or left behind by a previous consumer
+            recovered = self._stream_in.read(self._consumer, self.BATCH_SIZE, pending=True)
+            recovered.extend(self._stream_in.claim(self._consumer, self.BATCH_SIZE))
+            if recovered:
+                return recovered
+        return self._stream_in.read(self._consumer, self.BATCH_SIZE)
+
+    def heartbeat(self):
+        self._round_trips += 1
+        try:
+            self._redis.set(self._stream_out.name + ":heartbeat", time.time(), ex=self.HEARTBEAT_EXPIRE)
+        except exceptions.RedisError as e:
+            raise ChannelError(e.args[0])
+        self._heartbeat_sent = True
+
+    def last_heartbeat(self) -> float:
+        self._round_trips += 1
+        try:
+            heartbeat = self._redis.get(self._stream_in.name + ":heartbeat")
+        except exceptions.RedisError as e:
+            raise ChannelError(e.args[0])
+        return float(heartbeat) if heartbeat is not None else 0.0
+
+    def close(self):
+        try:
+            if self._unacked is not None:
+                self._stream_in.ack(self._unacked)
+                self._unacked = None
+            if self._heartbeat_sent:
+                # Letting the remote end know straight away that this end is gone
+                self._redis.delete(self._stream_out.name + ":heartbeat")
+        except (ChannelError, exceptions.RedisError):
+            pass
+
+    def export(self) -> Dict:
+        return {"stream_in": self._stream_in.name, "stream_out": self._stream_out.name}
@@ -9,12 +9,42 @@ from .channel import Channel, ChannelError, MessageFormatError, MessageTimeout
 
 
 class ChannelWebSocket(Channel):
-    def __init__(self, ws: WebSocket):
+    # Seconds without a pong or a message after which the client is considered gone (half-open sockets)
+    PONG_TIMEOUT = 15
+
+    def __init__(self, ws: WebSocket, pong_timeout: Optional[float] = None):
         self._ws: WebSocket = ws
+        self._pong_timeout: float = self.PONG_TIMEOUT if pong_timeout is None else pong_timeout
+        self._last_seen: float = time.time()
+        # Pongs are read along with the messages, by whoever is receiving
+        handle_pong = ws.handle_pong
+
+        def pong_handler(header, payload):
+            self._last_seen = time.time()
+            handle_pong(header, payload)
+
+        ws.handle_pong = pong_handler
+
+    @property
+    def last_seen(self) -> float:
+        return self._last_seen
 
     def close(self):
         self._ws.close()
 
+    def heartbeat(self):
+        if self._ws.closed:
+            raise ChannelError("Unable to send data to the remote host (not connected)")
+
+        if time.time() - self._last_seen > self._pong_timeout:
+            raise ChannelError("No pong received from the remote host for {} seconds".format(self._pong_timeout))
+
+        try:
+            # Websocket level ping: the browser answers without involving the client application
+            self._ws.send_frame(b"", WebSocket.OPCODE_PING)
+        except:
+            raise ChannelError("Unable to send data to the remote host")
+
     def send_message(self, message: Any):
         if self._ws.closed:
             raise ChannelError("Unable to send data to the remote host (not connected)")
@@ -43,6 +73,7 @@ class ChannelWebSocket(Channel):
 
         if not message:
             raise ChannelError("Unable to receive data from the remote host (message was empty)")
+        self._last_seen = time.time()
         try:
             # Deserialize and return the message
             return json.loads(message)
@@ -0,0 +1,212 @@
+import logging
+import time
+from typing import Any, Optional, Set, List, Tuple
+
+import gevent
+from redis import exceptions, Redis
+
+from .channel_redis import MessageQueue
+from .game_room import GameRoomSubscriber
+
+
+class GameClusterRegistry(GameRoomSubscriber):
+    """
+    Cluster-wide registry of the rooms (owning node) and of the seated players (room), stored in Redis hashes.
+    Every node holds a lease renewed by a heartbeat: rooms of a node whose lease expired can be claimed by other nodes.
+    Connection requests for rooms owned by another node are forwarded to that node inbox.
+    """
+    LEASE_TTL = 15
+    HEARTBEAT_INTERVAL = 5
+    # Connection requests bouncing between nodes (ownership changing in the meantime) are eventually handled locally
+    MAX_FORWARDS = 3
+    # Seconds between two removals of the rooms and players left behind by dead nodes
+    PRUNE_INTERVAL = 60
+    PRUNE_BATCH_SIZE = 500
+
+    # Returns the room owner, claiming the room if it's free or if its owner lease expired
+    CLAIM_ROOM_SCRIPT = """
+        local owner = redis.call('HGET', KEYS[1], ARGV[1])
+        if owner and owner ~= ARGV[2] and redis.call('EXISTS', ARGV[3] .. owner) == 1 then
+            return owner
+        end
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+        return ARGV[2]
+    """
+
+    # Returns the live node owning the room of a player
+    PLAYER_NODE_SCRIPT = """
+        local room_id = redis.call('HGET', KEYS[2], ARGV[1])
+        if not room_id then
+            return false
+        end
+        local owner = redis.call('HGET', KEYS[1], room_id)
+        if owner and redis.call('EXISTS', ARGV[2] .. owner) == 1 then
+            return owner
+        end
+        return false
+    """
+
+    # Deletes a hash field only if it holds the given value
+    COMPARE_DELETE_SCRIPT = """
+        if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+            return redis.call('HDEL', KEYS[1], ARGV[1])
+        end
+        return 0
+    """
+
+    def __init__(self, redis: Redis, cluster_name: str, node_id: str, logger=None):
+        self._redis: Redis = redis
+        self._node_id: str = node_id
+        self._rooms_key: str = "{}:rooms".format(cluster_name)
+        self._players_key: str = "{}:players".format(cluster_name)
+        # Sorted set of the nodes, scored by lease expiry time
+        self._nodes_key: str = "{}:nodes".format(cluster_name)
+        self._lease_prefix: str = "{}:node:".format(cluster_name)
+        self._inbox_format: str = "{}:node:{{}}:inbox".format(cluster_name)
+        self._inbox: MessageQueue = MessageQueue(redis, self._inbox_format.format(node_id))
+        self._claim_room = redis.register_script(self.CLAIM_ROOM_SCRIPT)
+        self._player_node = redis.register_script(self.PLAYER_NODE_SCRIPT)
+        self._compare_delete = redis.register_script(self.COMPARE_DELETE_SCRIPT)
+        self._owned_rooms: Set[str] = set()
+        self._heartbeat: Optional[gevent.Greenlet] = None
+        self._logger = logger if logger else logging
+
+    @property
+    def node_id(self) -> str:
+        return self._node_id
+
+    @property
+    def inbox(self) -> MessageQueue:
+        return self._inbox
+
+    def start(self):
+        self.renew_lease()
+        self._heartbeat = gevent.spawn(self._renew_lease_periodically)
+
+    def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.kill()
+            self._heartbeat = None
+        try:
+            for room_id in list(self._owned_rooms):
+                self.release_room(room_id)
+            self._redis.delete(self._lease_prefix + self._node_id)
+            self._redis.zrem(self._nodes_key, self._node_id)
+        except exceptions.RedisError as e:
+            self._logger.error("Node {}: unable to leave the cluster: {}".format(self._node_id, e.args[0]))
+
+    def renew_lease(self):
+        pipeline = self._redis.pipeline(transaction=False)
+        pipeline.set(self._lease_prefix + self._node_id, 1, ex=self.LEASE_TTL)
+        pipeline.zadd(self._nodes_key, {self._node_id: time.time() + self.LEASE_TTL})
+        pipeline.execute()
+
+    def live_nodes(self) -> List[str]:
+        """Ids of the nodes holding a valid lease"""
+        now = time.time()
+        pipeline = self._redis.pipeline(transaction=False)
+        pipeline.zremrangebyscore(self._nodes_key, "-inf", now)
+        pipeline.zrangebyscore(self._nodes_key, now, "+inf")
+        return [self._decode(node_id) for node_id in pipeline.execute()[1]]
+
+    def claim_room(self, room_id: str) -> str:
+        """Returns the node owning the room, which is this node if the room was free"""
+        owner = self._decode(self._claim_room(
+            keys=[self._rooms_key],
+            args=[room_id, self._node_id, self._lease_prefix]
+        ))
+        if owner == self._node_id:
+            self._owned_rooms.add(room_id)
+        return owner
+
+    def prune(self) -> int:
+        """
+        Removes the rooms owned by nodes whose lease expired, and the players seated in rooms no longer registered.
+        Entries are deleted only if unchanged since they were read. Returns the number of entries removed.
+        """
+        live_nodes = set(self.live_nodes())
+        removed = 0
+        for room_id, owner in self._redis.hscan_iter(self._rooms_key, count=self.PRUNE_BATCH_SIZE):
+            if self._decode(owner) not in live_nodes:
+                removed += self._compare_delete(keys=[self._rooms_key], args=[room_id, owner])
+
+        # Rooms read after the players: rooms are registered before their players
+        seats = []
+        for seat in self._redis.hscan_iter(self._players_key, count=self.PRUNE_BATCH_SIZE):
+            seats.append(seat)
+            if len(seats) >= self.PRUNE_BATCH_SIZE:
+                removed += self._prune_players(seats, live_nodes)
+                seats = []
+        if seats:
+            removed += self._prune_players(seats, live_nodes)
+        return removed
+
+    def _prune_players(self, seats: List[Tuple[Any, Any]], live_nodes: Set[str]) -> int:
+        owners = self._redis.hmget(self._rooms_key, [room_id for _, room_id in seats])
+        removed = 0
+        for (player_id, room_id), owner in zip(seats, owners):
+            if owner is None or self._decode(owner) not in live_nodes:
+                removed += self._compare_delete(keys=[self._players_key], args=[player_id, room_id])
+        return removed
+
+    def release_room(self, room_id: str):
+        self._owned_rooms.discard(room_id)
+        self._compare_delete(keys=[self._rooms_key], args=[room_id, self._node_id])
+
+    def route(self, message: Any) -> Optional[str]:
+        """Returns the node which should handle a connection request, None if it should be handled locally"""
+        if message.get("forwards", 0) >= self.MAX_FORWARDS:
+            return None
+
+        try:
+            room_id = message.get("room_id")
+            if room_id is not None:
+                owner = self.claim_room(str(room_id))
+            else:
+                # Players are sent back to the node running their public room
+                owner = self._decode(self._player_node(
+                    keys=[self._rooms_key, self._players_key],
+                    args=[str(message["player"]["id"]), self._lease_prefix]
+                ))
+        except (KeyError, TypeError):
+            # Invalid messages are rejected locally
+            return None
+        except exceptions.RedisError as e:
+            self._logger.error("Node {}: unable to route the connection: {}".format(self._node_id, e.args[0]))
+            return None
+
+        return None if owner is None or owner == self._node_id else owner
+
+    def forward(self, message: Any, node_id: str):
+        message["forwards"] = message.get("forwards", 0) + 1
+        MessageQueue(self._redis, self._inbox_format.format(node_id)).push(message)
+
+    def room_event(self, room_id: str, event: str, player_id: str):
+        try:
+            if event in ("player-added", "player-rejoined"):
+                self._redis.hset(self._players_key, player_id, room_id)
+            elif event == "player-removed":
+                self._compare_delete(keys=[self._players_key], args=[player_id, room_id])
+        except exceptions.RedisError as e:
+            self._logger.error("Node {}: unable to update player {}: {}".format(self._node_id, player_id, e.args[0]))
+
+    def _renew_lease_periodically(self):
+        pruned_at = time.time()
+        while True:
+            gevent.sleep(self.HEARTBEAT_INTERVAL)
+            try:
+                self.renew_lease()
+            except exceptions.RedisError as e:
+                self._logger.error("Node {}: unable to renew the lease: {}".format(self._node_id, e.args[0]))
+            if time.time() - pruned_at >= self.PRUNE_INTERVAL:
+                pruned_at = time.time()
+                try:
+                    removed = self.prune()
+                    if removed:
+                        self._logger.info("Node {}: {} stale entries removed".format(self._node_id, removed))
+                except exceptions.RedisError as e:
+                    self._logger.error("Node {}: unable to prune the registry: {}".format(self._node_id, e.args[0]))
+
+    @staticmethod
+    def _decode(value) -> Optional[str]:
+        return value.decode("utf-8") if isinstance(value, bytes) else value
@@ -0,0 +1,112 @@
+import collections
+import json
+import logging
+import time
+import uuid
+from typing import Any, Deque, Dict, List, Optional, Set
+
+import gevent
+from redis import exceptions, Redis
+
+from .game_room import GameRoomSubscriber
+from .poker_game import GameSubscriber
+
+# Stream read by the observers (observer.py): one entry per batch of events, of every game node
+GAME_EVENTS_STREAM = "poker5:game-events"
+
+
+class GameEventPublisher(GameSubscriber, GameRoomSubscriber):
+    """
+    Publishes a summary of the game and room events of a node to a capped Redis stream, for the observers.
+    Events are only buffered on the game path: a greenlet writes them in batches (one stream entry per batch),
+    along with the number of tables playing a hand, so the cost of the game path doesn't depend on the observers.
+    The oldest events are dropped if Redis can't keep up.
+    """
+    FLUSH_INTERVAL = 1
+    MAX_PENDING = 10000
+    # Entries kept in the stream (approximately)
+    STREAM_MAX_LENGTH = 10000
+
+    ROOM_EVENTS = {"player-added", "player-removed", "player-rejoined"}
+
+    def __init__(self, redis: Redis, cluster_name: str, logger=None, node_id: Optional[str] = None,
+                 stream: str = GAME_EVENTS_STREAM):
+        self._redis: Redis = redis
+        self._node_id: str = str(uuid.uuid4()) if node_id is None else node_id
+        self._cluster_name: str = cluster_name
+        self._stream: str = stream
+        self._logger = logger if logger else logging
+        self._pending: Deque[Dict[str, Any]] = collections.deque(maxlen=self.MAX_PENDING)
+        # Games started and not over yet
+        self._games: Set[str] = set()
+        self._dropped: int = 0
+        self._flusher: Optional[gevent.Greenlet] = None
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped
+
+    def game_event(self, event, event_data):
+        record = self._summary(event, event_data)
+        if record is not None:
+            self._push(record)
+
+    def room_event(self, room_id: str, event: str, player_id: str):
+        if event in self.ROOM_EVENTS:
+            self._push({"event": event})
+
+    def _summary(self, event: str, event_data: Dict) -> Optional[Dict[str, Any]]:
+        if event == "new-game":
+            self._games.add(event_data["game_id"])
+            return {"event": event, "game_type": event_data.get("game_type"), "players": len(event_data["players"])}
+        elif event == "game-over":
+            self._games.discard(event_data["game_id"])
+            return {"event": event}
+        elif event == "winner-designation":
+            return {"event": event, "pot": event_data["pot"]["money"]}
+        elif event == "dead-player":
+            return {"event": event}
+        return None
+
+    def _push(self, record: Dict[str, Any]):
+        if len(self._pending) == self._pending.maxlen:
+            self._dropped += 1
+        record["time"] = time.time()
+        self._pending.append(record)
+
+    def flush(self):
+        records: List[Dict[str, Any]] = list(self._pending)
+        self._pending.clear()
+        records.append({
+            "event": "node",
+            "node": self._node_id,
+            "cluster": self._cluster_name,
+            "tables": len(self._games),
+            "dropped": self._dropped,
+            "time": time.time()
+        })
+        try:
+            self._redis.xadd(
+                self._stream,
+                {"events": json.dumps(records)},
+                maxlen=self.STREAM_MAX_LENGTH,
+                approximate=True
+            )
+        except exceptions.RedisError as e:
+            self._dropped += len(records) - 1
+            self._logger.error("Unable to publish {} game events: {}".format(len(records) - 1, e.args[0]))
+
+    def _flush_periodically(self):
+        while True:
+            gevent.sleep(self.FLUSH_INTERVAL)
+            self.flush()
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = gevent.spawn(self._flush_periodically)
+
+    def stop(self):
+        if self._flusher is not None:
+            self._flusher.kill()
+            self._flusher = None
+        self.flush()
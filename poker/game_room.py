@@ -1,10 +1,23 @@
 import threading
+import time
 from typing import Dict, List, Optional
 
 import gevent
+import gevent.lock
 
+from .metrics import registry
 from .player_server import PlayerServer
-from .poker_game import GameSubscriber, GameError, GameFactory
+from .poker_game import GameSubscriber, GameError, GameFactory, GamePacer
+from .profiling import accounting, approximate_size
+from .structured_log import LogPayload
+
+HANDS_STARTED = registry.counter("poker_hands_started_total", "Hands started", ["game"])
+HANDS_FINISHED = registry.counter("poker_hands_finished_total", "Hands played until the end", ["game"])
+REDIS_ROUND_TRIPS_PER_HAND = registry.histogram(
+    "poker_redis_round_trips_per_hand", "Redis round trips made by the player channels of a room during a hand",
+    buckets=(10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+)
+RECONNECTS = registry.counter("poker_reconnects_total", "Players joining again the room they were seated in")
 
 
 class FullGameRoomException(Exception):
@@ -19,6 +32,11 @@ class UnknownRoomPlayerException(Exception):
     pass
 
 
+class GameRoomSubscriber:
+    def room_event(self, room_id: str, event: str, player_id: str):
+        raise NotImplemented
+
+
 class GameRoomPlayers:
     def __init__(self, room_size: int):
         self._seats: List[Optional[str]] = [None] * room_size
@@ -33,6 +51,18 @@ class GameRoomPlayers:
         finally:
             self._lock.release()
 
+    @property
+    def free_seats(self) -> int:
+        self._lock.acquire()
+        try:
+            return self._seats.count(None)
+        finally:
+            self._lock.release()
+
+    @property
+    def empty(self) -> bool:
+        return not self._players
+
     @property
     def seats(self) -> List[Optional[str]]:
         self._lock.acquire()
@@ -50,19 +80,19 @@ class GameRoomPlayers:
         finally:
             self._lock.release()
 
-    def add_player(self, player: PlayerServer):
+    def add_player(self, player: PlayerServer, seat: Optional[int] = None):
         self._lock.acquire()
         try:
             if player.id in self._players:
                 raise DuplicateRoomPlayerException
 
-            try:
-                free_seat = self._seats.index(None)
-            except ValueError:
-                raise FullGameRoomException
-            else:
-                self._seats[free_seat] = player.id
-                self._players[player.id] = player
+            if seat is None or seat >= len(self._seats) or self._seats[seat] is not None:
+                try:
+                    seat = self._seats.index(None)
+                except ValueError:
+                    raise FullGameRoomException
+            self._seats[seat] = player.id
+            self._players[player.id] = player
         finally:
             self._lock.release()
 
@@ -84,19 +114,28 @@ class GameRoomEventHandler:
         self._room_players: GameRoomPlayers = room_players
         self._room_id: str = room_id
         self._logger = logger
+        self._subscribers: List[GameRoomSubscriber] = []
+
+    def subscribe(self, subscriber: GameRoomSubscriber):
+        self._subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber: GameRoomSubscriber):
+        self._subscribers.remove(subscriber)
+
+    def notify(self, event, player_id):
+        """Notifies the subscribers only, without broadcasting the event to the players"""
+        for subscriber in self._subscribers:
+            subscriber.room_event(self._room_id, event, player_id)
 
     def room_event(self, event, player_id):
-        self._logger.debug(
-            "\n" +
-            ("-" * 80) + "\n"
-            "ROOM: {}\nEVENT: {}\nPLAYER: {}\nSEATS:\n - {}".format(
-                self._room_id,
-                event,
-                player_id,
-                "\n - ".join([seat if seat is not None else "(empty seat)" for seat in self._room_players.seats])
-            ) + "\n" +
-            ("-" * 80) + "\n"
-        )
+        self._logger.debug(LogPayload(
+            room=self._room_id,
+            event=event,
+            player=player_id,
+            seats=lambda: "\n - " + "\n - ".join(
+                [seat if seat is not None else "(empty seat)" for seat in self._room_players.seats]
+            )
+        ))
         self.broadcast({
             "message_type": "room-update",
             "event": event,
@@ -105,6 +144,7 @@ class GameRoomEventHandler:
             "player_ids": self._room_players.seats,
             "player_id": player_id
         })
+        self.notify(event, player_id)
 
     def broadcast(self, message):
         for player in self._room_players.players:
@@ -112,20 +152,106 @@ class GameRoomEventHandler:
 
 
 class GameRoom(GameSubscriber):
-    def __init__(self, id: str, private: bool, game_factory: GameFactory, room_size: int, logger):
+    # Seconds without any sign of life before a player is removed from the room
+    PLAYER_TIMEOUT = 20
+    REAP_INTERVAL = 5
+
+    def __init__(self, id: str, private: bool, game_factory: GameFactory, room_size: int, logger, pacer: Optional[GamePacer] = None):
         self.id = id
         self.private = private
         self.active = False
+        # Draining rooms stop as soon as the current hand is over
+        self._draining: bool = False
+        self._dealer_key: int = -1
         self._game_factory = game_factory
+        self._pacer: Optional[GamePacer] = pacer
         self._room_players = GameRoomPlayers(room_size)
         self._room_event_handler = GameRoomEventHandler(self._room_players, self.id, logger)
         self._event_messages = []
+        # Game being played, if any
+        self._game = None
+        self._last_activity: float = time.time()
         self._logger = logger
-        self._lock = threading.Lock()
+        # Players disconnection might yield to other greenlets while holding the lock
+        self._lock = gevent.lock.RLock()
+
+    @property
+    def free_seats(self) -> int:
+        return self._room_players.free_seats
+
+    @property
+    def players(self) -> List[PlayerServer]:
+        return self._room_players.players
+
+    @property
+    def draining(self) -> bool:
+        return self._draining
+
+    def drain(self):
+        self._draining = True
+
+    def export_state(self) -> Dict:
+        """Seats, stacks and dealer position needed to resume the room somewhere else"""
+        self._lock.acquire()
+        try:
+            return {
+                "room_id": self.id,
+                "private": self.private,
+                "dealer_key": self._dealer_key,
+                "player_ids": self._room_players.seats,
+                "players": {player.id: player.dto() for player in self._room_players.players}
+            }
+        finally:
+            self._lock.release()
+
+    def restore_state(self, state: Dict, players: Dict[str, PlayerServer]):
+        """Seats the players of an exported room at their former seats"""
+        self._lock.acquire()
+        try:
+            self._last_activity = time.time()
+            self._dealer_key = state["dealer_key"]
+            for seat, player_id in enumerate(state["player_ids"]):
+                if player_id is None:
+                    continue
+                player = players[player_id]
+                try:
+                    self._room_players.add_player(player, seat)
+                except DuplicateRoomPlayerException:
+                    # Joined again in the meantime
+                    self._room_players.get_player(player_id).update_channel(player)
+                except FullGameRoomException:
+                    self._logger.error("Room {}: no seat left for {}".format(self.id, player))
+                    player.disconnect()
+                    continue
+                # Players are not told about the move: subscribers only
+                self._room_event_handler.notify("player-rejoined", player_id)
+        finally:
+            self._lock.release()
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Approximate bytes held by the players (with their outboxes), the event log and the scores of the hand"""
+        game = self._game
+        scores = getattr(game, "scores", None)
+        return {
+            "players": approximate_size(self._room_players.players),
+            "event_log": approximate_size(self._event_messages),
+            "scores": approximate_size(scores) if scores is not None else 0
+        }
+
+    def is_idle(self, ttl: float) -> bool:
+        """True if the room has been empty and inactive for more than ttl seconds"""
+        return not self.active and self._room_players.empty and time.time() - self._last_activity > ttl
+
+    def subscribe(self, subscriber: GameRoomSubscriber):
+        self._room_event_handler.subscribe(subscriber)
+
+    def unsubscribe(self, subscriber: GameRoomSubscriber):
+        self._room_event_handler.unsubscribe(subscriber)
 
     def join(self, player):
         self._lock.acquire()
         try:
+            self._last_activity = time.time()
             try:
                 self._room_players.add_player(player)
                 self._room_event_handler.room_event("player-added", player.id)
@@ -134,6 +260,7 @@ class GameRoom(GameSubscriber):
                 old_player.update_channel(player)
                 player = old_player
                 self._room_event_handler.room_event("player-rejoined", player.id)
+                RECONNECTS.inc()
 
             for event_message in self._event_messages:
                 if "target" not in event_message or event_message["target"] == player.id:
@@ -149,6 +276,7 @@ class GameRoom(GameSubscriber):
             self._lock.release()
 
     def _leave(self, player_id):
+        self._last_activity = time.time()
         player = self._room_players.get_player(player_id)
         player.disconnect()
         self._room_players.remove_player(player.id)
@@ -162,63 +290,99 @@ class GameRoom(GameSubscriber):
             event_message.update(event_data)
 
             if "target" in event_data:
-                player = self._room_players.get_player(event_data["target"])
-                player.send_message(event_message)
+                try:
+                    player = self._room_players.get_player(event_data["target"])
+                except UnknownRoomPlayerException:
+                    # The player already left the room
+                    pass
+                else:
+                    player.try_send_message(event_message)
             else:
                 # Broadcasting message
                 self._room_event_handler.broadcast(event_message)
 
             if event == "game-over":
                 self._event_messages = []
+            elif "trace" in event_message:
+                # Not tracing the events sent again to the players joining
+                self._event_messages.append({key: value for key, value in event_message.items() if key != "trace"})
             else:
                 self._event_messages.append(event_message)
 
             if event == "dead-player":
-                self._leave(event_data["player"]["id"])
+                try:
+                    self._leave(event_data["player"]["id"])
+                except UnknownRoomPlayerException:
+                    # Removed in the meantime by the reaper
+                    pass
         finally:
             self._lock.release()
 
-    def remove_inactive_players(self):
-        def ping_player(player):
-            if not player.ping():
-                self.leave(player.id)
+    def remove_dead_players(self):
+        for player in self._room_players.players:
+            if not player.is_alive(self.PLAYER_TIMEOUT):
+                self._logger.info("Room {}: removing dead {}".format(self.id, player))
+                try:
+                    self.leave(player.id)
+                except UnknownRoomPlayerException:
+                    # Already gone
+                    pass
+
+    def _reap_dead_players(self):
+        while True:
+            gevent.sleep(self.REAP_INTERVAL)
+            self.remove_dead_players()
 
-        gevent.joinall([
-            gevent.spawn(ping_player, player)
-            for player in self._room_players.players
-        ])
+    @staticmethod
+    def _round_trips(players: List[PlayerServer]) -> int:
+        return sum(player.channel.round_trips for player in players)
 
     def activate(self):
         self.active = True
+        reaper = gevent.spawn(self._reap_dead_players)
         try:
             self._logger.info("Activating room {}...".format(self.id))
-            dealer_key = -1
-            while True:
+            while not self._draining:
                 try:
-                    self.remove_inactive_players()
+                    self.remove_dead_players()
 
                     players = self._room_players.players
                     if len(players) < 2:
                         raise GameError("At least two players needed to start a new game")
 
-                    dealer_key = (dealer_key + 1) % len(players)
-
-                    game = self._game_factory.create_game(players)
-                    game.event_dispatcher.subscribe(self)
-                    game.play_hand(players[dealer_key].id)
-                    game.event_dispatcher.unsubscribe(self)
+                    self._dealer_key = (self._dealer_key + 1) % len(players)
+
+                    # The event workers are spawned along with the game: accounted to the room as well
+                    with accounting.hand(self.id):
+                        game = self._game_factory.create_game(players, pacer=self._pacer)
+                        game.event_dispatcher.subscribe(self)
+                        round_trips = self._round_trips(players)
+                        HANDS_STARTED.labels(game.GAME_TYPE).inc()
+                        self._game = game
+                        try:
+                            game.play_hand(players[self._dealer_key].id)
+                            HANDS_FINISHED.labels(game.GAME_TYPE).inc()
+                        finally:
+                            self._game = None
+                            game.event_dispatcher.close()
+                            # Channels replaced during the hand (reconnections) are not accounted for
+                            REDIS_ROUND_TRIPS_PER_HAND.observe(max(0, self._round_trips(players) - round_trips))
 
                 except GameError:
                     break
         finally:
+            reaper.kill()
             self._logger.info("Deactivating room {}...".format(self.id))
+            self._last_activity = time.time()
             self.active = False
 
 
 class GameRoomFactory:
-    def __init__(self, room_size: int, game_factory: GameFactory):
+    def __init__(self, room_size: int, game_factory: GameFactory, pacer: Optional[GamePacer] = None):
         self._room_size: int = room_size
         self._game_factory: GameFactory = game_factory
+        self._pacer: Optional[GamePacer] = pacer
 
     def create_room(self, id: str, private: bool, logger) -> GameRoom:
-        return GameRoom(id=id, private=private, game_factory=self._game_factory, room_size=self._room_size, logger=logger)
+        return GameRoom(id=id, private=private, game_factory=self._game_factory, room_size=self._room_size, logger=logger,
+                        pacer=self._pacer)
@@ -1,42 +1,279 @@
+import collections
+import heapq
+import itertools
 import logging
-import threading
-from typing import List, Generator, Dict
+import time
+from typing import List, Generator, Dict, Optional, Tuple, Iterator, Deque
 from uuid import uuid4
 
 import gevent
+import gevent.lock
 
+from .metrics import registry
+from .profiling import accounting
 from .player_server import PlayerServer
-from .game_room import FullGameRoomException, GameRoom, GameRoomFactory
+from .game_room import GameRoom, GameRoomFactory, GameRoomSubscriber
+
+ACTIVE_ROOMS = registry.gauge("poker_rooms", "Rooms in memory", ["server"])
+SEATED_PLAYERS = registry.gauge("poker_seated_players", "Players seated in the rooms", ["server"])
+LOBBY_DEPTH = registry.gauge("poker_lobby_depth", "Connection requests waiting in the lobby", ["server"])
+ADMISSION_TIME = registry.histogram(
+    "poker_admission_seconds", "Time from a connection request to the player being seated (clocks of different hosts)"
+)
+
+
+class TooManyRoomsException(Exception):
+    pass
 
 
 class ConnectedPlayer:
-    def __init__(self, player: PlayerServer, room_id: str = None):
+    def __init__(self, player: PlayerServer, room_id: str = None, requested_at: Optional[float] = None):
         self.player: PlayerServer = player
         self.room_id: str = room_id
+        # Time of the connection request, if known
+        self.requested_at: Optional[float] = requested_at
+
+
+class GameRoomRegistry(GameRoomSubscriber):
+    """
+    Rooms indexed by id, plus a priority queue of public rooms with free seats.
+    Kept up to date by the room events, so that players can be seated without scanning every room.
+    """
+    # Preferring rooms with less free seats (filling tables up) or more free seats (spreading players)
+    FILL_FULLEST = "fullest"
+    FILL_EMPTIEST = "emptiest"
+
+    def __init__(self, fill_preference: str = FILL_FULLEST):
+        if fill_preference not in (self.FILL_FULLEST, self.FILL_EMPTIEST):
+            raise ValueError("Unknown fill preference '{}'".format(fill_preference))
+        self._fill_preference: str = fill_preference
+        self._rooms: Dict[str, GameRoom] = {}
+        # Room id of every seated player
+        self._player_rooms: Dict[str, str] = {}
+        # Heap of (priority, sequence, room id): outdated entries are discarded lazily
+        self._public_rooms: List[Tuple[int, int, str]] = []
+        # Current heap entry of each public room with free seats
+        self._entries: Dict[str, Tuple[int, int, str]] = {}
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def __iter__(self) -> Iterator[GameRoom]:
+        return iter(list(self._rooms.values()))
+
+    @property
+    def players_count(self) -> int:
+        return len(self._player_rooms)
+
+    def get(self, room_id: str) -> Optional[GameRoom]:
+        return self._rooms.get(room_id)
+
+    def get_player_room(self, player_id: str) -> Optional[GameRoom]:
+        room_id = self._player_rooms.get(player_id)
+        return None if room_id is None else self._rooms.get(room_id)
+
+    def add(self, room: GameRoom):
+        self._rooms[room.id] = room
+        room.subscribe(self)
+        self._update(room)
+
+    def remove(self, room: GameRoom):
+        room.unsubscribe(self)
+        del self._rooms[room.id]
+        self._entries.pop(room.id, None)
+        for player_id in [player_id for player_id, room_id in self._player_rooms.items() if room_id == room.id]:
+            del self._player_rooms[player_id]
+
+    def find_public_room(self) -> Optional[GameRoom]:
+        """Returns the preferred public room with at least one free seat"""
+        while self._public_rooms:
+            entry = self._public_rooms[0]
+            if self._entries.get(entry[2]) is entry:
+                return self._rooms[entry[2]]
+            heapq.heappop(self._public_rooms)
+        return None
+
+    def room_event(self, room_id: str, event: str, player_id: str):
+        if event in ("player-added", "player-rejoined"):
+            self._player_rooms[player_id] = room_id
+        elif event == "player-removed" and self._player_rooms.get(player_id) == room_id:
+            del self._player_rooms[player_id]
+        room = self._rooms.get(room_id)
+        if room is not None:
+            self._update(room)
+
+    def _update(self, room: GameRoom):
+        if room.private:
+            return
+
+        free_seats = room.free_seats
+        if not free_seats:
+            self._entries.pop(room.id, None)
+            return
+
+        entry = (free_seats if self._fill_preference == self.FILL_FULLEST else -free_seats, next(self._sequence), room.id)
+        self._entries[room.id] = entry
+        heapq.heappush(self._public_rooms, entry)
+
+        if len(self._public_rooms) > 2 * len(self._entries) + 64:
+            # Too many outdated entries
+            self._public_rooms = list(self._entries.values())
+            heapq.heapify(self._public_rooms)
 
 
 class GameServer:
-    def __init__(self, room_factory: GameRoomFactory, logger=None):
+    # Seconds an empty room is kept in memory
+    ROOM_TTL = 300
+    ROOM_REAP_INTERVAL = 60
+    MAX_ROOMS = 10000
+    DRAIN_POLL_INTERVAL = 0.1
+    # Seconds over which the admission rate is measured
+    ADMISSION_RATE_WINDOW = 10
+
+    def __init__(self, room_factory: GameRoomFactory, logger=None, fill_preference: str = GameRoomRegistry.FILL_FULLEST,
+                 room_ttl: Optional[float] = None, max_rooms: Optional[int] = None):
         self._id: str = str(uuid4())
-        self._rooms: List[GameRoom] = []
+        self._rooms: GameRoomRegistry = GameRoomRegistry(fill_preference)
+        self._room_ttl: float = self.ROOM_TTL if room_ttl is None else room_ttl
+        self._max_rooms: int = self.MAX_ROOMS if max_rooms is None else max_rooms
         self._players: Dict[str, PlayerServer] = {}
-        self._lobby_lock = threading.Lock()
+        # Shared with the room reaper greenlet
+        self._lobby_lock = gevent.lock.RLock()
         self._room_factory: GameRoomFactory = room_factory
+        self._draining: bool = False
+        # (time, number of players) of each admitted batch
+        self._admissions: Deque[Tuple[float, int]] = collections.deque()
         self._logger = logger if logger else logging
+        ACTIVE_ROOMS.labels(self._id).set_function(lambda: len(self._rooms))
+        SEATED_PLAYERS.labels(self._id).set_function(self.count_players)
+        LOBBY_DEPTH.labels(self._id).set_function(self.lobby_depth)
 
     def __str__(self):
         return "server {}".format(self._id)
 
+    @property
+    def rooms(self) -> List[GameRoom]:
+        return list(self._rooms)
+
     def new_players(self) -> Generator[ConnectedPlayer, None, None]:
         raise NotImplementedError
 
-    def __get_room(self, room_id: str) -> GameRoom:
+    def new_player_batches(self) -> Generator[List[ConnectedPlayer], None, None]:
+        """Players to seat, in batches: one player at a time unless overridden"""
+        for player in self.new_players():
+            yield [player]
+
+    @property
+    def admission_rate(self) -> float:
+        """Players admitted per second over the last ADMISSION_RATE_WINDOW seconds"""
+        self._expire_admissions()
+        return sum(count for _, count in self._admissions) / self.ADMISSION_RATE_WINDOW
+
+    def _expire_admissions(self):
+        expire_time = time.time() - self.ADMISSION_RATE_WINDOW
+        while self._admissions and self._admissions[0][0] < expire_time:
+            self._admissions.popleft()
+
+    def migrate_room(self, room: GameRoom):
+        """Hands a drained room over to another game server"""
+        raise NotImplementedError
+
+    @property
+    def draining(self) -> bool:
+        return self._draining
+
+    def drain(self):
+        """Stops accepting players: the rooms are migrated as soon as their current hand is over"""
+        self._logger.info("{}: draining".format(self))
+        self._draining = True
+        for room in self._rooms:
+            room.drain()
+
+    def _migrate_rooms(self):
+        for room in self._rooms:
+            room.drain()
+            while room.active:
+                gevent.sleep(self.DRAIN_POLL_INTERVAL)
+            self._lobby_lock.acquire()
+            try:
+                self._rooms.remove(room)
+                accounting.forget(room.id)
+                self.on_room_removed(room)
+            finally:
+                self._lobby_lock.release()
+            if not room.players:
+                continue
+            self._logger.info("{}: migrating room {}".format(self, room.id))
+            try:
+                self.migrate_room(room)
+            except:
+                self._logger.exception("{}: unable to migrate room {}".format(self, room.id))
+
+    def _restore_room(self, state: Dict, players: Dict[str, PlayerServer]) -> GameRoom:
+        self._lobby_lock.acquire()
         try:
-            return next(room for room in self._rooms if room.id == room_id)
-        except StopIteration:
-            room = self._room_factory.create_room(id=room_id, private=True, logger=self._logger)
-            self._rooms.append(room)
-            return room
+            room = self._rooms.get(state["room_id"])
+            if room is None:
+                room = self._create_room(state["room_id"], private=state["private"])
+            room.restore_state(state, players)
+        finally:
+            self._lobby_lock.release()
+        self._logger.info("{}: room {} restored".format(self, room.id))
+        if not room.active:
+            room.active = True
+            gevent.spawn(room.activate)
+        return room
+
+    def lobby_depth(self) -> int:
+        """Number of connection requests waiting to be handled (if known)"""
+        return 0
+
+    def count_players(self) -> int:
+        """Number of players seated in the rooms of this server"""
+        return self._rooms.players_count
+
+    def __get_room(self, room_id: str) -> GameRoom:
+        room = self._rooms.get(room_id)
+        if room is None:
+            room = self._create_room(room_id, private=True)
+        return room
+
+    def _create_room(self, room_id: str, private: bool) -> GameRoom:
+        if len(self._rooms) >= self._max_rooms:
+            # Making space by evicting every empty room straight away
+            self.remove_idle_rooms(ttl=0)
+            if len(self._rooms) >= self._max_rooms:
+                raise TooManyRoomsException("Maximum number of rooms ({}) reached".format(self._max_rooms))
+        room = self._room_factory.create_room(id=room_id, private=private, logger=self._logger)
+        self._rooms.add(room)
+        self.on_room_created(room)
+        return room
+
+    def remove_idle_rooms(self, ttl: Optional[float] = None):
+        """Evicts the rooms which have been empty and inactive for more than ttl seconds"""
+        ttl = self._room_ttl if ttl is None else ttl
+        for room in self._rooms:
+            if not room.active:
+                # Dead seats are only reaped by active rooms
+                room.remove_dead_players()
+            if room.is_idle(ttl):
+                self._logger.info("{}: removing idle room {}".format(self, room.id))
+                self._rooms.remove(room)
+                accounting.forget(room.id)
+                self.on_room_removed(room)
+
+    def _reap_idle_rooms(self):
+        while True:
+            gevent.sleep(self.ROOM_REAP_INTERVAL)
+            self._lobby_lock.acquire()
+            try:
+                self.remove_idle_rooms()
+            finally:
+                self._lobby_lock.release()
+            self._logger.info("{}: {} rooms, {} players, {:.1f} connections/s".format(
+                self, len(self._rooms), self.count_players(), self.admission_rate
+            ))
 
     def _join_private_room(self, player: PlayerServer, room_id: str) -> GameRoom:
         self._lobby_lock.acquire()
@@ -50,19 +287,16 @@ class GameServer:
     def _join_any_public_room(self, player: PlayerServer) -> GameRoom:
         self._lobby_lock.acquire()
         try:
-            # Adding player to the first non-full public room
-            for room in self._rooms:
-                if not room.private:
-                    try:
-                        room.join(player)
-                        return room
-                    except FullGameRoomException:
-                        pass
-
-            # All rooms are full: creating new room
-            room = self._room_factory.create_room(id=str(uuid4()), private=False, logger=self._logger)
+            room = self._rooms.get_player_room(player.id)
+            if room is None or room.private:
+                # Adding player to the preferred non-full public room
+                room = self._rooms.find_public_room()
+
+            if room is None:
+                # All rooms are full: creating new room
+                room = self._create_room(str(uuid4()), private=False)
+
             room.join(player)
-            self._rooms.append(room)
             return room
         finally:
             self._lobby_lock.release()
@@ -75,25 +309,54 @@ class GameServer:
             self._logger.info("Player {}: joining private room {}".format(player.player, player.room_id))
             return self._join_private_room(player.player, player.room_id)
 
+    def _admit(self, player: ConnectedPlayer):
+        # Player successfully connected: joining the lobby
+        self._logger.info("{}: {} connected".format(self, player.player))
+        try:
+            room = self._join_room(player)
+            self._logger.info("Room: {}".format(room.id))
+            if not room.active:
+                room.active = True
+                gevent.spawn(room.activate)
+        except TooManyRoomsException as e:
+            self._logger.error("{}: unable to seat {}: {}".format(self, player.player, e))
+            player.player.try_send_message({"message_type": "error", "error": e.args[0]})
+            player.player.disconnect()
+            self.on_admission_failed(player)
+        except:
+            # Close bad connections and ignore the connection
+            self._logger.exception("{}: bad connection".format(self))
+            self.on_admission_failed(player)
+
     def start(self):
         self._logger.info("{}: running".format(self))
         self.on_start()
+        reaper = gevent.spawn(self._reap_idle_rooms)
         try:
-            for player in self.new_players():
-                # Player successfully connected: joining the lobby
-                self._logger.info("{}: {} connected".format(self, player.player))
+            for players in self.new_player_batches():
+                # The whole batch is seated in one go
+                self._lobby_lock.acquire()
                 try:
-                    room = self._join_room(player)
-                    self._logger.info("Room: {}".format(room.id))
-                    if not room.active:
-                        room.active = True
-                        gevent.spawn(room.activate)
-                except:
-                    # Close bad connections and ignore the connection
-                    self._logger.exception("{}: bad connection".format(self))
-                    pass
+                    for player in players:
+                        self._admit(player)
+                finally:
+                    self._lobby_lock.release()
+                admitted_at = time.time()
+                for player in players:
+                    if player.requested_at is not None:
+                        ADMISSION_TIME.observe(admitted_at - player.requested_at)
+                self._admissions.append((time.time(), len(players)))
+                self._expire_admissions()
+                if self._draining:
+                    break
+            if self._draining:
+                reaper.kill()
+                self._migrate_rooms()
         finally:
+            reaper.kill()
             self._logger.info("{}: terminating".format(self))
+            for gauge in (ACTIVE_ROOMS, SEATED_PLAYERS, LOBBY_DEPTH):
+                gauge.remove(self._id)
             self.on_shutdown()
 
     def on_start(self):
@@ -101,3 +364,13 @@ class GameServer:
 
     def on_shutdown(self):
         pass
+
+    def on_room_created(self, room: GameRoom):
+        pass
+
+    def on_room_removed(self, room: GameRoom):
+        pass
+
+    def on_admission_failed(self, player: ConnectedPlayer):
+        """Player not seated after being connected"""
+        pass
@@ -0,0 +1,68 @@
+import time
+from typing import Generator, List
+
+from .channel import ChannelError
+from .game_room import GameRoom, GameRoomFactory
+from .game_server import GameServer, ConnectedPlayer
+from .lobby import LobbyMemory
+from .player_server import PlayerServer
+
+
+class GameServerMemory(GameServer):
+    """
+    Game server sharing its process with the web gateway: players connect through an in-process lobby
+    and their messages never leave the process.
+    """
+    # Maximum number of connection requests admitted at once
+    ADMISSION_BATCH_SIZE = 50
+
+    def __init__(self, lobby: LobbyMemory, room_factory: GameRoomFactory, logger=None, **kwargs):
+        GameServer.__init__(self, room_factory, logger, **kwargs)
+        self._lobby: LobbyMemory = lobby
+
+    def _create_player(self, message, channel) -> ConnectedPlayer:
+        player = PlayerServer(
+            channel=channel,
+            logger=self._logger,
+            id=message["player"]["id"],
+            name=message["player"]["name"],
+            money=message["player"]["money"]
+        )
+        return ConnectedPlayer(player=player, room_id=message["room_id"], requested_at=message.get("requested_at"))
+
+    def lobby_depth(self) -> int:
+        return len(self._lobby)
+
+    def new_player_batches(self) -> Generator[List[ConnectedPlayer], None, None]:
+        while not self._draining:
+            # Waking up every now and then to notice the server is draining
+            requests = self._lobby.pop_many(self.ADMISSION_BATCH_SIZE, timeout=self.DRAIN_POLL_INTERVAL)
+            players = []
+            for message, channel in requests:
+                if message["timeout_epoch"] < time.time():
+                    self._logger.error("Unable to connect the player: Connection timeout")
+                    channel.close()
+                    continue
+                player = self._create_player(message, channel)
+                try:
+                    channel.send_message({
+                        "message_type": "connect",
+                        "server_id": self._id,
+                        "player": player.player.dto()
+                    })
+                except ChannelError as e:
+                    self._logger.error("Unable to connect {}: {}".format(player.player, e.args[0]))
+                    continue
+                players.append(player)
+            if players:
+                yield players
+
+    def new_players(self) -> Generator[ConnectedPlayer, None, None]:
+        for players in self.new_player_batches():
+            yield from players
+
+    def migrate_room(self, room: GameRoom):
+        # No other game server to hand the room over to: players are sent back to the lobby page
+        for player in room.players:
+            player.try_send_message({"message_type": "error", "error": "Game server shutting down"})
+            player.disconnect()
@@ -1,21 +1,50 @@
 import time
-from typing import Generator
+from typing import Generator, Optional, Any, List, Dict, Union
 
-from redis import Redis
+import gevent
+from redis import exceptions, Redis
 
-from .game_room import GameRoomFactory
+from .game_cluster import GameClusterRegistry
+from .game_event_stream import GameEventPublisher
+from .lobby import LobbyShards
+from .game_room import GameRoom, GameRoomFactory
+from .channel import Channel
+from .channel_inbox import Inbox
 from .channel_redis import MessageQueue, ChannelRedis, ChannelError, MessageFormatError, MessageTimeout
+from .channel_redis_stream import ChannelRedisStream
 from .game_server import GameServer, ConnectedPlayer
 from .player_server import PlayerServer
+from .redis_shards import RedisShards
 
 
 class GameServerRedis(GameServer):
-    def __init__(self, redis: Redis, connection_channel: str, room_factory: GameRoomFactory, logger=None):
-        GameServer.__init__(self, room_factory, logger)
+    # Maximum number of connection requests popped and acknowledged at once
+    ADMISSION_BATCH_SIZE = 50
+    # Seconds between two assignments of the lobby shards
+    SHARD_REBALANCE_INTERVAL = 5
+
+    def __init__(self, redis: Redis, connection_channel: str, room_factory: GameRoomFactory, logger=None,
+                 cluster_name: Optional[str] = None, lobby_shards: int = 1,
+                 session_redis: Optional[Union[Redis, RedisShards]] = None,
+                 event_publisher: Optional[GameEventPublisher] = None, **kwargs):
+        GameServer.__init__(self, room_factory, logger, **kwargs)
         self._redis: Redis = redis
+        # Player sessions and inboxes, possibly spread over several Redis endpoints (lobby and registry stay on redis)
+        self._session_redis: Union[Redis, RedisShards] = redis if session_redis is None else session_redis
         self._connection_queue = MessageQueue(redis, connection_channel)
+        self._lobby: LobbyShards = LobbyShards(connection_channel, lobby_shards)
+        self._lobby_queues: List[MessageQueue] = [self._connection_queue]
+        self._lobby_shards: Optional[List[int]] = None
+        self._lobby_assigned_at: float = 0.0
+        # Messages of the clients connected through a multiplexing gateway
+        self._inbox: Inbox = Inbox(self._session_redis, "poker5:node-{}:inbox".format(self._id), self._logger)
+        # Shared with the other game servers popping connections from the same lobby
+        self._cluster: Optional[GameClusterRegistry] = None if cluster_name is None else \
+            GameClusterRegistry(redis, cluster_name, self._id, self._logger)
+        # Summary of the game events for the observers
+        self._event_publisher: Optional[GameEventPublisher] = event_publisher
 
-    def _connect_player(self, message) -> ConnectedPlayer:
+    def _create_player(self, message) -> ConnectedPlayer:
         try:
             timeout_epoch = int(message["timeout_epoch"])
         except KeyError:
@@ -56,36 +85,242 @@ class GameServerRedis(GameServer):
                                      desc="'{}' is not a number".format(message["player"]["money"]))
 
         try:
-            game_room_id = str(message["room_id"])
+            # Public rooms: no room id or null
+            game_room_id = None if message["room_id"] is None else str(message["room_id"])
         except KeyError:
             game_room_id = None
         except ValueError:
             raise MessageFormatError(attribute="room_id", desc="Invalid room id")
 
-        player = PlayerServer(
-            channel=ChannelRedis(
-                self._redis,
+        try:
+            requested_at = None if message.get("requested_at") is None else float(message["requested_at"])
+        except (TypeError, ValueError):
+            raise MessageFormatError(attribute="requested_at", desc="'{}' is not a number".format(message["requested_at"]))
+
+        if message.get("reply_to") is not None:
+            # Gateway multiplexing its sessions over a single inbox
+            channel = self._inbox.open_channel(session_id, str(message["reply_to"]))
+        elif message.get("channel") == "stream":
+            channel = ChannelRedisStream(
+                self._session_redis,
+                "poker5:player-{}:session-{}:stream-I".format(player_id, session_id),
+                "poker5:player-{}:session-{}:stream-O".format(player_id, session_id),
+                consumer="server-{}".format(self._id)
+            )
+        else:
+            channel = ChannelRedis(
+                self._session_redis,
                 "poker5:player-{}:session-{}:I".format(player_id, session_id),
                 "poker5:player-{}:session-{}:O".format(player_id, session_id)
-            ),
+            )
+
+        player = PlayerServer(
+            channel=channel,
             logger=self._logger,
             id=player_id,
             name=player_name,
             money=player_money,
         )
 
-        # Acknowledging the connection
-        player.send_message({
-            "message_type": "connect",
-            "server_id": self._id,
-            "player": player.dto()
-        })
+        return ConnectedPlayer(player=player, room_id=game_room_id, requested_at=requested_at)
+
+    def _acknowledge(self, players: List[ConnectedPlayer]) -> List[ConnectedPlayer]:
+        """Acknowledges the connections in a single round trip, returns the players successfully acknowledged"""
+        pipeline = self._session_redis.pipeline(transaction=False)
+        for player in players:
+            player.player.channel.pipeline_send(pipeline, {
+                "message_type": "connect",
+                "server_id": self._id,
+                "player": player.player.dto()
+            })
+        try:
+            results = pipeline.execute(raise_on_error=False)
+        except exceptions.RedisError as e:
+            self._logger.error("Unable to acknowledge {} connections: {}".format(len(players), e.args[0]))
+            for player in players:
+                player.player.channel.close()
+            return []
+        acknowledged = []
+        # Two commands per push
+        for player, result in zip(players, results[::2]):
+            if isinstance(result, Exception):
+                self._logger.error("Unable to connect {}: {}".format(player.player, result))
+                player.player.channel.close()
+            else:
+                acknowledged.append(player)
+        return acknowledged
 
-        return ConnectedPlayer(player=player, room_id=game_room_id)
+    def _pop_connections(self) -> Optional[List[Any]]:
+        """Returns the next batch of connection requests, None once the server is draining"""
+        while not self._draining:
+            # Connections forwarded by the other nodes first
+            queues = self._assigned_lobby_queues()
+            if self._cluster is not None:
+                queues = [self._cluster.inbox] + queues
+            for queue in queues:
+                messages = queue.pop_many(self.ADMISSION_BATCH_SIZE)
+                if messages:
+                    return messages
+            gevent.sleep(0.01)
+        return None
 
-    def new_players(self) -> Generator[ConnectedPlayer, None, None]:
+    def lobby_depth(self) -> int:
+        return sum(queue.size() for queue in self._lobby_queues)
+
+    def _assigned_lobby_queues(self) -> List[MessageQueue]:
+        if self._lobby.num_shards == 1 or time.time() - self._lobby_assigned_at < self.SHARD_REBALANCE_INTERVAL:
+            return self._lobby_queues
+        self._lobby_assigned_at = time.time()
+
+        if self._cluster is None:
+            # Single node: consuming every shard
+            shards = list(range(self._lobby.num_shards))
+        else:
+            try:
+                shards = self._lobby.assigned_shards(self._id, self._cluster.live_nodes())
+            except exceptions.RedisError as e:
+                self._logger.error("{}: unable to rebalance the lobby shards: {}".format(self, e.args[0]))
+                return self._lobby_queues
+
+        if shards != self._lobby_shards:
+            self._logger.info("{}: consuming lobby shards {}".format(self, shards))
+            self._lobby_shards = shards
+            self._lobby_queues = [MessageQueue(self._redis, self._lobby.shard_name(shard)) for shard in shards]
+        return self._lobby_queues
+
+    def _import_channel(self, channel: Dict) -> Channel:
+        if "session_id" in channel:
+            return self._inbox.open_channel(str(channel["session_id"]), channel["remote_inbox"])
+        if "stream_in" in channel:
+            # Messages left pending by the previous game server are claimed
+            return ChannelRedisStream(
+                self._session_redis, channel["stream_in"], channel["stream_out"], consumer="server-{}".format(self._id)
+            )
+        return ChannelRedis(self._session_redis, channel["channel_in"], channel["channel_out"])
+
+    def _restore_migrated_room(self, message):
+        try:
+            state = message["room"]
+            players = {
+                player_id: PlayerServer(
+                    channel=self._import_channel(state["channels"][player_id]),
+                    logger=self._logger,
+                    id=player_id,
+                    name=str(player["name"]),
+                    money=float(player["money"])
+                )
+                for player_id, player in state["players"].items()
+            }
+        except (KeyError, TypeError, ValueError):
+            raise MessageFormatError(attribute="room", desc="Invalid room state")
+        for player in players.values():
+            try:
+                # Letting multiplexing gateways know where the session moved
+                player.channel.heartbeat()
+            except ChannelError:
+                pass
+        self._restore_room(state, players)
+
+    def migrate_room(self, room: GameRoom):
+        state = room.export_state()
+        state["channels"] = {}
+        for player in room.players:
+            # Messages still waiting to be sent go first
+            player.outbox.flush()
+            state["channels"][player.id] = player.channel.export()
+        # Picked up by the next game server popping from the lobby
+        MessageQueue(self._redis, self._lobby.shard_name(self._lobby.shard_of(room_id=room.id))).push(
+            {"message_type": "room-migration", "room_id": room.id, "room": state}
+        )
+
+    def _admit_message(self, message) -> Optional[ConnectedPlayer]:
+        if self._cluster is not None:
+            node_id = self._cluster.route(message)
+            if node_id is not None:
+                self._logger.info("{}: forwarding connection to node {}".format(self, node_id))
+                self._cluster.forward(message, node_id)
+                return None
+        if message.get("message_type") == "room-migration":
+            self._restore_migrated_room(message)
+            return None
+        try:
+            return self._create_player(message)
+        except (ChannelError, MessageTimeout, MessageFormatError):
+            self._release_unused_claim(message.get("room_id"))
+            raise
+
+    def _release_unused_claim(self, room_id: Optional[Any]):
+        """Releases the room claimed when routing a connection, unless the room was created in the meantime"""
+        if self._cluster is None or room_id is None or self._rooms.get(str(room_id)) is not None:
+            return
+        try:
+            self._cluster.release_room(str(room_id))
+        except exceptions.RedisError as e:
+            self._logger.error("{}: unable to release room {}: {}".format(self, room_id, e.args[0]))
+
+    def new_player_batches(self) -> Generator[List[ConnectedPlayer], None, None]:
         while True:
             try:
-                yield self._connect_player(self._connection_queue.pop())
-            except (ChannelError, MessageTimeout, MessageFormatError) as e:
-                self._logger.error("Unable to connect the player: {}".format(e.args[0]))
+                messages = self._pop_connections()
+            except ChannelError as e:
+                self._logger.error("Unable to pop connections: {}".format(e.args[0]))
+                gevent.sleep(1)
+                continue
+            if messages is None:
+                return
+            players = []
+            for message in messages:
+                try:
+                    player = self._admit_message(message)
+                    if player is not None:
+                        players.append(player)
+                except (ChannelError, MessageTimeout, MessageFormatError) as e:
+                    self._logger.error("Unable to connect the player: {}".format(e.args[0]))
+            if players:
+                acknowledged = self._acknowledge(players)
+                for player in players:
+                    if player not in acknowledged:
+                        self._release_unused_claim(player.room_id)
+                players = acknowledged
+            if players:
+                yield players
+
+    def new_players(self) -> Generator[ConnectedPlayer, None, None]:
+        for players in self.new_player_batches():
+            yield from players
+
+    def on_start(self):
+        if self._cluster is not None:
+            self._cluster.start()
+        if self._event_publisher is not None:
+            self._event_publisher.start()
+
+    def on_shutdown(self):
+        self._inbox.stop()
+        if self._cluster is not None:
+            self._cluster.stop()
+        if self._event_publisher is not None:
+            self._event_publisher.stop()
+
+    def on_room_created(self, room: GameRoom):
+        if self._event_publisher is not None:
+            room.subscribe(self._event_publisher)
+        if self._cluster is not None:
+            room.subscribe(self._cluster)
+            try:
+                self._cluster.claim_room(room.id)
+            except exceptions.RedisError as e:
+                self._logger.error("{}: unable to register room {}: {}".format(self, room.id, e.args[0]))
+
+    def on_admission_failed(self, player: ConnectedPlayer):
+        self._release_unused_claim(player.room_id)
+
+    def on_room_removed(self, room: GameRoom):
+        if self._event_publisher is not None:
+            room.unsubscribe(self._event_publisher)
+        if self._cluster is not None:
+            room.unsubscribe(self._cluster)
+            try:
+                self._cluster.release_room(room.id)
+            except exceptions.RedisError as e:
+                self._logger.error("{}: unable to unregister room {}: {}".format(self, room.id, e.args[0]))
@@ -0,0 +1,168 @@
+import collections
+import logging
+import os
+import signal
+import zlib
+from typing import Dict, List, Any
+
+import gevent
+import gevent.subprocess
+from redis import exceptions, Redis
+
+from .channel import ChannelError, MessageFormatError
+from .channel_redis import MessageQueue
+from .game_server import GameServer
+from .lobby import LobbyShards
+
+
+class GameServerSupervisor:
+    """
+    Runs a game server in each of N worker processes, every worker owning a disjoint shard of rooms.
+    Connection requests are popped from the lobby and forwarded to the worker lobbies:
+    private rooms by hashing their id, public rooms to the least loaded worker.
+    Workers are started by running the given command with the WORKER_ID and WORKER_CHANNEL variables set.
+    """
+    RESTART_DELAY = 1
+    LOAD_REPORT_INTERVAL = 2
+    # Players remembered by the supervisor to send them back to the same worker when they reconnect
+    MAX_STICKY_PLAYERS = 100000
+    ROUTING_BATCH_SIZE = 50
+
+    def __init__(self, redis: Redis, connection_channel: str, worker_command: List[str], num_workers: int,
+                 logger=None, lobby_shards: int = 1):
+        self._redis: Redis = redis
+        # Every lobby shard is consumed by the supervisor
+        self._connection_queues: List[MessageQueue] = [
+            MessageQueue(redis, shard_name) for shard_name in LobbyShards(connection_channel, lobby_shards).shard_names()
+        ]
+        self._connection_channel: str = connection_channel
+        self._worker_command: List[str] = worker_command
+        self._num_workers: int = num_workers
+        self._logger = logger if logger else logging
+        self._worker_queues: List[MessageQueue] = [
+            MessageQueue(redis, self.worker_channel(worker_id)) for worker_id in range(num_workers)
+        ]
+        # Number of seated players last reported by each worker
+        self._loads: List[int] = [0] * num_workers
+        # Players sent to each worker since the last load report
+        self._assigned: List[int] = [0] * num_workers
+        self._player_workers: Dict[str, int] = collections.OrderedDict()
+        self._workers: Dict[int, gevent.subprocess.Popen] = {}
+        self._running: bool = False
+
+    def worker_channel(self, worker_id: int) -> str:
+        return "{}:worker-{}".format(self._connection_channel, worker_id)
+
+    @staticmethod
+    def loads_key(connection_channel: str) -> str:
+        return "{}:loads".format(connection_channel)
+
+    @staticmethod
+    def run_worker(server: GameServer, redis: Redis, connection_channel: str, worker_id: int, logger=None):
+        """Runs a worker game server, periodically reporting its load to the supervisor"""
+        logger = logger if logger else logging
+
+        def report_load():
+            while True:
+                try:
+                    redis.hset(
+                        GameServerSupervisor.loads_key(connection_channel), str(worker_id), server.count_players()
+                    )
+                except exceptions.RedisError as e:
+                    logger.error("Worker {}: unable to report the load: {}".format(worker_id, e.args[0]))
+                gevent.sleep(GameServerSupervisor.LOAD_REPORT_INTERVAL)
+
+        reporter = gevent.spawn(report_load)
+        try:
+            server.start()
+        finally:
+            reporter.kill()
+
+    def route(self, message: Any) -> int:
+        """Returns the worker in charge of a connection request"""
+        room_id = message.get("room_id")
+        if room_id is not None:
+            return zlib.crc32(str(room_id).encode("utf-8")) % self._num_workers
+
+        try:
+            player_id = str(message["player"]["id"])
+        except (KeyError, TypeError):
+            raise MessageFormatError(attribute="player.id", desc="Missing attribute")
+
+        try:
+            worker_id = self._player_workers.pop(player_id)
+        except KeyError:
+            worker_id = min(range(self._num_workers), key=lambda k: self._loads[k] + self._assigned[k])
+            self._assigned[worker_id] += 1
+
+        self._player_workers[player_id] = worker_id
+        if len(self._player_workers) > self.MAX_STICKY_PLAYERS:
+            self._player_workers.popitem(last=False)
+        return worker_id
+
+    def start(self):
+        self._logger.info("Supervisor: starting {} workers".format(self._num_workers))
+        self._running = True
+        self._redis.delete(self.loads_key(self._connection_channel))
+        monitors = [gevent.spawn(self._run_worker, worker_id) for worker_id in range(self._num_workers)]
+        load_tracker = gevent.spawn(self._track_loads)
+        router = gevent.spawn(self._route_connections)
+        gevent.signal_handler(signal.SIGTERM, router.kill)
+        try:
+            router.join()
+        finally:
+            load_tracker.kill()
+            self.shutdown()
+            gevent.joinall(monitors)
+
+    def shutdown(self):
+        self._running = False
+        for worker in list(self._workers.values()):
+            try:
+                worker.terminate()
+            except OSError:
+                pass
+
+    def _route_connections(self):
+        while True:
+            routed = False
+            for queue in self._connection_queues:
+                try:
+                    for message in queue.pop_many(self.ROUTING_BATCH_SIZE):
+                        routed = True
+                        try:
+                            self._worker_queues[self.route(message)].push(message)
+                        except (ChannelError, MessageFormatError) as e:
+                            self._logger.error("Supervisor: unable to route the connection: {}".format(e.args[0]))
+                except ChannelError as e:
+                    self._logger.error("Supervisor: unable to pop the connections: {}".format(e.args[0]))
+            if not routed:
+                gevent.sleep(0.01)
+
+    def _run_worker(self, worker_id: int):
+        while self._running:
+            env = dict(os.environ, WORKER_ID=str(worker_id), WORKER_CHANNEL=self.worker_channel(worker_id))
+            worker = gevent.subprocess.Popen(self._worker_command, env=env)
+            self._workers[worker_id] = worker
+            self._logger.info("Supervisor: worker {} started (pid {})".format(worker_id, worker.pid))
+            status = worker.wait()
+            del self._workers[worker_id]
+            self._loads[worker_id] = 0
+            if self._running:
+                self._logger.error("Supervisor: worker {} (pid {}) terminated with status {}, restarting".format(
+                    worker_id, worker.pid, status
+                ))
+                gevent.sleep(self.RESTART_DELAY)
+
+    def _track_loads(self):
+        while True:
+            gevent.sleep(self.LOAD_REPORT_INTERVAL)
+            try:
+                loads = self._redis.hgetall(self.loads_key(self._connection_channel))
+            except exceptions.RedisError as e:
+                self._logger.error("Supervisor: unable to read the worker loads: {}".format(e.args[0]))
+                continue
+            for worker_id in self._workers:
+                self._loads[worker_id] = int(loads.get(str(worker_id).encode("utf-8"), 0))
+            # Fresh load reports account for the players assigned in the meantime
+            self._assigned = [0] * self._num_workers
@@ -0,0 +1,408 @@
+import collections
+import io
+import logging
+import os
+import time
+import uuid
+from typing import Any, BinaryIO, Deque, Dict, Generator, List, Optional, Tuple
+
+import gevent
+import gevent.event
+from gevent.threadpool import ThreadPool
+
+from .poker_game import GameSubscriber
+
+# Binary hand histories: a file header followed by hands, each of them prefixed by its length (varint).
+# Hand: game id, game type, start time (ms), players (id, name and money, referenced by index afterwards),
+# dealer index, then actions (tag byte followed by varints and card bytes) up to the END tag.
+# Cards are stored as a byte each ((rank << 2) + suit), amounts as zigzag varints of cents.
+
+FILE_HEADER = b"PKHH\x01"
+
+GAME_TYPES = ["texas-holdem", "traditional"]
+BET_TYPES = ["blind", "check", "call", "raise", "all-in"]
+
+TAG_END = 0
+TAG_BET = 1
+TAG_FOLD = 2
+TAG_DEAD_PLAYER = 3
+TAG_CARDS = 4
+TAG_SHARED_CARDS = 5
+TAG_CARDS_CHANGE = 6
+TAG_SHOWDOWN = 7
+TAG_WINNER = 8
+
+# Game ids which are not UUIDs are stored as strings
+GAME_ID_UUID = 0
+GAME_ID_STRING = 1
+
+
+class HandHistoryFormatError(Exception):
+    pass
+
+
+def write_varint(buffer: bytearray, value: int):
+    while value > 0x7f:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(stream: BinaryIO) -> int:
+    value = 0
+    shift = 0
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            raise HandHistoryFormatError("Truncated varint")
+        value |= (byte[0] & 0x7f) << shift
+        if byte[0] < 0x80:
+            return value
+        shift += 7
+
+
+def write_amount(buffer: bytearray, amount: float):
+    cents = int(round(amount * 100))
+    write_varint(buffer, cents << 1 if cents >= 0 else ((-cents) << 1) - 1)
+
+
+def read_amount(stream: BinaryIO) -> float:
+    value = read_varint(stream)
+    cents = value >> 1 if not value & 1 else -((value + 1) >> 1)
+    return cents / 100
+
+
+def write_string(buffer: bytearray, value: str):
+    encoded = value.encode("utf-8")
+    write_varint(buffer, len(encoded))
+    buffer += encoded
+
+
+def read_string(stream: BinaryIO) -> str:
+    length = read_varint(stream)
+    encoded = stream.read(length)
+    if len(encoded) != length:
+        raise HandHistoryFormatError("Truncated string")
+    return encoded.decode("utf-8")
+
+
+def write_cards(buffer: bytearray, cards: List[Tuple[int, int]]):
+    write_varint(buffer, len(cards))
+    buffer += bytes((rank << 2) + suit for rank, suit in cards)
+
+
+def read_cards(stream: BinaryIO) -> List[Tuple[int, int]]:
+    count = read_varint(stream)
+    codes = stream.read(count)
+    if len(codes) != count:
+        raise HandHistoryFormatError("Truncated cards")
+    return [(code >> 2, code & 3) for code in codes]
+
+
+class HandEncoder:
+    """Encodes the events of a hand as they are raised"""
+    def __init__(self, new_game: Dict[str, Any]):
+        self._buffer = bytearray()
+        self._player_keys: Dict[str, int] = {}
+
+        try:
+            game_id = uuid.UUID(new_game["game_id"])
+        except ValueError:
+            self._buffer.append(GAME_ID_STRING)
+            write_string(self._buffer, new_game["game_id"])
+        else:
+            self._buffer.append(GAME_ID_UUID)
+            self._buffer += game_id.bytes
+
+        game_type = new_game.get("game_type")
+        write_varint(self._buffer, GAME_TYPES.index(game_type) if game_type in GAME_TYPES else len(GAME_TYPES))
+        write_varint(self._buffer, int(time.time() * 1000))
+
+        write_varint(self._buffer, len(new_game["players"]))
+        for key, player in enumerate(new_game["players"]):
+            self._player_keys[player["id"]] = key
+            write_string(self._buffer, player["id"])
+            write_string(self._buffer, player["name"])
+            write_amount(self._buffer, player["money"])
+        write_varint(self._buffer, self._player_keys.get(new_game.get("dealer_id"), len(self._player_keys)))
+
+        # Blinds collected before the hand started (traditional poker)
+        for player_id, bet in (new_game.get("blind_bets") or {}).items():
+            self._bet(player_id, bet, "blind")
+
+    def _player(self, player_id: str) -> int:
+        return self._player_keys[player_id]
+
+    def _bet(self, player_id: str, bet: float, bet_type: str):
+        player_key = self._player(player_id)
+        self._buffer.append(TAG_BET)
+        write_varint(self._buffer, player_key)
+        write_amount(self._buffer, bet)
+        self._buffer.append(BET_TYPES.index(bet_type) if bet_type in BET_TYPES else len(BET_TYPES))
+
+    def add(self, event: str, event_data: Dict[str, Any]):
+        """Encodes a game event (events not part of the history are ignored)"""
+        if event == "bet":
+            self._bet(event_data["player"]["id"], event_data["bet"], event_data["bet_type"])
+        elif event in ("fold", "dead-player"):
+            player_key = self._player(event_data["player"]["id"])
+            self._buffer.append(TAG_FOLD if event == "fold" else TAG_DEAD_PLAYER)
+            write_varint(self._buffer, player_key)
+        elif event == "cards-assignment":
+            player_key = self._player(event_data["target"])
+            self._buffer.append(TAG_CARDS)
+            write_varint(self._buffer, player_key)
+            write_cards(self._buffer, event_data["cards"])
+        elif event == "shared-cards":
+            self._buffer.append(TAG_SHARED_CARDS)
+            write_cards(self._buffer, event_data["cards"])
+        elif event == "cards-change":
+            player_key = self._player(event_data["player"]["id"])
+            self._buffer.append(TAG_CARDS_CHANGE)
+            write_varint(self._buffer, player_key)
+            write_varint(self._buffer, event_data["num_cards"])
+        elif event == "showdown":
+            players = [(self._player(player_id), player["cards"]) for player_id, player in event_data["players"].items()]
+            self._buffer.append(TAG_SHOWDOWN)
+            write_varint(self._buffer, len(players))
+            for player_key, cards in players:
+                write_varint(self._buffer, player_key)
+                write_cards(self._buffer, cards)
+        elif event == "winner-designation":
+            winner_keys = [self._player(player_id) for player_id in event_data["pot"]["winner_ids"]]
+            self._buffer.append(TAG_WINNER)
+            write_amount(self._buffer, event_data["pot"]["money"])
+            write_amount(self._buffer, event_data["pot"]["money_split"])
+            write_varint(self._buffer, len(winner_keys))
+            for player_key in winner_keys:
+                write_varint(self._buffer, player_key)
+
+    def finish(self) -> bytes:
+        self._buffer.append(TAG_END)
+        return bytes(self._buffer)
+
+
+def decode_hand(data: bytes) -> Dict[str, Any]:
+    stream = io.BytesIO(data)
+    if stream.read(1)[0] == GAME_ID_UUID:
+        game_id = str(uuid.UUID(bytes=stream.read(16)))
+    else:
+        game_id = read_string(stream)
+    game_type = read_varint(stream)
+    started_at = read_varint(stream) / 1000
+    players = [
+        {"id": read_string(stream), "name": read_string(stream), "money": read_amount(stream)}
+        for _ in range(read_varint(stream))
+    ]
+    dealer_key = read_varint(stream)
+
+    def player_id() -> str:
+        return players[read_varint(stream)]["id"]
+
+    actions = []
+    while True:
+        tag = stream.read(1)
+        if not tag:
+            raise HandHistoryFormatError("Missing end of hand")
+        tag = tag[0]
+        if tag == TAG_END:
+            break
+        elif tag == TAG_BET:
+            action = {"action": "bet", "player": player_id(), "bet": read_amount(stream)}
+            bet_type = stream.read(1)[0]
+            action["bet_type"] = BET_TYPES[bet_type] if bet_type < len(BET_TYPES) else None
+        elif tag in (TAG_FOLD, TAG_DEAD_PLAYER):
+            action = {"action": "fold" if tag == TAG_FOLD else "dead-player", "player": player_id()}
+        elif tag == TAG_CARDS:
+            action = {"action": "cards-assignment", "player": player_id(), "cards": read_cards(stream)}
+        elif tag == TAG_SHARED_CARDS:
+            action = {"action": "shared-cards", "cards": read_cards(stream)}
+        elif tag == TAG_CARDS_CHANGE:
+            action = {"action": "cards-change", "player": player_id(), "num_cards": read_varint(stream)}
+        elif tag == TAG_SHOWDOWN:
+            action = {"action": "showdown", "players": {}}
+            for _ in range(read_varint(stream)):
+                showdown_player_id = player_id()
+                action["players"][showdown_player_id] = read_cards(stream)
+        elif tag == TAG_WINNER:
+            action = {"action": "winner-designation", "pot": read_amount(stream), "money_split": read_amount(stream)}
+            action["winners"] = [player_id() for _ in range(read_varint(stream))]
+        else:
+            raise HandHistoryFormatError("Unknown tag {}".format(tag))
+        actions.append(action)
+
+    return {
+        "game_id": game_id,
+        "game_type": GAME_TYPES[game_type] if game_type < len(GAME_TYPES) else None,
+        "started_at": started_at,
+        "players": players,
+        "dealer_id": players[dealer_key]["id"] if dealer_key < len(players) else None,
+        "actions": actions
+    }
+
+
+def read_hands(path: str) -> Generator[Dict[str, Any], None, None]:
+    """Decodes the hands of a hand history file (a hand cut short by a crash ends the file)"""
+    with open(path, "rb") as stream:
+        if stream.read(len(FILE_HEADER)) != FILE_HEADER:
+            raise HandHistoryFormatError("{} is not a hand history file".format(path))
+        while stream.peek(1):
+            try:
+                length = read_varint(stream)
+            except HandHistoryFormatError:
+                return
+            data = stream.read(length)
+            if len(data) != length:
+                return
+            yield decode_hand(data)
+
+
+class HandHistoryWriter:
+    """
+    Appends records to rotating files through an in-memory buffer.
+    Files are written by a single thread, so the greenlets never wait for the disk: the buffer is queued once full
+    or every FLUSH_INTERVAL seconds, and the queued chunks are handed over to the thread once its previous write
+    is over.
+    Chunks are dropped (and logged) when more than MAX_PENDING_SIZE bytes are waiting for a slow disk.
+    """
+    BUFFER_SIZE = 64 * 1024
+    FLUSH_INTERVAL = 5
+    MAX_FILE_SIZE = 64 * 1024 * 1024
+    MAX_PENDING_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, directory: str, prefix: str = "hands", max_file_size: Optional[int] = None, logger=None):
+        self._directory: str = directory
+        self._prefix: str = prefix
+        self._max_file_size: int = self.MAX_FILE_SIZE if max_file_size is None else max_file_size
+        self._logger = logger if logger else logging
+        self._buffer = bytearray()
+        # Chunks waiting for the writing thread
+        self._pending: Deque[bytes] = collections.deque()
+        self._pending_size: int = 0
+        self._pending_event = gevent.event.Event()
+        self._dropped_bytes: int = 0
+        self._closing: bool = False
+        # Only used by the writing thread
+        self._file: Optional[BinaryIO] = None
+        self._file_sequence: int = 0
+        self._thread = ThreadPool(1)
+        self._writer: Optional[gevent.Greenlet] = None
+        self._flusher: Optional[gevent.Greenlet] = None
+
+    @property
+    def dropped_bytes(self) -> int:
+        return self._dropped_bytes
+
+    def write(self, record: bytes):
+        write_varint(self._buffer, len(record))
+        self._buffer += record
+        if len(self._buffer) >= self.BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Queues the buffer for the writing thread (never waits)"""
+        if not self._buffer:
+            return
+        chunk, self._buffer = bytes(self._buffer), bytearray()
+        if self._pending_size + len(chunk) > self.MAX_PENDING_SIZE:
+            self._dropped_bytes += len(chunk)
+            self._logger.error("Hand history: {} bytes dropped, the disk can't keep up".format(len(chunk)))
+            return
+        self._pending.append(chunk)
+        self._pending_size += len(chunk)
+        self._pending_event.set()
+        if self._writer is None:
+            self._writer = gevent.spawn(self._write_pending)
+
+    def _write_pending(self):
+        # Only greenlet waiting for the thread: a single write at a time
+        while True:
+            self._pending_event.wait()
+            self._pending_event.clear()
+            while self._pending:
+                chunk = self._pending.popleft()
+                self._pending_size -= len(chunk)
+                self._thread.spawn(self._write_chunk, chunk).get()
+            if self._closing:
+                return
+
+    def _write_chunk(self, chunk: bytes):
+        try:
+            if self._file is None or self._file.tell() + len(chunk) > self._max_file_size:
+                self._rotate()
+            self._file.write(chunk)
+            self._file.flush()
+        except OSError as e:
+            self._logger.error("Unable to write {} bytes of hand history: {}".format(len(chunk), e))
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.makedirs(self._directory, exist_ok=True)
+        self._file_sequence += 1
+        path = os.path.join(self._directory, "{}-{}-{}-{:04d}.hh".format(
+            self._prefix, time.strftime("%Y%m%d-%H%M%S", time.gmtime()), os.getpid(), self._file_sequence
+        ))
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(FILE_HEADER)
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _flush_periodically(self):
+        while True:
+            gevent.sleep(self.FLUSH_INTERVAL)
+            self.flush()
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = gevent.spawn(self._flush_periodically)
+
+    def close(self):
+        """Writes the buffer and waits for the file to be closed"""
+        if self._flusher is not None:
+            self._flusher.kill()
+            self._flusher = None
+        self.flush()
+        if self._writer is not None:
+            self._closing = True
+            self._pending_event.set()
+            self._writer.join()
+            self._writer = None
+        self._thread.spawn(self._close_file).get()
+        self._thread.kill()
+
+
+class HandHistoryRecorder(GameSubscriber):
+    """Records every hand played with the games it is subscribed to, once the hand is over"""
+    def __init__(self, writer: HandHistoryWriter, logger=None):
+        self._writer: HandHistoryWriter = writer
+        self._logger = logger if logger else logging
+        # Hands being played, by game id
+        self._hands: Dict[str, HandEncoder] = {}
+
+    def game_event(self, event, event_data):
+        game_id = event_data.get("game_id")
+        try:
+            if event == "new-game":
+                self._hands[game_id] = HandEncoder(event_data)
+            elif event == "game-over":
+                hand = self._hands.pop(game_id, None)
+                if hand is not None:
+                    self._writer.write(hand.finish())
+            elif game_id in self._hands:
+                self._hands[game_id].add(event, event_data)
+        except (KeyError, TypeError, ValueError) as e:
+            # Not letting a malformed event break the recording of the other hands
+            self._hands.pop(game_id, None)
+            self._logger.error("Unable to record hand {} ({} event): {}".format(game_id, event, e))
+
+    def start(self):
+        self._writer.start()
+
+    def close(self):
+        self._writer.close()
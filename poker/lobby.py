@@ -0,0 +1,75 @@
+import zlib
+from typing import List, Optional, Any, Tuple
+
+import gevent.queue
+
+from .channel import Channel
+
+
+class LobbyShards:
+    """
+    Lobby split into several queues to avoid a single hot key.
+    Connection requests are spread by room id (all the players of a private room end up in the same shard),
+    or by player id for public rooms.
+    Shards are assigned to the game nodes by rendezvous hashing, so that only the shards of a node joining or leaving
+    are moved to a different node.
+    """
+    def __init__(self, connection_channel: str, num_shards: int = 1):
+        if num_shards < 1:
+            raise ValueError("At least one lobby shard is needed")
+        self._connection_channel: str = connection_channel
+        self._num_shards: int = num_shards
+
+    @property
+    def num_shards(self) -> int:
+        return self._num_shards
+
+    def shard_name(self, shard: int) -> str:
+        if self._num_shards == 1:
+            # Plain lobby
+            return self._connection_channel
+        return "{}:shard-{}".format(self._connection_channel, shard)
+
+    def shard_names(self) -> List[str]:
+        return [self.shard_name(shard) for shard in range(self._num_shards)]
+
+    def shard_of(self, player_id: Optional[str] = None, room_id: Optional[str] = None) -> int:
+        key = room_id if room_id is not None else player_id
+        return zlib.crc32(str(key).encode("utf-8")) % self._num_shards
+
+    def assigned_shards(self, node_id: str, node_ids: List[str]) -> List[int]:
+        """Shards to be consumed by a node, given every live node of the cluster"""
+        if node_id not in node_ids:
+            node_ids = node_ids + [node_id]
+        return [
+            shard for shard in range(self._num_shards)
+            if max(node_ids, key=lambda candidate: (self._weight(candidate, shard), candidate)) == node_id
+        ]
+
+    @staticmethod
+    def _weight(node_id: str, shard: int) -> int:
+        return zlib.crc32("{}:{}".format(node_id, shard).encode("utf-8"))
+
+
+class LobbyMemory:
+    """
+    In-process lobby: connection requests travel along with the game server end of an in-memory channel
+    """
+    def __init__(self):
+        self._requests = gevent.queue.Queue()
+
+    def __len__(self):
+        return self._requests.qsize()
+
+    def push(self, message: Any, channel: Channel):
+        self._requests.put((message, channel))
+
+    def pop_many(self, count: int, timeout: Optional[float] = None) -> List[Tuple[Any, Channel]]:
+        """Waits up to timeout seconds for a request, then returns up to count requests"""
+        try:
+            requests = [self._requests.get(timeout=timeout)]
+        except gevent.queue.Empty:
+            return []
+        while len(requests) < count and not self._requests.empty():
+            requests.append(self._requests.get_nowait())
+        return requests
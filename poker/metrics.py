@@ -0,0 +1,240 @@
+import bisect
+import logging
+import urllib.parse
+from typing import Dict, List, Tuple, Callable, Optional, Sequence
+
+from gevent import pywsgi
+
+
+class Metric:
+    """Family of samples sharing a name, one sample per combination of label values"""
+    TYPE = "untyped"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        self._name: str = name
+        self._description: str = description
+        self._label_names: Tuple[str, ...] = tuple(label_names)
+        self._children: Dict[Tuple[str, ...], "Metric"] = {}
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def labels(self, *values) -> "Metric":
+        """Sample for the given label values: to be kept by callers on hot paths"""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self._label_names):
+                raise ValueError("Metric {} expects labels {}".format(self._name, self._label_names))
+            child = self._children[values] = self._create_child()
+        return child
+
+    def remove(self, *values):
+        self._children.pop(tuple(str(value) for value in values), None)
+
+    def _create_child(self) -> "Metric":
+        return type(self)(self._name, self._description)
+
+    def _label_text(self, values: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self._label_names, values))
+        if extra is not None:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(name, value.replace('"', '\\"')) for name, value in pairs) + "}"
+
+    def _samples(self, labels: str) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = ["# HELP {} {}".format(self._name, self._description), "# TYPE {} {}".format(self._name, self.TYPE)]
+        if self._label_names:
+            for values, child in list(self._children.items()):
+                lines.extend(child._render_samples(self, values))
+        else:
+            lines.extend(self._samples(""))
+        return lines
+
+    def _render_samples(self, parent: "Metric", values: Tuple[str, ...]) -> List[str]:
+        return self._samples(parent._label_text(values))
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        Metric.__init__(self, name, description, label_names)
+        self._value: float = 0
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def inc(self, amount: float = 1):
+        self._value += amount
+
+    def _samples(self, labels: str) -> List[str]:
+        return ["{}{} {}".format(self._name, labels, self._value)]
+
+
+class Gauge(Metric):
+    """Value set by the application, or read from a function when scraped"""
+    TYPE = "gauge"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        Metric.__init__(self, name, description, label_names)
+        self._value: float = 0
+        self._function: Optional[Callable[[], float]] = None
+
+    @property
+    def value(self) -> float:
+        return self._function() if self._function is not None else self._value
+
+    def set(self, value: float):
+        self._value = value
+
+    def inc(self, amount: float = 1):
+        self._value += amount
+
+    def dec(self, amount: float = 1):
+        self._value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def _samples(self, labels: str) -> List[str]:
+        try:
+            value = self.value
+        except Exception:
+            # Not letting a broken gauge spoil the whole scrape
+            logging.exception("Unable to read gauge {}".format(self._name))
+            return []
+        return ["{}{} {}".format(self._name, labels, value)]
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+    # Seconds
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        Metric.__init__(self, name, description, label_names)
+        self._buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        # Observations per bucket (not cumulative), the last one being +Inf
+        self._counts: List[int] = [0] * (len(self._buckets) + 1)
+        self._sum: float = 0.0
+        self._count: int = 0
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def observe(self, value: float):
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    def _create_child(self) -> "Metric":
+        return Histogram(self._name, self._description, buckets=self._buckets)
+
+    def _render_samples(self, parent: "Metric", values: Tuple[str, ...]) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self._buckets + (float("inf"),), self._counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append("{}_bucket{} {}".format(self._name, parent._label_text(values, ("le", le)), cumulative))
+        labels = parent._label_text(values)
+        lines.append("{}_sum{} {}".format(self._name, labels, self._sum))
+        lines.append("{}_count{} {}".format(self._name, labels, self._count))
+        return lines
+
+    def _samples(self, labels: str) -> List[str]:
+        return self._render_samples(self, ())
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            # Declared again (module reloaded, several servers in the same process)
+            if type(existing) is not type(metric):
+                raise ValueError("Metric {} already registered with another type".format(metric.name))
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, description, label_names))
+
+    def gauge(self, name: str, description: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, description, label_names))
+
+    def histogram(self, name: str, description: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, label_names, buckets))
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Metrics of the process
+registry = MetricsRegistry()
+
+
+class MetricsServer:
+    """
+    Serves the metrics of the process over HTTP (GET /metrics), in a greenlet.
+    Extra routes (admin commands) return the content type and the body of the response, given the query parameters.
+    """
+    def __init__(self, port: int, host: str = "127.0.0.1", metrics: Optional[MetricsRegistry] = None, logger=None,
+                 routes: Optional[Dict[str, Callable[[Dict[str, str]], Tuple[str, bytes]]]] = None):
+        self._metrics: MetricsRegistry = registry if metrics is None else metrics
+        self._routes: Dict[str, Callable[[Dict[str, str]], Tuple[str, bytes]]] = {} if routes is None else routes
+        self._server = pywsgi.WSGIServer((host, port), self._application, log=None)
+        self._logger = logger if logger else logging
+
+    def _application(self, environ, start_response):
+        path = environ.get("PATH_INFO")
+        if path == "/metrics":
+            content_type, body = "text/plain; version=0.0.4", self._metrics.render().encode("utf-8")
+        elif path in self._routes:
+            query = {key: values[-1] for key, values in urllib.parse.parse_qs(environ.get("QUERY_STRING", "")).items()}
+            try:
+                content_type, body = self._routes[path](query)
+            except Exception as e:
+                self._logger.exception("Admin command {} failed".format(path))
+                start_response("400 Bad Request", [("Content-Type", "text/plain")])
+                return ["{}\n".format(e).encode("utf-8")]
+        else:
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b"Not found\n"]
+        start_response("200 OK", [("Content-Type", content_type), ("Content-Length", str(len(body)))])
+        return [body]
+
+    @property
+    def address(self):
+        return self._server.address
+
+    def start(self):
+        self._server.start()
+        self._logger.info("Metrics served on http://{}:{}/metrics".format(*self._server.address[:2]))
+
+    def stop(self):
+        self._server.stop()
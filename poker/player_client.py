@@ -1,11 +1,16 @@
 import time
-from typing import Any, Optional
+from typing import Any, Optional, Union
 
 from redis import Redis
 
 from .player import Player
 from .channel import MessageFormatError, Channel
+from .channel_inbox import Inbox
+from .channel_memory import ChannelMemory
 from .channel_redis import ChannelRedis, MessageQueue
+from .channel_redis_stream import ChannelRedisStream
+from .lobby import LobbyShards, LobbyMemory
+from .redis_shards import RedisShards
 
 
 class PlayerClient:
@@ -28,6 +33,9 @@ class PlayerClient:
     def recv_message(self, timeout_epoch: Optional[float] = None) -> Any:
         return self._server_channel.recv_message(timeout_epoch)
 
+    def heartbeat(self):
+        self._server_channel.heartbeat()
+
     def close(self):
         self._server_channel.close()
 
@@ -35,35 +43,100 @@ class PlayerClient:
 class PlayerClientConnector:
     CONNECTION_TIMEOUT = 30
 
-    def __init__(self, redis: Redis, connection_channel: str, logger):
+    def __init__(self, redis: Redis, connection_channel: str, logger, lobby_shards: int = 1,
+                 inbox: Optional[Inbox] = None, streams: bool = False,
+                 session_redis: Optional[Union[Redis, RedisShards]] = None):
         self._redis = redis
-        self._connection_queue = MessageQueue(redis, connection_channel)
+        # Session channels, possibly spread over several Redis endpoints
+        self._session_redis = redis if session_redis is None else session_redis
+        self._lobby = LobbyShards(connection_channel, lobby_shards)
+        # Sessions multiplexed over the inbox of the process (dedicated queues otherwise)
+        self._inbox: Optional[Inbox] = inbox
+        # Sessions over Redis streams (at-least-once delivery) when not multiplexed
+        self._streams: bool = streams
+        self._logger = logger
+
+    def connect(self, player: Player, session_id: str, room_id: str) -> PlayerClient:
+        if self._inbox is not None:
+            # The game server inbox is known once the connection is acknowledged.
+            # Opened before requesting the connection: the inbox drops messages of unknown sessions
+            server_channel = self._inbox.open_channel(session_id)
+        elif self._streams:
+            server_channel = ChannelRedisStream(
+                self._session_redis,
+                "poker5:player-{}:session-{}:stream-O".format(player.id, session_id),
+                "poker5:player-{}:session-{}:stream-I".format(player.id, session_id),
+                consumer="gateway-{}".format(session_id)
+            )
+        else:
+            server_channel = ChannelRedis(
+                self._session_redis,
+                "poker5:player-{}:session-{}:O".format(player.id, session_id),
+                "poker5:player-{}:session-{}:I".format(player.id, session_id)
+            )
+
+        try:
+            # Requesting new connection
+            lobby_shard = self._lobby.shard_of(player_id=player.id, room_id=room_id)
+            MessageQueue(self._redis, self._lobby.shard_name(lobby_shard)).push(
+                {
+                    "message_type": "connect",
+                    "timeout_epoch": time.time() + PlayerClientConnector.CONNECTION_TIMEOUT,
+                    "player": {
+                        "id": player.id,
+                        "name": player.name,
+                        "money": player.money
+                    },
+                    "session_id": session_id,
+                    "room_id": room_id,
+                    "requested_at": time.time(),
+                    "reply_to": None if self._inbox is None else self._inbox.name,
+                    "channel": "stream" if self._streams else "queue"
+                }
+            )
+
+            # Reading connection response
+            connection_message = server_channel.recv_message(time.time() + PlayerClientConnector.CONNECTION_TIMEOUT)
+            MessageFormatError.validate_message_type(connection_message, "connect")
+        except:
+            server_channel.close()
+            raise
+        self._logger.info("{}: connected to server {}".format(player, connection_message["server_id"]))
+        return PlayerClient(player, connection_message, server_channel)
+
+
+class PlayerClientConnectorMemory:
+    """Connects players to a game server running in the same process"""
+    CONNECTION_TIMEOUT = 30
+
+    def __init__(self, lobby: LobbyMemory, logger):
+        self._lobby: LobbyMemory = lobby
         self._logger = logger
 
     def connect(self, player: Player, session_id: str, room_id: str) -> PlayerClient:
-        # Requesting new connection
-        self._connection_queue.push(
+        server_channel, player_channel = ChannelMemory.pair()
+        self._lobby.push(
             {
                 "message_type": "connect",
-                "timeout_epoch": time.time() + PlayerClientConnector.CONNECTION_TIMEOUT,
+                "timeout_epoch": time.time() + PlayerClientConnectorMemory.CONNECTION_TIMEOUT,
                 "player": {
                     "id": player.id,
                     "name": player.name,
                     "money": player.money
                 },
                 "session_id": session_id,
-                "room_id": room_id
-            }
-        )
-
-        server_channel = ChannelRedis(
-            self._redis,
-            "poker5:player-{}:session-{}:O".format(player.id, session_id),
-            "poker5:player-{}:session-{}:I".format(player.id, session_id)
+                "room_id": room_id,
+                "requested_at": time.time()
+            },
+            player_channel
         )
 
         # Reading connection response
-        connection_message = server_channel.recv_message(time.time() + PlayerClientConnector.CONNECTION_TIMEOUT)
-        MessageFormatError.validate_message_type(connection_message, "connect")
+        try:
+            connection_message = server_channel.recv_message(time.time() + PlayerClientConnectorMemory.CONNECTION_TIMEOUT)
+            MessageFormatError.validate_message_type(connection_message, "connect")
+        except:
+            server_channel.close()
+            raise
         self._logger.info("{}: connected to server {}".format(player, connection_message["server_id"]))
         return PlayerClient(player, connection_message, server_channel)
@@ -1,24 +1,225 @@
+import collections
 import logging
 import time
-from typing import Any, Optional
+from typing import Any, Optional, Dict, Deque
 
-from .channel import MessageFormatError, ChannelError, MessageTimeout, Channel
+import gevent
+
+from .channel import ChannelError, Channel, MessageTimeout, MessageFormatError
 from .player import Player
+from .profiling import accounting
+from .tracing import Tracer
+
+
+class PlayerOutbox:
+    """
+    Bounded queue of messages waiting to be sent to a player.
+    The queue depth includes messages not consumed yet by the remote end of the channel (when known).
+    Each outbox sends to a single channel: a player reconnecting gets a new outbox.
+    """
+    # On overflow, pending state updates are replaced by the most recent ones (non-critical updates are dropped)
+    POLICY_COALESCE = "coalesce"
+    # On overflow, non-critical updates are dropped
+    POLICY_DROP = "drop"
+    # Nothing is ever dropped, the player is disconnected when the backlog lasts too long
+    POLICY_DISCONNECT = "disconnect"
+
+    # Game updates superseded by the following update of the same type
+    SUPERSEDED_EVENTS = {"pots-update"}
+    # Game updates which can be skipped without breaking the game for the player
+    NON_CRITICAL_EVENTS = {"pots-update", "bet", "fold", "cards-change"}
+
+    BACKLOG_POLL_INTERVAL = 0.5
+
+    def __init__(self, player: "PlayerServer", channel: Channel, max_size: int, policy: str,
+                 max_backlog_time: Optional[float], previous: Optional["PlayerOutbox"] = None):
+        if policy not in (self.POLICY_COALESCE, self.POLICY_DROP, self.POLICY_DISCONNECT):
+            raise ValueError("Unknown overflow policy '{}'".format(policy))
+        if policy == self.POLICY_DISCONNECT and max_backlog_time is None:
+            raise ValueError("A maximum backlog time is required by the disconnect policy")
+        self._player: PlayerServer = player
+        self._channel: Channel = channel
+        # Outbox of the same channel whose messages need to be delivered first
+        self._previous: Optional[PlayerOutbox] = previous
+        self._max_size: int = max_size
+        self._policy: str = policy
+        self._max_backlog_time: Optional[float] = max_backlog_time
+        self._messages: Deque[Any] = collections.deque()
+        self._remote_depth: int = 0
+        self._backlog_since: Optional[float] = None
+        self._sender: Optional[gevent.Greenlet] = None
+        self._max_depth: int = 0
+        self._dropped: int = 0
+        self._coalesced: int = 0
+
+    @property
+    def channel(self) -> Channel:
+        return self._channel
+
+    @property
+    def depth(self) -> int:
+        return len(self._messages) + self._remote_depth
+
+    @property
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "depth": self.depth,
+            "local_depth": len(self._messages),
+            "remote_depth": self._remote_depth,
+            "max_depth": self._max_depth,
+            "dropped": self._dropped,
+            "coalesced": self._coalesced
+        }
+
+    def push(self, message: Any) -> bool:
+        """Queues a message. Returns False if the message was discarded"""
+        self._check_backlog()
+        if not self._player.connected:
+            # Slow connection dropped
+            return False
+
+        if self.depth >= self._max_size and not self._on_overflow(message):
+            return False
+
+        self._messages.append(message)
+        self._max_depth = max(self._max_depth, self.depth)
+
+        if self._sender is None:
+            self._sender = gevent.spawn(self._send_messages)
+            accounting.adopt(self._sender)
+        return True
+
+    def flush(self, timeout: Optional[float] = None):
+        """Waits until every queued message was handed over to the channel"""
+        if self._sender is not None and self._sender is not gevent.getcurrent():
+            self._sender.join(timeout)
+
+    def clear(self):
+        self._messages.clear()
+        self._remote_depth = 0
+        self._backlog_since = None
+
+    def close(self, timeout: Optional[float] = None) -> gevent.Greenlet:
+        """Delivers the queued messages (for timeout seconds at most), then closes the channel, in a separate greenlet"""
+        def close():
+            self.flush(timeout)
+            self.shutdown()
+        return gevent.spawn(close)
+
+    def shutdown(self):
+        """Discards the queued messages and closes the channel"""
+        self.clear()
+        try:
+            self._channel.send_message({"message_type": "disconnect"})
+        except ChannelError:
+            pass
+        self._channel.close()
+
+    def _on_overflow(self, message: Any) -> bool:
+        if self._policy == self.POLICY_DISCONNECT or not self._is_non_critical(message):
+            return True
+
+        if self._policy == self.POLICY_COALESCE and message["event"] in self.SUPERSEDED_EVENTS:
+            try:
+                superseded = next(
+                    pending for pending in self._messages
+                    if self._is_non_critical(pending) and pending["event"] == message["event"]
+                )
+            except StopIteration:
+                pass
+            else:
+                self._messages.remove(superseded)
+                self._coalesced += 1
+                return True
+
+        self._dropped += 1
+        return False
+
+    def _is_non_critical(self, message: Any) -> bool:
+        return message.get("message_type") == "game-update" \
+            and message.get("event") in self.NON_CRITICAL_EVENTS \
+            and "target" not in message
+
+    def _check_backlog(self):
+        if self.depth < self._max_size:
+            self._backlog_since = None
+        elif self._backlog_since is None:
+            self._backlog_since = time.time()
+        elif self._max_backlog_time is not None and time.time() - self._backlog_since > self._max_backlog_time:
+            if self._player.outbox is self:
+                self._player.drop_slow_connection()
+
+    def _send_messages(self):
+        try:
+            if self._previous is not None:
+                self._previous.flush()
+                self._previous = None
+            while self._messages:
+                if self._remote_depth >= self._max_size:
+                    # The remote end is not keeping up: waiting for it to catch up
+                    gevent.sleep(self.BACKLOG_POLL_INTERVAL)
+                    self._remote_depth = self._channel.outbound_backlog()
+                    self._check_backlog()
+                    continue
+                message = self._messages.popleft()
+                if "trace" in message:
+                    message = Tracer.stamp(message, "pushed")
+                self._remote_depth = self._channel.send_message(message) or 0
+        except ChannelError as e:
+            if self._player.outbox is self:
+                # Replaced outboxes don't affect the current connection
+                self._player.drop_connection(e)
+        finally:
+            self._sender = None
 
 
 class PlayerServer(Player):
-    def __init__(self, channel: Channel, logger, *args, **kwargs):
+    OUTBOX_SIZE = 200
+    OUTBOX_POLICY = PlayerOutbox.POLICY_COALESCE
+    OUTBOX_MAX_BACKLOG_TIME = 60
+    DISCONNECT_FLUSH_TIMEOUT = 2
+
+    def __init__(self, channel: Channel, logger, *args, outbox_size: Optional[int] = None,
+                 outbox_policy: Optional[str] = None, max_backlog_time: Optional[float] = None, **kwargs):
         Player.__init__(self, *args, **kwargs)
         self._channel: Channel = channel
         self._connected: bool = True
+        self._last_seen: float = time.time()
+        # Last game event acknowledged by the client
+        self._last_ack: int = 0
+        # Messages received while waiting for an acknowledgement
+        self._unread: Deque[Any] = collections.deque()
         self._logger = logger if logger else logging
+        self._outbox_size: int = self.OUTBOX_SIZE if outbox_size is None else outbox_size
+        self._outbox_policy: str = self.OUTBOX_POLICY if outbox_policy is None else outbox_policy
+        self._max_backlog_time: Optional[float] = \
+            self.OUTBOX_MAX_BACKLOG_TIME if max_backlog_time is None else max_backlog_time
+        self._outbox: PlayerOutbox = self._create_outbox(channel)
+
+    def _create_outbox(self, channel: Channel, previous: Optional[PlayerOutbox] = None) -> PlayerOutbox:
+        return PlayerOutbox(self, channel, max_size=self._outbox_size, policy=self._outbox_policy,
+                            max_backlog_time=self._max_backlog_time, previous=previous)
 
     def disconnect(self):
-        """Disconnect the client"""
+        """Disconnect the client (pending messages are delivered in the background)"""
+        if self._connected:
+            self._connected = False
+            self._outbox.close(self.DISCONNECT_FLUSH_TIMEOUT)
+
+    def drop_connection(self, error: ChannelError):
+        if self._connected:
+            self._logger.error("Unable to send data to {}: {}".format(self, error))
+            self._close()
+
+    def drop_slow_connection(self):
+        if self._connected:
+            self._logger.error("Disconnecting {}: too many messages waiting to be sent {}".format(self, self._outbox.metrics))
+            self._close()
+
+    def _close(self):
         if self._connected:
-            self.try_send_message({"message_type": "disconnect"})
-            self._channel.close()
             self._connected = False
+            self._outbox.shutdown()
 
     @property
     def channel(self) -> Channel:
@@ -28,34 +229,85 @@ class PlayerServer(Player):
     def connected(self) -> bool:
         return self._connected
 
+    @property
+    def outbox(self) -> PlayerOutbox:
+        return self._outbox
+
+    @property
+    def last_seen(self) -> float:
+        """Last time a message or a heartbeat was received from the client"""
+        last_heartbeat = self._channel.last_heartbeat()
+        return self._last_seen if last_heartbeat is None else max(self._last_seen, last_heartbeat)
+
+    def is_alive(self, timeout: float) -> bool:
+        if not self._connected:
+            return False
+        try:
+            last_heartbeat = self._channel.last_heartbeat()
+        except ChannelError:
+            return False
+        if last_heartbeat is None:
+            # Liveness can't be tracked without heartbeats
+            return True
+        return time.time() - max(self._last_seen, last_heartbeat) < timeout
+
     def update_channel(self, new_player):
+        # Called while holding the room lock: the old channel is flushed and closed in the background
         self.disconnect()
+        # Messages previously sent to the new player need to be delivered first
+        self._outbox = self._create_outbox(new_player.channel, previous=new_player.outbox)
         self._channel = new_player.channel
         self._connected = new_player.connected
-
-    def ping(self) -> bool:
-        try:
-            self.send_message({"message_type": "ping"})
-            message = self.recv_message(timeout_epoch=time.time() + 2)
-            MessageFormatError.validate_message_type(message, expected="pong")
-            return True
-        except (ChannelError, MessageTimeout, MessageFormatError) as e:
-            self._logger.error("Unable to ping {}: {}".format(self, e))
-            self.disconnect()
-            return False
+        self._last_seen = time.time()
 
     def try_send_message(self, message: Any) -> bool:
         try:
-            self.send_message(message)
-            return True
+            return self.send_message(message)
         except ChannelError:
             return False
 
-    def send_message(self, message: Any):
-        return self._channel.send_message(message)
+    def send_message(self, message: Any) -> bool:
+        if not self._connected:
+            raise ChannelError("Unable to send data to {} (not connected)".format(self))
+        return self._outbox.push(message)
 
     def recv_message(self, timeout_epoch: Optional[float] = None) -> Any:
-        message = self._channel.recv_message(timeout_epoch)
+        if not self._connected:
+            raise ChannelError("Unable to receive data from {} (not connected)".format(self))
+        if self._unread:
+            message = self._unread.popleft()
+        else:
+            message = self._recv_message(timeout_epoch)
+            while self._read_ack(message):
+                message = self._recv_message(timeout_epoch)
         if "message_type" in message and message["message_type"] == "disconnect":
             raise ChannelError("Client disconnected")
         return message
+
+    def wait_ack(self, event_id: int, timeout_epoch: float) -> bool:
+        """Waits until the client acknowledged the given game event"""
+        try:
+            while self._last_ack < event_id:
+                message = self._recv_message(timeout_epoch)
+                if not self._read_ack(message):
+                    self._unread.append(message)
+            return True
+        except (ChannelError, MessageTimeout, MessageFormatError):
+            return False
+
+    def _recv_message(self, timeout_epoch: Optional[float]) -> Any:
+        message = self._channel.recv_message(timeout_epoch)
+        self._last_seen = time.time()
+        if isinstance(message, dict) and "trace" in message:
+            message = Tracer.stamp(message, "popped")
+        return message
+
+    def _read_ack(self, message: Any) -> bool:
+        if message.get("message_type") != "ack":
+            return False
+        try:
+            self._last_ack = max(self._last_ack, int(message["event_id"]))
+        except (KeyError, TypeError, ValueError):
+            # Invalid acknowledgements are simply ignored
+            pass
+        return True
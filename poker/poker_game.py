@@ -1,14 +1,28 @@
+import itertools
 import time
 from typing import List, Dict, Set, Generator, Optional
 
 import gevent
+import gevent.queue
 
 from .card import Card
 from .channel import ChannelError, MessageTimeout, MessageFormatError
 from .deck import DeckFactory, Deck
+from .metrics import registry
 from .player import Player
 from .player_server import PlayerServer
+from .profiling import accounting
 from .score_detector import Score, ScoreDetector
+from .structured_log import LogPayload, LogSampler
+from .tracing import tracer, Tracer, INBOUND
+
+BET_DECISION_TIME = registry.histogram(
+    "poker_bet_decision_seconds", "Time from a bet request to the player decision",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+)
+EVENT_FANOUT_TIME = registry.histogram(
+    "poker_event_fanout_seconds", "Time from a game event being raised to its delivery by a subscriber"
+)
 
 
 class GameError(Exception):
@@ -20,7 +34,7 @@ class EndGameException(Exception):
 
 
 class GameFactory:
-    def create_game(self, players: List[PlayerServer]):
+    def create_game(self, players: List[PlayerServer], pacer: Optional["GamePacer"] = None):
         raise NotImplemented
 
 
@@ -205,32 +219,152 @@ class GamePots:
             raise ValueError("Invalid bets")
 
 
+class GameEventWorker:
+    POLICY_BLOCK = "block"
+    POLICY_DROP = "drop"
+    POLICY_COALESCE = "coalesce"
+
+    COALESCE_EVENTS = {"pots-update"}
+
+    def __init__(self, subscriber: GameSubscriber, logger, policy: str = POLICY_BLOCK, max_size: int = 100):
+        if policy not in (self.POLICY_BLOCK, self.POLICY_DROP, self.POLICY_COALESCE):
+            raise ValueError("Unknown backpressure policy '{}'".format(policy))
+        self._subscriber: GameSubscriber = subscriber
+        self._logger = logger
+        self._policy: str = policy
+        self._queue = gevent.queue.JoinableQueue(max_size)
+        # Last queued item, still waiting to be processed (candidate for coalescing)
+        self._tail: Optional[list] = None
+        self._dropped: int = 0
+        self._coalesced: int = 0
+        self._greenlet = gevent.spawn(self._run)
+        accounting.adopt(self._greenlet)
+
+    @property
+    def subscriber(self) -> GameSubscriber:
+        return self._subscriber
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped
+
+    @property
+    def coalesced(self) -> int:
+        return self._coalesced
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def push(self, event, event_data):
+        if self._policy == self.POLICY_COALESCE \
+                and event in self.COALESCE_EVENTS \
+                and self._tail is not None \
+                and self._tail[0] == event:
+            # The pending update was not delivered yet: replacing it with the most recent one
+            self._tail[1] = event_data
+            self._coalesced += 1
+            return
+
+        # Raise time kept for the fan-out latency
+        item = [event, event_data, time.time()]
+
+        if self._policy == self.POLICY_DROP:
+            try:
+                self._queue.put_nowait(item)
+            except gevent.queue.Full:
+                self._dropped += 1
+                return
+        else:
+            self._queue.put(item)
+
+        self._tail = item
+
+    def sync(self, timeout: Optional[float] = None) -> bool:
+        """Waits until every queued event was handled by the subscriber"""
+        return self._queue.join(timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        self.sync(timeout)
+        self._greenlet.kill()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._tail:
+                self._tail = None
+            try:
+                self._subscriber.game_event(item[0], item[1])
+                EVENT_FANOUT_TIME.observe(time.time() - item[2])
+            except Exception:
+                self._logger.exception("Subscriber {} failed to handle event {}".format(self._subscriber, item[0]))
+            finally:
+                self._queue.task_done()
+
+
 class GameEventDispatcher:
-    def __init__(self, game_id: str, logger):
-        self._subscribers: List[GameSubscriber] = []
+    # Event ids are unique and increasing within the process, so that clients can acknowledge them
+    _event_ids = itertools.count(1)
+
+    def __init__(self, game_id: str, logger, policy: str = GameEventWorker.POLICY_BLOCK, max_queue_size: int = 100,
+                 log_sampler: Optional[LogSampler] = None):
+        self._workers: List[GameEventWorker] = []
         self._game_id: str = game_id
         self._logger = logger
+        self._log_sampler: Optional[LogSampler] = log_sampler
+        # Last event broadcast to every player and last event targeting each player
+        self._last_event_id: int = 0
+        self._last_target_event_ids: Dict[str, int] = {}
+        self._policy: str = policy
+        self._max_queue_size: int = max_queue_size
 
-    def subscribe(self, subscriber: GameSubscriber):
-        self._subscribers.append(subscriber)
+    @property
+    def game_id(self) -> str:
+        return self._game_id
+
+    def last_event_id(self, player_id: str) -> int:
+        """Id of the last event sent to the given player"""
+        return max(self._last_event_id, self._last_target_event_ids.get(player_id, 0))
+
+    def subscribe(self, subscriber: GameSubscriber, policy: Optional[str] = None, max_queue_size: Optional[int] = None):
+        self._workers.append(GameEventWorker(
+            subscriber=subscriber,
+            logger=self._logger,
+            policy=self._policy if policy is None else policy,
+            max_size=self._max_queue_size if max_queue_size is None else max_queue_size
+        ))
 
     def unsubscribe(self, subscriber: GameSubscriber):
-        self._subscribers.remove(subscriber)
+        worker = next(worker for worker in self._workers if worker.subscriber is subscriber)
+        self._workers.remove(worker)
+        worker.close()
+
+    def sync(self, timeout: Optional[float] = None):
+        """Waits until all the events raised so far were delivered to every subscriber"""
+        for worker in self._workers:
+            worker.sync(timeout)
+
+    def close(self):
+        """Delivers pending events and stops every subscriber worker"""
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
 
     def raise_event(self, event, event_data):
+        event_id = next(GameEventDispatcher._event_ids)
+        if "target" in event_data:
+            self._last_target_event_ids[event_data["target"]] = event_id
+        else:
+            self._last_event_id = event_id
         event_data["event"] = event
         event_data["game_id"] = self._game_id
-        self._logger.debug(
-            "\n" +
-            ("-" * 80) + "\n"
-            "GAME: {}\nEVENT: {}".format(self._game_id, event) + "\n" +
-            str(event_data) + "\n" +
-            ("-" * 80) + "\n"
-        )
-        gevent.joinall([
-            gevent.spawn(subscriber.game_event, event, event_data)
-            for subscriber in self._subscribers
-        ])
+        event_data["event_id"] = event_id
+        if tracer.enabled and tracer.sample():
+            event_data["trace"] = {"raised": time.time()}
+        if self._log_sampler is None or self._log_sampler.sample(event):
+            self._logger.debug(LogPayload(game=self._game_id, event=event, data=event_data))
+        for worker in self._workers:
+            worker.push(event, event_data)
 
     def cards_assignment_event(self, player: Player, cards: List[Card], score: Score):
         self.raise_event(
@@ -286,7 +420,7 @@ class GameEventDispatcher:
                 "player": player.dto(),
                 "min_bet": min_bet,
                 "max_bet": max_bet,
-                "bets": bets,
+                "bets": dict(bets),
                 "timeout": timeout,
                 "timeout_date": time.strftime("%Y-%m-%d %H:%M:%S+0000", time.gmtime(timeout_epoch))
             }
@@ -299,7 +433,7 @@ class GameEventDispatcher:
                 "player": player.dto(),
                 "bet": bet,
                 "bet_type": bet_type,
-                "bets": bets
+                "bets": dict(bets)
             }
         )
 
@@ -334,6 +468,43 @@ class GameEventDispatcher:
         )
 
 
+class GamePacer:
+    """Pauses the game for a fixed amount of time, giving clients time to animate game events"""
+    def wait(self, players: List[Player], event_dispatcher: "GameEventDispatcher", seconds: float):
+        gevent.sleep(seconds)
+
+    @staticmethod
+    def create(profile: str) -> "GamePacer":
+        if profile == "fixed":
+            return GamePacer()
+        elif profile == "ack":
+            return GameAckPacer()
+        elif profile == "turbo":
+            return GameAckPacer(max_wait_ratio=GameAckPacer.TURBO_MAX_WAIT_RATIO)
+        raise ValueError("Unknown pacing profile '{}'".format(profile))
+
+
+class GameAckPacer(GamePacer):
+    """
+    Moves on as soon as every connected client acknowledged the last game event.
+    The fixed waits (scaled by max_wait_ratio) are used as upper bounds.
+    """
+    TURBO_MAX_WAIT_RATIO = 0.3
+
+    def __init__(self, max_wait_ratio: float = 1.0):
+        self._max_wait_ratio: float = max_wait_ratio
+
+    def wait(self, players: List[Player], event_dispatcher: "GameEventDispatcher", seconds: float):
+        timeout_epoch = time.time() + seconds * self._max_wait_ratio
+        # wait_ack gives up at timeout_epoch: not joining with a timeout, as the game would then
+        # read the player channels while the acknowledgements are still being read
+        gevent.joinall([
+            gevent.spawn(player.wait_ack, event_dispatcher.last_event_id(player.id), timeout_epoch)
+            for player in players
+            if isinstance(player, PlayerServer) and player.connected
+        ])
+
+
 class GameWinnersDetector:
     def __init__(self, game_players: GamePlayers):
         self._game_players: GamePlayers = game_players
@@ -438,27 +609,33 @@ class GameBetRounder:
 
 
 class GameBetHandler:
-    def __init__(self, game_players: GamePlayers, bet_rounder: GameBetRounder, event_dispatcher: GameEventDispatcher, bet_timeout: int, timeout_tolerance: int, wait_after_round: int):
+    PRE_ACTIONS = {"check-fold", "check", "fold-to-any-bet", "call-any"}
+
+    def __init__(self, game_players: GamePlayers, bet_rounder: GameBetRounder, event_dispatcher: GameEventDispatcher, bet_timeout: int, timeout_tolerance: int, wait_after_round: int, pacer: Optional[GamePacer] = None):
         self._game_players: GamePlayers = game_players
         self._bet_rounder: GameBetRounder = bet_rounder
         self._event_dispatcher: GameEventDispatcher = event_dispatcher
         self._bet_timeout: int = bet_timeout
         self._timeout_tolerance: int = timeout_tolerance
         self._wait_after_round: int = wait_after_round
+        self._pacer: GamePacer = pacer if pacer else GamePacer()
+        # Actions queued by the players ahead of their turn, keyed by player id
+        self._pre_actions: Dict[str, str] = {}
 
     def any_bet(self, bets: Dict[str, float]) -> bool:
         return any(k for k in bets if bets[k] > 0)
 
     def bet_round(self, dealer_id: str, bets: Dict[str, float], pots: GamePots):
         best_player = self._bet_rounder.bet_round(dealer_id, bets, self.get_bet, self.on_bet)
-        gevent.sleep(self._wait_after_round)
+        self._pacer.wait(self._game_players.all, self._event_dispatcher, self._wait_after_round)
         if self.any_bet(bets):
             pots.add_bets(bets)
             self._event_dispatcher.pots_update_event(self._game_players.active, pots)
         return best_player
 
     def get_bet(self, player, min_bet: float, max_bet: float, bets: Dict[str, float]) -> Optional[int]:
-        timeout_epoch = time.time() + self._bet_timeout
+        requested_at = time.time()
+        timeout_epoch = requested_at + self._bet_timeout
         self._event_dispatcher.bet_action_event(
             player=player,
             min_bet=min_bet,
@@ -467,11 +644,34 @@ class GameBetHandler:
             timeout=self._bet_timeout,
             timeout_epoch=timeout_epoch
         )
-        return self.receive_bet(player, min_bet, max_bet, timeout_epoch)
+        bet = self.receive_bet(player, min_bet, max_bet, timeout_epoch)
+        BET_DECISION_TIME.observe(time.time() - requested_at)
+        return bet
 
     def receive_bet(self, player, min_bet, max_bet, timeout_epoch) -> Optional[int]:
         try:
-            message = player.recv_message(timeout_epoch=timeout_epoch)
+            while True:
+                pre_action = self._pre_actions.get(player.id)
+                try:
+                    # With a pending pre-action, only the messages already queued are read
+                    message = player.recv_message(timeout_epoch=timeout_epoch if pre_action is None else time.time())
+                except MessageTimeout:
+                    if pre_action is None:
+                        raise
+                    # Pre-actions are only used once
+                    del self._pre_actions[player.id]
+                    bet = self._pre_action_bet(pre_action, min_bet)
+                    if bet is not None:
+                        return bet
+                    # Pre-action condition does not hold: waiting for the player
+                    continue
+
+                if message.get("message_type") != "pre-action":
+                    # An explicit bet overrides any pending pre-action
+                    self._pre_actions.pop(player.id, None)
+                    break
+
+                self.set_pre_action(player, message)
 
             MessageFormatError.validate_message_type(message, "bet")
 
@@ -489,12 +689,41 @@ class GameBetHandler:
                         attribute="bet",
                         desc="Bet out of range. min: {} max: {}, actual: {}".format(min_bet, max_bet, bet)
                     )
+                if "trace" in message:
+                    Tracer.finish(message, "handled", INBOUND)
                 return bet
 
         except (ChannelError, MessageFormatError, MessageTimeout) as e:
-            player.send_message({"message_type": "error", "error": e.args[0]})
+            player.try_send_message({"message_type": "error", "error": e.args[0]})
             return None
 
+    def set_pre_action(self, player: Player, message):
+        """Stores (or cancels) an action to be taken as soon as it's the player turn to bet"""
+        if "action" not in message:
+            raise MessageFormatError(attribute="action", desc="Attribute is missing")
+
+        if message["action"] not in GameBetHandler.PRE_ACTIONS and message["action"] != "cancel":
+            raise MessageFormatError(attribute="action", desc="Unknown pre-action '{}'".format(message["action"]))
+
+        if message.get("game_id") != self._event_dispatcher.game_id:
+            # Sent during a previous game
+            return
+
+        if message["action"] == "cancel":
+            self._pre_actions.pop(player.id, None)
+        else:
+            self._pre_actions[player.id] = message["action"]
+
+    def _pre_action_bet(self, pre_action: str, min_bet: float) -> Optional[float]:
+        if pre_action == "check-fold":
+            return 0.0 if min_bet == 0.0 else -1
+        elif pre_action == "check":
+            return 0.0 if min_bet == 0.0 else None
+        elif pre_action == "fold-to-any-bet":
+            return -1 if min_bet > 0.0 else None
+        elif pre_action == "call-any":
+            return min_bet
+
     def on_bet(self, player: Player, bet: float, min_bet: float, max_bet: float, bets: Dict[str, float]):
         def get_bet_type(bet):
             if bet == 0:
@@ -515,6 +744,7 @@ class GameBetHandler:
 
 
 class PokerGame:
+    GAME_TYPE = "poker"
     TIMEOUT_TOLERANCE = 2
     BET_TIMEOUT = 30
 
@@ -523,22 +753,33 @@ class PokerGame:
     WAIT_AFTER_SHOWDOWN = 2
     WAIT_AFTER_WINNER_DESIGNATION = 5
 
-    def __init__(self, id: str, game_players: GamePlayers, event_dispatcher: GameEventDispatcher, deck_factory: DeckFactory, score_detector: ScoreDetector):
+    def __init__(self, id: str, game_players: GamePlayers, event_dispatcher: GameEventDispatcher, deck_factory: DeckFactory, score_detector: ScoreDetector, pacer: Optional[GamePacer] = None):
         self._id: str = id
         self._game_players: GamePlayers = game_players
         self._event_dispatcher: GameEventDispatcher = event_dispatcher
         self._deck_factory: DeckFactory = deck_factory
         self._score_detector: ScoreDetector = score_detector
+        self._pacer: GamePacer = pacer if pacer else GamePacer()
         self._bet_handler: GameBetHandler = self._create_bet_handler()
         self._winners_detector: GameWinnersDetector = self._create_winners_detector()
+        self._scores: Optional[GameScores] = None
 
     @property
     def event_dispatcher(self) -> GameEventDispatcher:
         return self._event_dispatcher
 
+    @property
+    def scores(self) -> Optional[GameScores]:
+        """Scores of the hand being played"""
+        return self._scores
+
     def play_hand(self, dealer_id: str):
         raise NotImplemented
 
+    def _wait(self, seconds: float):
+        """Gives clients time to animate the last game events"""
+        self._pacer.wait(self._game_players.all, self._event_dispatcher, seconds)
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # Factory methods
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -550,7 +791,8 @@ class PokerGame:
             event_dispatcher=self._event_dispatcher,
             bet_timeout=self.BET_TIMEOUT,
             timeout_tolerance=self.TIMEOUT_TOLERANCE,
-            wait_after_round=self.WAIT_AFTER_BET_ROUND
+            wait_after_round=self.WAIT_AFTER_BET_ROUND,
+            pacer=self._pacer
         )
 
     def _create_winners_detector(self) -> GameWinnersDetector:
@@ -560,7 +802,8 @@ class PokerGame:
         return GamePots(self._game_players)
 
     def _create_scores(self) -> GameScores:
-        return GameScores(self._score_detector)
+        self._scores = GameScores(self._score_detector)
+        return self._scores
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # Cards handler
@@ -572,7 +815,7 @@ class PokerGame:
             # Distribute cards
             scores.assign_cards(player.id, deck.pop_cards(number_of_cards))
             self._send_player_score(player, scores)
-        gevent.sleep(self.WAIT_AFTER_CARDS_ASSIGNMENT)
+        self._wait(self.WAIT_AFTER_CARDS_ASSIGNMENT)
 
     def _send_player_score(self, player: Player, scores: GameScores):
         self._event_dispatcher.cards_assignment_event(
@@ -608,8 +851,8 @@ class PokerGame:
                     upcoming_pots=pots[(i + 1):]
                 )
 
-                gevent.sleep(self.WAIT_AFTER_WINNER_DESIGNATION)
+                self._wait(self.WAIT_AFTER_WINNER_DESIGNATION)
 
     def _showdown(self, scores: GameScores):
         self._event_dispatcher.showdown_event(self._game_players.active, scores)
-        gevent.sleep(self.WAIT_AFTER_SHOWDOWN)
+        self._wait(self.WAIT_AFTER_SHOWDOWN)
@@ -1,25 +1,26 @@
 import uuid
 from typing import Optional, List
 
-import gevent
-
 from .deck import DeckFactory
 from .player import Player
-from .poker_game import PokerGame, GameFactory, GameError, EndGameException, GamePlayers, GameEventDispatcher, GameSubscriber
+from .poker_game import PokerGame, GameFactory, GameError, EndGameException, GamePlayers, GameEventDispatcher, GameSubscriber, GamePacer
 from .score_detector import HoldemPokerScoreDetector
+from .structured_log import LogSampler
 
 
 class HoldemPokerGameFactory(GameFactory):
-    def __init__(self, big_blind: float, small_blind: float, logger, game_subscribers: Optional[List[GameSubscriber]] = None):
+    def __init__(self, big_blind: float, small_blind: float, logger, game_subscribers: Optional[List[GameSubscriber]] = None,
+                 log_sampler: Optional[LogSampler] = None):
         self._big_blind: float = big_blind
         self._small_blind: float = small_blind
         self._logger = logger
+        self._log_sampler: Optional[LogSampler] = log_sampler
         self._game_subscribers: List[GameSubscriber] = [] if game_subscribers is None else game_subscribers
 
-    def create_game(self, players: List[Player]):
+    def create_game(self, players: List[Player], pacer: Optional[GamePacer] = None):
         game_id = str(uuid.uuid4())
 
-        event_dispatcher = HoldemPokerGameEventDispatcher(game_id=game_id, logger=self._logger)
+        event_dispatcher = HoldemPokerGameEventDispatcher(game_id=game_id, logger=self._logger, log_sampler=self._log_sampler)
         for subscriber in self._game_subscribers:
             event_dispatcher.subscribe(subscriber)
 
@@ -30,7 +31,8 @@ class HoldemPokerGameFactory(GameFactory):
             game_players=GamePlayers(players),
             event_dispatcher=event_dispatcher,
             deck_factory=DeckFactory(2),
-            score_detector=HoldemPokerScoreDetector()
+            score_detector=HoldemPokerScoreDetector(),
+            pacer=pacer
         )
 
 
@@ -64,6 +66,7 @@ class HoldemPokerGameEventDispatcher(GameEventDispatcher):
 
 
 class HoldemPokerGame(PokerGame):
+    GAME_TYPE = "texas-holdem"
     TIMEOUT_TOLERANCE = 2
     BET_TIMEOUT = 30
 
@@ -186,21 +189,21 @@ class HoldemPokerGame(PokerGame):
 
             # Flop
             self._add_shared_cards(deck.pop_cards(3), scores)
-            gevent.sleep(self.WAIT_AFTER_FLOP_TURN_RIVER)
+            self._wait(self.WAIT_AFTER_FLOP_TURN_RIVER)
 
             # Flop bet round
             bet_rounds.__next__()
 
             # Turn
             self._add_shared_cards(deck.pop_cards(1), scores)
-            gevent.sleep(self.WAIT_AFTER_FLOP_TURN_RIVER)
+            self._wait(self.WAIT_AFTER_FLOP_TURN_RIVER)
 
             # Turn bet round
             bet_rounds.__next__()
 
             # River
             self._add_shared_cards(deck.pop_cards(1), scores)
-            gevent.sleep(self.WAIT_AFTER_FLOP_TURN_RIVER)
+            self._wait(self.WAIT_AFTER_FLOP_TURN_RIVER)
 
             # River bet round
             if bet_rounds.__next__() and self._game_players.count_active() > 1:
@@ -214,3 +217,5 @@ class HoldemPokerGame(PokerGame):
 
         finally:
             self._event_dispatcher.game_over_event()
+            # Making sure the whole hand was delivered before moving to the next one
+            self._event_dispatcher.sync()
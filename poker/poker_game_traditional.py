@@ -1,15 +1,16 @@
 import time
 import uuid
-from typing import List
-
-import gevent
+from typing import List, Optional
 
 from .channel import ChannelError, MessageFormatError, MessageTimeout
 from .deck import DeckFactory
 from .player import Player
 from .player_server import PlayerServer
-from .poker_game import PokerGame, GameFactory, EndGameException, GameError, GamePlayers, GameEventDispatcher
+from .poker_game import PokerGame, GameFactory, EndGameException, GameError, GamePlayers, GameEventDispatcher, GamePacer, \
+    GameSubscriber
 from .score_detector import TraditionalPokerScoreDetector
+from .structured_log import LogSampler
+from .tracing import Tracer, INBOUND
 
 
 class DeadHandException(Exception):
@@ -17,22 +18,30 @@ class DeadHandException(Exception):
 
 
 class TraditionalPokerGameFactory(GameFactory):
-    def __init__(self, blind, logger):
+    def __init__(self, blind, logger, log_sampler: Optional[LogSampler] = None,
+                 game_subscribers: Optional[List[GameSubscriber]] = None):
         self._blind = blind
         self._logger = logger
+        self._log_sampler: Optional[LogSampler] = log_sampler
+        self._game_subscribers: List[GameSubscriber] = [] if game_subscribers is None else game_subscribers
 
-    def create_game(self, players: List[PlayerServer]):
+    def create_game(self, players: List[PlayerServer], pacer: Optional[GamePacer] = None):
         # In a traditional poker game, the lowest rank is 9 with 2 players, 8 with three, 7 with four, 6 with five
         lowest_rank = 11 - len(players)
         game_id = str(uuid.uuid4())
 
+        event_dispatcher = TraditionalPokerGameEventDispatcher(game_id=game_id, logger=self._logger, log_sampler=self._log_sampler)
+        for subscriber in self._game_subscribers:
+            event_dispatcher.subscribe(subscriber)
+
         return TraditionalPokerGame(
             self._blind,
             id=game_id,
             game_players=GamePlayers(players),
-            event_dispatcher=TraditionalPokerGameEventDispatcher(game_id=game_id, logger=self._logger),
+            event_dispatcher=event_dispatcher,
             deck_factory=DeckFactory(lowest_rank),
-            score_detector=TraditionalPokerScoreDetector(lowest_rank)
+            score_detector=TraditionalPokerScoreDetector(lowest_rank),
+            pacer=pacer
         )
 
 
@@ -45,7 +54,7 @@ class TraditionalPokerGameEventDispatcher(GameEventDispatcher):
                 "game_type": "traditional",
                 "players": [player.dto() for player in players],
                 "dealer_id": dealer_id,
-                "blind_bets": blind_bets,
+                "blind_bets": dict(blind_bets),
             }
         )
 
@@ -77,6 +86,7 @@ class TraditionalPokerGameEventDispatcher(GameEventDispatcher):
 
 
 class TraditionalPokerGame(PokerGame):
+    GAME_TYPE = "traditional"
     TIMEOUT_TOLERANCE = 2
     BET_TIMEOUT = 30
     CHANGE_CARDS_TIMEOUT = 30
@@ -129,7 +139,7 @@ class TraditionalPokerGame(PokerGame):
                 discard = self._get_player_discard(player, scores, timeout_epoch=timeout_epoch + self.TIMEOUT_TOLERANCE)
 
             except (ChannelError, MessageFormatError, MessageTimeout) as e:
-                player.send_message({"message_type": "error", "error": e.args[0]})
+                player.try_send_message({"message_type": "error", "error": e.args[0]})
                 self._event_dispatcher.dead_player_event(player)
                 self._game_players.remove(player.id)
 
@@ -143,10 +153,14 @@ class TraditionalPokerGame(PokerGame):
                     self._send_player_score(player, scores)
 
                 self._event_dispatcher.change_cards_event(player, len(discard))
-        gevent.sleep(self.WAIT_AFTER_CARDS_CHANGE)
+        self._wait(self.WAIT_AFTER_CARDS_CHANGE)
 
     def _get_player_discard(self, player, scores, timeout_epoch):
         message = player.recv_message(timeout_epoch=timeout_epoch)
+        while message.get("message_type") == "pre-action":
+            # Action for the next bet round
+            self._bet_handler.set_pre_action(player, message)
+            message = player.recv_message(timeout_epoch=timeout_epoch)
 
         MessageFormatError.validate_message_type(message, "cards-change")
 
@@ -161,11 +175,14 @@ class TraditionalPokerGame(PokerGame):
             if len(discard_keys) > 4:
                 raise MessageFormatError(attribute="cards", desc="Maximum number of cards exceeded")
             player_cards = scores.player_cards(player.id)
-            return [player_cards[key] for key in discard_keys]
-
+            discard = [player_cards[key] for key in discard_keys]
         except (TypeError, IndexError):
             raise MessageFormatError(attribute="cards", desc="Invalid list of cards")
 
+        if "trace" in message:
+            Tracer.finish(message, "handled", INBOUND)
+        return discard
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # Game logic
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -213,3 +230,5 @@ class TraditionalPokerGame(PokerGame):
 
         finally:
             self._event_dispatcher.game_over_event()
+            # Making sure the whole hand was delivered before moving to the next one
+            self._event_dispatcher.sync()
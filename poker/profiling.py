@@ -0,0 +1,237 @@
+import collections
+import contextlib
+import json
+import logging
+import os
+import signal
+import sys
+import time
+import types
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import gevent
+import gevent.lock
+import greenlet
+
+from .channel import Channel
+
+
+class ProfilerBusyException(Exception):
+    pass
+
+
+class RoomUsage:
+    def __init__(self):
+        # CPU time of the room greenlets (game, event workers and outbox senders) while playing hands
+        self.cpu_seconds: float = 0.0
+        # Times the room greenlets yielded to other greenlets while playing hands
+        self.switches: int = 0
+        self.hands: int = 0
+
+    def dto(self) -> Dict:
+        return {"cpu_seconds": self.cpu_seconds, "switches": self.switches, "hands": self.hands}
+
+
+class RoomAccounting:
+    """
+    Tells which room the running greenlet is playing a hand for and, once enabled, accounts
+    the CPU time and the greenlet switches of every room.
+    CPU time is measured at every greenlet switch: the time elapsed since the previous switch is charged to the room
+    playing a hand in the greenlet switched from (other greenlets are not charged).
+    Greenlets spawned for a room while it plays a hand (event workers, outbox senders) are adopted: they are charged
+    to the room until the end of the hand.
+    """
+    def __init__(self):
+        self._enabled: bool = False
+        self._usage: Dict[str, RoomUsage] = collections.defaultdict(RoomUsage)
+        # Rooms playing a hand, by greenlet
+        self._room_ids: Dict[greenlet.greenlet, str] = {}
+        # Greenlets adopted by the rooms playing a hand, by room
+        self._adopted: Dict[str, List[greenlet.greenlet]] = {}
+        self._switched_at: float = time.thread_time()
+        self._previous_trace: Optional[Callable] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    def enable(self):
+        if self._enabled:
+            return
+        self._enabled = True
+        self._switched_at = time.thread_time()
+        self._previous_trace = greenlet.settrace(self._trace)
+
+    def disable(self):
+        if not self._enabled:
+            return
+        self._enabled = False
+        greenlet.settrace(self._previous_trace)
+        self._previous_trace = None
+
+    def room_id(self, glet: Optional[greenlet.greenlet] = None) -> Optional[str]:
+        """Room playing a hand in the given greenlet (the current one by default)"""
+        return self._room_ids.get(greenlet.getcurrent() if glet is None else glet)
+
+    def adopt(self, glet: greenlet.greenlet):
+        """Charges a greenlet spawned by the current one to the same room, until the end of the hand"""
+        room_id = self.room_id()
+        if room_id is not None:
+            self._room_ids[glet] = room_id
+            self._adopted[room_id].append(glet)
+
+    def usage(self, room_id: str) -> RoomUsage:
+        return self._usage[room_id] if room_id in self._usage else RoomUsage()
+
+    def forget(self, room_id: str):
+        self._usage.pop(room_id, None)
+
+    @contextlib.contextmanager
+    def hand(self, room_id: str) -> Iterator[None]:
+        """Accounts the resources used by the current greenlet (and the greenlets it adopts) to the given room"""
+        current = greenlet.getcurrent()
+        self._room_ids[current] = room_id
+        self._adopted[room_id] = []
+        try:
+            yield
+        finally:
+            del self._room_ids[current]
+            for glet in self._adopted.pop(room_id):
+                self._room_ids.pop(glet, None)
+            if self._enabled:
+                usage = self._usage[room_id]
+                usage.cpu_seconds += time.thread_time() - self._switched_at
+                usage.hands += 1
+
+    def _trace(self, event: str, args: Tuple[greenlet.greenlet, greenlet.greenlet]):
+        if event in ("switch", "throw"):
+            now = time.thread_time()
+            room_id = self._room_ids.get(args[0])
+            if room_id is not None:
+                usage = self._usage[room_id]
+                usage.cpu_seconds += now - self._switched_at
+                usage.switches += 1
+            self._switched_at = now
+        if self._previous_trace is not None:
+            self._previous_trace(event, args)
+
+
+# Accounting of the process (the CPU time and switches are not measured unless enabled)
+accounting = RoomAccounting()
+
+
+# Not followed when measuring the memory held by an object: shared with the rest of the process
+NOT_OWNED_TYPES = (
+    Channel, greenlet.greenlet, logging.Logger, logging.LoggerAdapter, gevent.lock.Semaphore, gevent.lock.RLock,
+    type, types.ModuleType, types.FunctionType, types.MethodType, types.BuiltinFunctionType
+)
+
+
+def approximate_size(obj: Any, max_objects: int = 100000) -> int:
+    """Bytes held by an object and by the objects it references (channels, greenlets, locks and loggers excluded)"""
+    seen = set()
+    pending = [obj]
+    size = 0
+    while pending and len(seen) < max_objects:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, NOT_OWNED_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+            pending.extend(obj)
+        elif hasattr(obj, "__dict__"):
+            pending.append(obj.__dict__)
+        for slot in getattr(type(obj), "__slots__", ()):
+            if hasattr(obj, slot):
+                pending.append(getattr(obj, slot))
+    return size
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of the running greenlet at regular intervals of CPU time (SIGPROF), either for the whole
+    process or only while a given room is playing a hand.
+    Stacks are returned in the folded format of flame graph tools (frames separated by semicolons, then the count).
+    """
+    INTERVAL = 0.005
+    MAX_SECONDS = 120
+
+    def __init__(self, room_accounting: Optional[RoomAccounting] = None, interval: Optional[float] = None):
+        self._accounting: RoomAccounting = accounting if room_accounting is None else room_accounting
+        self._interval: float = self.INTERVAL if interval is None else interval
+        self._room_id: Optional[str] = None
+        self._samples: Dict[str, int] = collections.Counter()
+        self._running: bool = False
+
+    def profile(self, seconds: float, room_id: Optional[str] = None) -> Dict[str, int]:
+        """Samples the process (or a room) for the given number of seconds: must run in the main thread"""
+        if self._running:
+            raise ProfilerBusyException("A profile is already running")
+        if seconds <= 0 or seconds > self.MAX_SECONDS:
+            raise ValueError("Profiles last between 0 and {} seconds".format(self.MAX_SECONDS))
+        self._running = True
+        self._room_id = room_id
+        self._samples = collections.Counter()
+        previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        try:
+            signal.setitimer(signal.ITIMER_PROF, self._interval, self._interval)
+            gevent.sleep(seconds)
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, previous_handler)
+            self._running = False
+        return dict(self._samples)
+
+    def _sample(self, signum, frame):
+        if frame is None or (self._room_id is not None and self._accounting.room_id() != self._room_id):
+            return
+        self._samples[self.folded_stack(frame)] += 1
+
+    @staticmethod
+    def folded_stack(frame: types.FrameType) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    @staticmethod
+    def render(samples: Dict[str, int]) -> str:
+        return "".join("{} {}\n".format(stack, count) for stack, count in sorted(samples.items()))
+
+
+def admin_routes(game_server, profiler: Optional[SamplingProfiler] = None) -> Dict[str, Callable[[Dict[str, str]], Tuple[str, bytes]]]:
+    """
+    Admin commands of a game server, served along with its metrics:
+    - /rooms?limit=N: usage of the N rooms using the most CPU time (memory held by players, event log and scores)
+    - /profile?seconds=S&room=ID: folded stacks sampled for S seconds (the whole process unless a room is given)
+    """
+    profiler = SamplingProfiler() if profiler is None else profiler
+
+    def rooms(query: Dict[str, str]) -> Tuple[str, bytes]:
+        limit = int(query.get("limit", 20))
+        usages = sorted(
+            ((room, accounting.usage(room.id)) for room in game_server.rooms),
+            key=lambda room_usage: room_usage[1].cpu_seconds,
+            reverse=True
+        )
+        body = {
+            "accounting": accounting.enabled,
+            "rooms": [
+                dict(room_id=room.id, players=len(room.players), memory=room.memory_usage(), **usage.dto())
+                for room, usage in usages[:limit]
+            ]
+        }
+        return "application/json", json.dumps(body).encode("utf-8")
+
+    def profile(query: Dict[str, str]) -> Tuple[str, bytes]:
+        samples = profiler.profile(float(query.get("seconds", 10)), query.get("room"))
+        return "text/plain", SamplingProfiler.render(samples).encode("utf-8")
+
+    return {"/rooms": rooms, "/profile": profile}
+
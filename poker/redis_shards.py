@@ -0,0 +1,116 @@
+import bisect
+import zlib
+from typing import List, Optional, Tuple, Dict, Any
+
+import gevent.queue
+from redis import Redis, BlockingConnectionPool
+
+
+def create_redis(url: str, max_connections: int = 50, timeout: float = 5,
+                 health_check_interval: int = 30) -> Redis:
+    """
+    Redis client with a bounded connection pool: greenlets wait (cooperatively) for a free connection
+    instead of opening new ones, and idle connections are checked before being used again.
+    """
+    pool = BlockingConnectionPool.from_url(
+        url,
+        max_connections=max_connections,
+        timeout=timeout,
+        queue_class=gevent.queue.LifoQueue,
+        health_check_interval=health_check_interval
+    )
+    return Redis(connection_pool=pool)
+
+
+class HashRing:
+    """
+    Consistent hashing of keys over a list of nodes: adding or removing a node only moves
+    the keys of that node.
+    """
+    REPLICAS = 160
+
+    def __init__(self, node_names: List[str], replicas: Optional[int] = None):
+        if not node_names:
+            raise ValueError("At least one node is needed")
+        replicas = self.REPLICAS if replicas is None else replicas
+        # (position on the ring, node index), sorted by position
+        self._ring: List[Tuple[int, int]] = sorted(
+            (self._hash("{}#{}".format(node_name, replica)), node)
+            for node, node_name in enumerate(node_names)
+            for replica in range(replicas)
+        )
+        self._positions: List[int] = [position for position, _ in self._ring]
+
+    def node_of(self, key) -> int:
+        index = bisect.bisect(self._positions, self._hash(key))
+        return self._ring[index % len(self._ring)][1]
+
+    @staticmethod
+    def _hash(key) -> int:
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        return zlib.crc32(key)
+
+
+class RedisShards:
+    """
+    Redis endpoints used as a single client for single-key commands: each command goes to the endpoint
+    owning its key (first argument). Every process talking to each other must use the same endpoints, in any order.
+    """
+    def __init__(self, clients: List[Redis], node_names: Optional[List[str]] = None):
+        self._clients: List[Redis] = clients
+        self._ring = HashRing(node_names if node_names is not None else [str(node) for node in range(len(clients))])
+
+    @staticmethod
+    def from_urls(urls: List[str], **kwargs) -> "RedisShards":
+        # Passwords are not part of the ring
+        return RedisShards([create_redis(url, **kwargs) for url in urls], [url.split("@")[-1] for url in urls])
+
+    def __len__(self):
+        return len(self._clients)
+
+    def client(self, key) -> Redis:
+        return self._clients[self._ring.node_of(key)]
+
+    def __getattr__(self, command: str):
+        def execute(key, *args, **kwargs):
+            return getattr(self.client(key), command)(key, *args, **kwargs)
+        return execute
+
+    def xreadgroup(self, groupname, consumername, streams: Dict, *args, **kwargs):
+        # The only key based command used here without the key as first argument
+        if len({self._ring.node_of(stream) for stream in streams}) > 1:
+            raise ValueError("Streams read at once must be on the same shard")
+        return self.client(next(iter(streams))).xreadgroup(groupname, consumername, streams, *args, **kwargs)
+
+    def pipeline(self, transaction: bool = False) -> "ShardedPipeline":
+        if transaction:
+            raise ValueError("Transactions can't span several shards")
+        return ShardedPipeline(self)
+
+
+class ShardedPipeline:
+    """Pipeline per shard, executed one after the other: results are returned in the order of the commands"""
+    def __init__(self, shards: RedisShards):
+        self._shards: RedisShards = shards
+        self._pipelines: Dict[int, Any] = {}
+        # (shard pipeline, position in the shard pipeline) of every command
+        self._commands: List[Tuple[int, int]] = []
+        self._sizes: Dict[int, int] = {}
+
+    def __getattr__(self, command: str):
+        def queue(key, *args, **kwargs):
+            client = self._shards.client(key)
+            shard = id(client)
+            if shard not in self._pipelines:
+                self._pipelines[shard] = client.pipeline(transaction=False)
+                self._sizes[shard] = 0
+            getattr(self._pipelines[shard], command)(key, *args, **kwargs)
+            self._commands.append((shard, self._sizes[shard]))
+            self._sizes[shard] += 1
+            return self
+        return queue
+
+    def execute(self, raise_on_error: bool = True) -> List[Any]:
+        results = {shard: pipeline.execute(raise_on_error=raise_on_error) for shard, pipeline in self._pipelines.items()}
+        return [results[shard][position] for shard, position in self._commands]
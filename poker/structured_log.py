@@ -0,0 +1,36 @@
+import collections
+from typing import Dict, Any
+
+
+class LogPayload:
+    """
+    Key-value log message formatted only when the log record is actually emitted.
+    Values can be callables, in which case they are evaluated at formatting time.
+    Log handlers can access the raw key-value pairs through record.msg.fields.
+    """
+    def __init__(self, **fields):
+        self._fields: Dict[str, Any] = fields
+
+    @property
+    def fields(self) -> Dict[str, Any]:
+        return {key: value() if callable(value) else value for key, value in self._fields.items()}
+
+    def __str__(self):
+        return "\n" + ("-" * 80) + "\n" + \
+               "\n".join("{}: {}".format(key.upper(), value) for key, value in self.fields.items()) + "\n" + \
+               ("-" * 80) + "\n"
+
+
+class LogSampler:
+    """Logs only one every N records for the configured (high volume) keys"""
+    def __init__(self, rates: Dict[str, int]):
+        self._rates: Dict[str, int] = rates
+        self._counters: Dict[str, int] = collections.defaultdict(int)
+
+    def sample(self, key: str) -> bool:
+        rate = self._rates.get(key, 1)
+        if rate <= 1:
+            return True
+        count = self._counters[key]
+        self._counters[key] = (count + 1) % rate
+        return count == 0
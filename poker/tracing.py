@@ -0,0 +1,119 @@
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from .metrics import registry
+
+OUTBOUND = "outbound"
+INBOUND = "inbound"
+
+# (from, to, stage) of each direction: game events go to the clients, player actions go to the game services
+# (the inbound gateway stage lasts until the push returns, it is observed by the gateway: see GatewayTracer)
+STAGES = {
+    OUTBOUND: (("raised", "pushed", "game-service"), ("pushed", "popped", "broker"), ("popped", "written", "gateway")),
+    INBOUND: (("pushed", "popped", "broker"), ("popped", "handled", "game-service")),
+}
+
+TRACE_STAGE_TIME = registry.histogram(
+    "poker_trace_stage_seconds", "Time spent by the sampled messages in each stage (clocks of different hosts)",
+    ["direction", "stage"]
+)
+
+
+class Tracer:
+    """
+    Samples one message every N: sampled messages carry the time they reached each stage in their "trace" attribute,
+    and the time spent in each stage is observed by the last process handling them.
+    Messages are copied when stamped, as they might be shared (broadcast or in-memory channels).
+    """
+    def __init__(self, sample_every: int = 0):
+        self._sample_every: int = sample_every
+        self._count: int = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._sample_every > 0
+
+    def set_sampling(self, sample_every: int):
+        """Traces one message every sample_every messages (never if 0)"""
+        self._sample_every = sample_every
+        self._count = 0
+
+    def sample(self) -> bool:
+        if self._sample_every <= 0:
+            return False
+        self._count = (self._count + 1) % self._sample_every
+        return self._count == 0
+
+    @staticmethod
+    def stamp(message: Dict, stage: str) -> Dict:
+        message = dict(message)
+        message["trace"] = dict(message.get("trace") or {})
+        message["trace"][stage] = time.time()
+        return message
+
+    @staticmethod
+    def observe(trace: Dict, direction: str):
+        for start, end, stage in STAGES[direction]:
+            try:
+                TRACE_STAGE_TIME.labels(direction, stage).observe(float(trace[end]) - float(trace[start]))
+            except (KeyError, TypeError, ValueError):
+                # Stage not traced (or not a number)
+                pass
+
+    @staticmethod
+    def finish(message: Dict, stage: str, direction: str):
+        Tracer.observe(Tracer.stamp(message, stage)["trace"], direction)
+
+
+# Sampling of the process (disabled unless configured)
+tracer = Tracer()
+
+
+class GatewayTracer:
+    """
+    Traces the messages forwarded by a gateway for a player session.
+    Only player actions are sampled (other client messages never reach the game as a reply).
+    The action following a traced action request of the player is traced as well,
+    along with the time taken by the client.
+    """
+    TRACED_MESSAGE_TYPES = ("bet", "cards-change")
+
+    def __init__(self, player_id: str, session_tracer: Optional[Tracer] = None):
+        self._player_id: str = player_id
+        self._tracer: Tracer = tracer if session_tracer is None else session_tracer
+        self._action_written_at: Optional[float] = None
+
+    def client_message(self, message: Any, received_at: Optional[float] = None) -> Any:
+        """Message read from the client at received_at (now by default), about to be pushed to the game service"""
+        if not isinstance(message, dict) or message.get("message_type") not in self.TRACED_MESSAGE_TYPES:
+            return message
+        received_at = time.time() if received_at is None else received_at
+        if self._action_written_at is not None:
+            TRACE_STAGE_TIME.labels(INBOUND, "client").observe(received_at - self._action_written_at)
+            self._action_written_at = None
+        elif not self._tracer.sample():
+            return message
+        message = dict(message)
+        message["trace"] = {"received": received_at, "pushed": time.time()}
+        return message
+
+    @staticmethod
+    def client_message_pushed(message: Any):
+        """Message pushed to the game service (the push returned)"""
+        if isinstance(message, dict) and "trace" in message:
+            TRACE_STAGE_TIME.labels(INBOUND, "gateway").observe(time.time() - message["trace"]["received"])
+
+    @staticmethod
+    def server_message(message: Any) -> Tuple[Any, Optional[Dict]]:
+        """Message popped from the game service: returns the message for the client (without trace) and its trace"""
+        if "trace" not in message:
+            return message, None
+        trace = dict(message["trace"] or {})
+        trace["popped"] = time.time()
+        return {key: value for key, value in message.items() if key != "trace"}, trace
+
+    def server_message_written(self, message: Any, trace: Dict):
+        trace["written"] = time.time()
+        Tracer.observe(trace, OUTBOUND)
+        if message.get("event") == "player-action" and (message.get("player") or {}).get("id") == self._player_id:
+            self._action_written_at = trace["written"]
@@ -234,6 +234,25 @@ PyPoker = {
             $cards.slideUp(1000).slideDown(1000);
         },
 
+        lastEventId: null,
+
+        ackPending: false,
+
+        ackEvent: function(eventId) {
+            // Let the server know once the game events have been animated (acknowledgements are cumulative)
+            PyPoker.Game.lastEventId = eventId;
+            if (!PyPoker.Game.ackPending) {
+                PyPoker.Game.ackPending = true;
+                $(':animated').promise().done(function() {
+                    PyPoker.Game.ackPending = false;
+                    PyPoker.socket.send(JSON.stringify({
+                        'message_type': 'ack',
+                        'event_id': PyPoker.Game.lastEventId
+                    }));
+                });
+            }
+        },
+
         onGameUpdate: function(message) {
             PyPoker.Player.resetControls();
             PyPoker.Player.resetTimers();
@@ -573,6 +592,7 @@ PyPoker = {
                     break;
                 case 'game-update':
                     PyPoker.Game.onGameUpdate(data);
+                    PyPoker.Game.ackEvent(data.event_id);
                     break;
                 case 'error':
                     PyPoker.Logger.log(data.error);
@@ -0,0 +1,27 @@
+import unittest
+
+import benchmark
+
+
+class BenchmarkTest(unittest.TestCase):
+    def test_macro_benchmarks(self):
+        settings = benchmark.BenchmarkSettings(duration=0.2)
+        self.assertGreater(benchmark.bench_hands(settings), 0)
+        self.assertGreater(benchmark.bench_admission(settings), 0)
+        self.assertGreater(benchmark.bench_channel_memory(settings), 0)
+
+    def test_compare(self):
+        baseline = {"benchmarks": {
+            "micro.card_create": {"value": 100.0, "unit": "cards/s"},
+            "micro.card_sort": {"value": 100.0, "unit": "sorts/s"},
+        }}
+        results = {"benchmarks": {
+            "micro.card_create": {"value": 70.0, "unit": "cards/s"},
+            "micro.card_sort": {"value": 90.0, "unit": "sorts/s"},
+            "macro.hands": {"value": 10.0, "unit": "hands/s"},
+        }}
+        self.assertEqual(["micro.card_create"], benchmark.compare(results, baseline, tolerance=0.2))
+
+
+if __name__ == '__main__':
+    unittest.main()
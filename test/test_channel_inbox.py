@@ -0,0 +1,114 @@
+import json
+import time
+import unittest
+from unittest import mock
+
+import gevent
+
+from poker.channel import ChannelError, MessageTimeout
+from poker.channel_inbox import Inbox
+from poker.player import Player
+from poker.player_client import PlayerClientConnector
+
+
+class InboxTest(unittest.TestCase):
+    def setUp(self):
+        self.redis = mock.Mock()
+        self.redis.rpop.return_value = None
+        self.redis.pipeline.return_value.execute.return_value = [1, True]
+        self.inbox = Inbox(self.redis, "gateway-1:inbox", logger=mock.Mock())
+
+    def tearDown(self):
+        self.inbox.stop()
+
+    def _pushed(self):
+        return [
+            (call[0][0], json.loads(call[0][1].decode("utf-8")))
+            for call in self.redis.pipeline.return_value.lpush.call_args_list
+        ]
+
+    def test_dispatch(self):
+        channel1 = self.inbox.open_channel("session-1", "node-1:inbox")
+        channel2 = self.inbox.open_channel("session-2", "node-1:inbox")
+        self.redis.rpop.side_effect = [
+            [
+                json.dumps({"session_id": "session-2", "reply_to": "node-1:inbox", "message": {"id": 1}}),
+                json.dumps({"session_id": "unknown", "reply_to": "node-1:inbox", "message": {"id": 2}}),
+                json.dumps({"session_id": "session-1", "reply_to": "node-1:inbox", "message": {"id": 3}}),
+            ],
+            None
+        ]
+        self.assertEqual({"id": 3}, channel1.recv_message(time.time() + 1))
+        self.assertEqual({"id": 1}, channel2.recv_message(time.time() + 1))
+        # A single poller for every session
+        self.assertTrue(all(call[0][0] == "gateway-1:inbox" for call in self.redis.rpop.call_args_list))
+
+    def test_recv_timeout(self):
+        channel = self.inbox.open_channel("session-1", "node-1:inbox")
+        self.assertRaises(MessageTimeout, channel.recv_message, time.time() + 0.05)
+
+    def test_send_message(self):
+        channel = self.inbox.open_channel("session-1", "node-1:inbox")
+        channel.send_message({"message_type": "bet"})
+        self.assertEqual(
+            [("node-1:inbox", {"session_id": "session-1", "reply_to": "gateway-1:inbox", "message": {"message_type": "bet"}})],
+            self._pushed()
+        )
+
+    def test_send_message_unknown_remote(self):
+        channel = self.inbox.open_channel("session-1")
+        self.assertRaises(ChannelError, channel.send_message, {"message_type": "bet"})
+        channel.deliver({"session_id": "session-1", "reply_to": "node-1:inbox", "message": {"message_type": "connect"}})
+        channel.send_message({"message_type": "bet"})
+        self.assertEqual("node-1:inbox", self._pushed()[0][0])
+
+    def test_remote_moved(self):
+        channel = self.inbox.open_channel("session-1", "node-1:inbox")
+        channel.deliver({"session_id": "session-1", "reply_to": "node-2:inbox", "heartbeat": True})
+        self.assertEqual("node-2:inbox", channel.remote_inbox)
+
+    def test_heartbeat(self):
+        channel = self.inbox.open_channel("session-1", "node-1:inbox")
+        channel._last_heartbeat = 0.0
+        channel.deliver({"session_id": "session-1", "reply_to": "node-1:inbox", "heartbeat": True})
+        self.assertGreater(channel.last_heartbeat(), time.time() - 1)
+        self.assertRaises(MessageTimeout, channel.recv_message, time.time())
+
+    def test_closed_by_remote(self):
+        channel = self.inbox.open_channel("session-1", "node-1:inbox")
+        channel.deliver({"session_id": "session-1", "reply_to": "node-1:inbox", "closed": True})
+        self.assertEqual(0.0, channel.last_heartbeat())
+        self.assertRaises(ChannelError, channel.recv_message, time.time() + 1)
+
+    def test_close(self):
+        channel = self.inbox.open_channel("session-1", "node-1:inbox")
+        channel.close()
+        self.assertEqual(
+            [("node-1:inbox", {"session_id": "session-1", "reply_to": "gateway-1:inbox", "closed": True})],
+            self._pushed()
+        )
+        self.assertRaises(ChannelError, channel.send_message, {"message_type": "bet"})
+
+
+    def test_connector_opens_channel_before_requesting(self):
+        # Poller already running for other sessions
+        self.inbox.open_channel("session-0", "node-1:inbox")
+        acks = [[json.dumps({
+            "session_id": "session-1", "reply_to": "node-1:inbox",
+            "message": {"message_type": "connect", "server_id": "node-1"}
+        })]]
+
+        def push():
+            # The game server acknowledges the connection while the request is being pushed
+            self.redis.rpop.side_effect = lambda *args: acks.pop() if acks else None
+            gevent.sleep(0.05)
+            return [1, True]
+
+        self.redis.pipeline.return_value.execute.side_effect = push
+        connector = PlayerClientConnector(self.redis, "texas-holdem-poker:lobby", mock.Mock(), inbox=self.inbox)
+        with mock.patch.object(PlayerClientConnector, "CONNECTION_TIMEOUT", 0.5):
+            client = connector.connect(Player("player-1", "Player 1", 1000.0), "session-1", "room-1")
+        self.assertEqual("node-1", client.connection_message["server_id"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import time
+import unittest
+from unittest import mock
+
+from poker.channel import ChannelError, MessageTimeout
+from poker.channel_inbox_async import AsyncInbox
+
+
+class AsyncInboxTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.responses = []
+        self.redis = mock.Mock()
+        self.redis.brpop = mock.AsyncMock(side_effect=self._brpop)
+        self.redis.rpop = mock.AsyncMock(return_value=None)
+        self.pipeline = mock.MagicMock()
+        self.pipeline.__aenter__.return_value = self.pipeline
+        self.pipeline.execute = mock.AsyncMock(return_value=[1, True])
+        self.redis.pipeline.return_value = self.pipeline
+        self.inbox = AsyncInbox(self.redis, "gateway-1:inbox")
+
+    async def asyncTearDown(self):
+        await self.inbox.stop()
+
+    async def _brpop(self, keys, timeout):
+        if self.responses:
+            return keys[0].encode("utf-8"), json.dumps(self.responses.pop(0)).encode("utf-8")
+        await asyncio.sleep(0.01)
+        return None
+
+    def _pushed(self):
+        return [(call[0][0], json.loads(call[0][1].decode("utf-8"))) for call in self.pipeline.lpush.call_args_list]
+
+    async def test_dispatch(self):
+        channel1 = self.inbox.open_channel("session-1")
+        channel2 = self.inbox.open_channel("session-2", "node-1:inbox")
+        self.responses.append({"session_id": "session-2", "reply_to": "node-1:inbox", "message": {"id": 1}})
+        self.redis.rpop.side_effect = [
+            [
+                json.dumps({"session_id": "unknown", "reply_to": "node-1:inbox", "message": {"id": 2}}),
+                json.dumps({"session_id": "session-1", "reply_to": "node-2:inbox", "message": {"id": 3}}),
+            ],
+            None
+        ]
+        self.assertEqual({"id": 1}, await channel2.recv_message(time.time() + 1))
+        self.assertEqual({"id": 3}, await channel1.recv_message(time.time() + 1))
+        # Remote end learnt from the first message
+        self.assertEqual("node-2:inbox", channel1.remote_inbox)
+
+    async def test_recv_timeout(self):
+        channel = self.inbox.open_channel("session-1", "node-1:inbox")
+        with self.assertRaises(MessageTimeout):
+            await channel.recv_message(time.time() + 0.05)
+
+    async def test_send_message(self):
+        channel = self.inbox.open_channel("session-1", "node-1:inbox")
+        await channel.send_message({"message_type": "bet"})
+        self.assertEqual(
+            [("node-1:inbox", {"session_id": "session-1", "reply_to": "gateway-1:inbox", "message": {"message_type": "bet"}})],
+            self._pushed()
+        )
+
+    @mock.patch.object(AsyncInbox, "HEARTBEAT_INTERVAL", 0.01)
+    async def test_heartbeats(self):
+        self.inbox.open_channel("session-1", "node-1:inbox")
+        self.inbox.open_channel("session-2")
+        self.inbox.open_channel("session-3", "node-2:inbox")
+        await asyncio.sleep(0.05)
+        # Sessions with a known remote end, in a single round trip per interval
+        self.assertEqual(
+            [
+                ("node-1:inbox", {"session_id": "session-1", "reply_to": "gateway-1:inbox", "heartbeat": True}),
+                ("node-2:inbox", {"session_id": "session-3", "reply_to": "gateway-1:inbox", "heartbeat": True})
+            ],
+            self._pushed()[:2]
+        )
+        self.assertEqual(2 * self.pipeline.execute.call_count, self.pipeline.lpush.call_count)
+
+    async def test_closed_by_remote(self):
+        channel = self.inbox.open_channel("session-1", "node-1:inbox")
+        channel.deliver({"session_id": "session-1", "reply_to": "node-1:inbox", "closed": True})
+        self.assertEqual(0.0, channel.last_heartbeat())
+        with self.assertRaises(ChannelError):
+            await channel.recv_message(time.time() + 1)
+
+    async def test_close(self):
+        channel = self.inbox.open_channel("session-1", "node-1:inbox")
+        await channel.close()
+        self.assertEqual(
+            [("node-1:inbox", {"session_id": "session-1", "reply_to": "gateway-1:inbox", "closed": True})],
+            self._pushed()
+        )
+        self.assertEqual(0, len(self.inbox))
+        with self.assertRaises(ChannelError):
+            await channel.send_message({"message_type": "bet"})
+
+
+if __name__ == '__main__':
+    unittest.main()
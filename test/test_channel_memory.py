@@ -0,0 +1,86 @@
+import time
+import unittest
+from unittest import mock
+
+import gevent
+
+from poker.channel import ChannelError, MessageTimeout
+from poker.channel_memory import ChannelMemory
+from poker.game_room import GameRoomFactory
+from poker.game_server_memory import GameServerMemory
+from poker.lobby import LobbyMemory
+from poker.player import Player
+from poker.player_client import PlayerClientConnectorMemory
+
+
+class ChannelMemoryTest(unittest.TestCase):
+    def setUp(self):
+        self.end1, self.end2 = ChannelMemory.pair()
+
+    def test_send_message(self):
+        self.assertEqual(1, self.end1.send_message({"id": 1}))
+        self.assertEqual(2, self.end1.send_message({"id": 2}))
+        self.assertEqual(2, self.end1.outbound_backlog())
+        self.assertEqual({"id": 1}, self.end2.recv_message())
+        self.assertEqual({"id": 2}, self.end2.recv_message())
+        self.assertEqual(0, self.end1.outbound_backlog())
+
+    def test_recv_timeout(self):
+        self.assertRaises(MessageTimeout, self.end1.recv_message, time.time() + 0.05)
+
+    def test_heartbeat(self):
+        self.end2._last_heartbeat = 0.0
+        self.end1.heartbeat()
+        self.assertGreater(self.end2.last_heartbeat(), time.time() - 1)
+
+    def test_close(self):
+        receiver = gevent.spawn(self.end2.recv_message)
+        gevent.sleep(0)
+        self.end1.close()
+        receiver.join(1)
+        self.assertIsInstance(receiver.exception, ChannelError)
+        self.assertEqual(0.0, self.end2.last_heartbeat())
+        self.assertRaises(ChannelError, self.end2.send_message, {"id": 1})
+        self.assertRaises(ChannelError, self.end1.recv_message)
+
+
+class GameServerMemoryTest(unittest.TestCase):
+    def test_connect(self):
+        lobby = LobbyMemory()
+        server = GameServerMemory(lobby, GameRoomFactory(room_size=3, game_factory=mock.Mock()), logger=mock.Mock())
+        batches = server.new_player_batches()
+        connector = PlayerClientConnectorMemory(lobby, logger=mock.Mock())
+
+        client = gevent.spawn(connector.connect, Player("player-1", "Player 1", 1000.0), "session-1", None)
+        batch = next(batches)
+        client.join(1)
+
+        self.assertEqual(["player-1"], [player.player.id for player in batch])
+        self.assertIsNone(batch[0].room_id)
+        self.assertEqual(server._id, client.value.connection_message["server_id"])
+        client.value.send_message({"message_type": "bet"})
+        self.assertEqual({"message_type": "bet"}, batch[0].player.recv_message(time.time() + 1))
+
+    def test_connection_timeout(self):
+        lobby = LobbyMemory()
+        server = GameServerMemory(lobby, GameRoomFactory(room_size=3, game_factory=mock.Mock()), logger=mock.Mock())
+        expired_client, expired_server = ChannelMemory.pair()
+        client, server_channel = ChannelMemory.pair()
+        player = {"id": "player-1", "name": "Player 1", "money": 1000.0}
+        lobby.push({"timeout_epoch": time.time() - 1, "player": player, "room_id": None}, expired_server)
+        lobby.push({"timeout_epoch": time.time() + 5, "player": player, "room_id": "room-1"}, server_channel)
+
+        batch = next(server.new_player_batches())
+
+        self.assertEqual(["room-1"], [player.room_id for player in batch])
+        self.assertRaises(ChannelError, expired_client.recv_message, time.time() + 1)
+        self.assertEqual("connect", client.recv_message(time.time() + 1)["message_type"])
+
+    def test_drain(self):
+        server = GameServerMemory(LobbyMemory(), GameRoomFactory(room_size=3, game_factory=mock.Mock()), logger=mock.Mock())
+        server.drain()
+        self.assertEqual([], list(server.new_player_batches()))
+
+
+if __name__ == '__main__':
+    unittest.main()
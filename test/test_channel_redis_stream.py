@@ -0,0 +1,89 @@
+import json
+import time
+import unittest
+from unittest import mock
+
+from redis import exceptions
+
+from poker.channel import ChannelError, MessageTimeout
+from poker.channel_redis_stream import ChannelRedisStream, MessageStream
+
+
+def entry(message_id, message):
+    return message_id.encode("utf-8"), {b"data": json.dumps(message).encode("utf-8")}
+
+
+class ChannelRedisStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.redis = mock.Mock()
+        self.redis.xreadgroup.return_value = []
+        self.redis.xautoclaim.return_value = [b"0-0", [], []]
+        self.channel = ChannelRedisStream(self.redis, "in", "out", consumer="consumer-1")
+
+    def test_send_message_trimmed_by_length(self):
+        self.redis.pipeline.return_value.execute.return_value = [b"1-0", True]
+        self.channel.send_message({"message_type": "bet"})
+        self.redis.pipeline.return_value.xadd.assert_called_once_with(
+            "out", {"data": b'{"message_type": "bet"}'}, approximate=True, maxlen=MessageStream.MAX_LENGTH
+        )
+
+    def test_send_message_trimmed_by_age(self):
+        channel = ChannelRedisStream(self.redis, "in", "out", consumer="consumer-1", max_age=60)
+        self.redis.pipeline.return_value.execute.return_value = [b"1-0", True]
+        channel.send_message({"message_type": "bet"})
+        minid = self.redis.pipeline.return_value.xadd.call_args[1]["minid"]
+        self.assertAlmostEqual((time.time() - 60) * 1000, int(minid.split("-")[0]), delta=1000)
+
+    def test_recv_message_acknowledges_previous_message(self):
+        self.redis.xreadgroup.side_effect = [
+            [],
+            [[b"in", [entry("1-0", {"id": 1}), entry("2-0", {"id": 2})]]]
+        ]
+        self.assertEqual({"id": 1}, self.channel.recv_message())
+        self.redis.xack.assert_not_called()
+        self.assertEqual({"id": 2}, self.channel.recv_message())
+        self.redis.xack.assert_called_once_with("in", MessageStream.GROUP, "1-0")
+        self.assertEqual("2-0", self.channel.position)
+        # Many messages in a single round trip
+        self.assertEqual(2, self.redis.xreadgroup.call_count)
+
+    def test_recv_message_recovers_pending_messages(self):
+        self.redis.xreadgroup.return_value = [[b"in", [entry("1-0", {"id": 1})]]]
+        self.redis.xautoclaim.return_value = [b"0-0", [entry("0-5", {"id": 0})], []]
+        self.assertEqual({"id": 1}, self.channel.recv_message())
+        self.assertEqual({"id": 0}, self.channel.recv_message())
+        self.assertEqual({"in": "0"}, self.redis.xreadgroup.call_args_list[0][0][2])
+
+    def test_recv_message_timeout(self):
+        self.assertRaises(MessageTimeout, self.channel.recv_message, time.time() + 0.05)
+
+    def test_group_already_created(self):
+        self.redis.xgroup_create.side_effect = exceptions.ResponseError("BUSYGROUP Consumer Group name already exists")
+        self.assertRaises(MessageTimeout, self.channel.recv_message, time.time())
+
+    def test_group_recreated_after_expiry(self):
+        self.redis.xreadgroup.side_effect = [
+            [],
+            exceptions.ResponseError("NOGROUP No such key 'in' or consumer group 'poker5' in XREADGROUP"),
+            [[b"in", [entry("5-0", {"id": 5})]]]
+        ]
+        self.assertEqual({"id": 5}, self.channel.recv_message())
+        self.assertEqual(2, self.redis.xgroup_create.call_count)
+
+    def test_group_not_recreated_twice(self):
+        self.redis.xreadgroup.side_effect = exceptions.ResponseError("NOGROUP No such key")
+        self.assertRaises(ChannelError, self.channel.recv_message, time.time())
+
+    @mock.patch.object(ChannelRedisStream, "BATCH_SIZE", 2)
+    def test_catch_up(self):
+        self.redis.xrange.side_effect = [
+            [entry("2-0", {"id": 2}), entry("3-0", {"id": 3})],
+            [entry("4-0", {"id": 4})]
+        ]
+        self.assertEqual([{"id": 2}, {"id": 3}, {"id": 4}], self.channel.catch_up("1-0"))
+        self.assertEqual(("in", "(1-0", "+"), self.redis.xrange.call_args_list[0][0])
+        self.assertEqual(("in", "(3-0", "+"), self.redis.xrange.call_args_list[1][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
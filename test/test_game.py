@@ -1,7 +1,13 @@
+import time
 import unittest
+from unittest import mock
+
+import gevent
 
 from poker.card import Card
+from poker.channel import Channel, MessageTimeout
 from poker.player import Player
+from poker.player_server import PlayerServer
 from poker.poker_game import *
 from poker.score_detector import HoldemPokerScoreDetector
 
@@ -905,8 +911,214 @@ class GameBetRounderTest(unittest.TestCase):
         bet_rounder.bet_round("player-2", bets, bet_function_mock)
 
 
+class GameEventDispatcherTest(unittest.TestCase):
+    class SubscriberMock(GameSubscriber):
+        def __init__(self, delay=0.0):
+            self.events = []
+            self._delay = delay
+
+        def game_event(self, event, event_data):
+            gevent.sleep(self._delay)
+            self.events.append((event, dict(event_data)))
+
+    def test_raise_event_does_not_wait_for_subscribers(self):
+        subscriber = GameEventDispatcherTest.SubscriberMock(delay=0.5)
+        event_dispatcher = GameEventDispatcher("game-1", logger=mock.Mock())
+        event_dispatcher.subscribe(subscriber)
+        time_start = time.time()
+        event_dispatcher.raise_event("fold", {})
+        self.assertLess(time.time() - time_start, 0.1)
+        self.assertEqual([], subscriber.events)
+        event_dispatcher.close()
+        self.assertEqual(["fold"], [event for event, _ in subscriber.events])
+
+    def test_events_are_delivered_in_order(self):
+        subscriber = GameEventDispatcherTest.SubscriberMock()
+        event_dispatcher = GameEventDispatcher("game-1", logger=mock.Mock())
+        event_dispatcher.subscribe(subscriber)
+        for i in range(10):
+            event_dispatcher.raise_event("bet", {"bet": i})
+        event_dispatcher.sync()
+        self.assertEqual(list(range(10)), [event_data["bet"] for _, event_data in subscriber.events])
+        self.assertEqual("game-1", subscriber.events[0][1]["game_id"])
+        event_dispatcher.close()
+
+    def test_bets_are_copied(self):
+        subscriber = GameEventDispatcherTest.SubscriberMock()
+        event_dispatcher = GameEventDispatcher("game-1", logger=mock.Mock())
+        event_dispatcher.subscribe(subscriber)
+        player_a = Player("a", "Player A", 1000.0)
+        player_b = Player("b", "Player B", 1000.0)
+        bets = {"a": 20.0}
+        event_dispatcher.bet_event(player_a, 20.0, "blind", bets)
+        bets["b"] = 40.0
+        event_dispatcher.bet_event(player_b, 40.0, "blind", bets)
+        event_dispatcher.bet_action_event(player_a, 20.0, 960.0, bets, 30, time.time() + 30)
+        bets["a"] = 40.0
+        event_dispatcher.sync()
+        self.assertEqual(
+            [{"a": 20.0}, {"a": 20.0, "b": 40.0}, {"a": 20.0, "b": 40.0}],
+            [event_data["bets"] for _, event_data in subscriber.events]
+        )
+        event_dispatcher.close()
+
+    def test_drop_policy(self):
+        subscriber = GameEventDispatcherTest.SubscriberMock()
+        event_dispatcher = GameEventDispatcher("game-1", logger=mock.Mock())
+        event_dispatcher.subscribe(subscriber, policy=GameEventWorker.POLICY_DROP, max_queue_size=2)
+        for i in range(5):
+            event_dispatcher.raise_event("bet", {"bet": i})
+        event_dispatcher.sync()
+        self.assertEqual([0, 1], [event_data["bet"] for _, event_data in subscriber.events])
+        self.assertEqual(3, event_dispatcher._workers[0].dropped)
+        event_dispatcher.close()
+
+    def test_coalesce_policy(self):
+        subscriber = GameEventDispatcherTest.SubscriberMock()
+        event_dispatcher = GameEventDispatcher("game-1", logger=mock.Mock())
+        event_dispatcher.subscribe(subscriber, policy=GameEventWorker.POLICY_COALESCE)
+        event_dispatcher.raise_event("pots-update", {"pots": 1})
+        event_dispatcher.raise_event("pots-update", {"pots": 2})
+        event_dispatcher.raise_event("bet", {})
+        event_dispatcher.raise_event("pots-update", {"pots": 3})
+        event_dispatcher.sync()
+        self.assertEqual(
+            [("pots-update", 2), ("bet", None), ("pots-update", 3)],
+            [(event, event_data.get("pots")) for event, event_data in subscriber.events]
+        )
+        event_dispatcher.close()
+
+    def test_last_event_id(self):
+        event_dispatcher = GameEventDispatcher("game-1", logger=mock.Mock())
+        event_dispatcher.raise_event("new-game", {})
+        new_game_id = event_dispatcher.last_event_id("player-1")
+        event_dispatcher.raise_event("cards-assignment", {"target": "player-1"})
+        self.assertGreater(event_dispatcher.last_event_id("player-1"), new_game_id)
+        self.assertEqual(new_game_id, event_dispatcher.last_event_id("player-2"))
+
+    def test_failing_subscriber_does_not_stop_delivery(self):
+        class FailingSubscriber(GameSubscriber):
+            def game_event(self, event, event_data):
+                raise RuntimeError("Boom")
+
+        subscriber = GameEventDispatcherTest.SubscriberMock()
+        event_dispatcher = GameEventDispatcher("game-1", logger=mock.Mock())
+        event_dispatcher.subscribe(FailingSubscriber())
+        event_dispatcher.subscribe(subscriber)
+        event_dispatcher.raise_event("fold", {})
+        event_dispatcher.raise_event("fold", {})
+        event_dispatcher.close()
+        self.assertEqual(2, len(subscriber.events))
+
+
+class GameAckPacerTest(unittest.TestCase):
+    class SlowChannel(Channel):
+        """Noticing the timeout a little late, like the polling channels"""
+        def __init__(self):
+            self.readers = 0
+
+        def send_message(self, message):
+            pass
+
+        def recv_message(self, timeout_epoch=None):
+            self.readers += 1
+            try:
+                gevent.sleep(max(0.0, timeout_epoch - time.time()) + 0.05)
+                raise MessageTimeout("Timed out")
+            finally:
+                self.readers -= 1
+
+    def test_wait_for_readers(self):
+        channel = GameAckPacerTest.SlowChannel()
+        player = PlayerServer(channel, mock.Mock(), id="player-1", name="Player 1", money=1000.0)
+        event_dispatcher = GameEventDispatcher("game-1", logger=mock.Mock())
+        event_dispatcher.raise_event("new-game", {})
+        GameAckPacer().wait([player], event_dispatcher, 0.05)
+        # The game can read the channel: nobody else is reading it
+        self.assertEqual(0, channel.readers)
+
+
 class GameBetHandlerTest(unittest.TestCase):
-    pass
+    class PlayerMock(Player):
+        def __init__(self, messages):
+            Player.__init__(self, "player-1", "Player One", 1000.0)
+            self.messages = messages
+            self.sent_messages = []
+
+        def recv_message(self, timeout_epoch=None):
+            if not self.messages:
+                raise MessageTimeout("Timed out")
+            return self.messages.pop(0)
+
+        def try_send_message(self, message):
+            self.sent_messages.append(message)
+            return True
+
+    def _create_bet_handler(self):
+        event_dispatcher = mock.Mock()
+        event_dispatcher.game_id = "game-1"
+        return GameBetHandler(
+            game_players=GamePlayers([]),
+            bet_rounder=mock.Mock(),
+            event_dispatcher=event_dispatcher,
+            bet_timeout=30,
+            timeout_tolerance=2,
+            wait_after_round=0
+        )
+
+    def _pre_action(self, action, game_id="game-1"):
+        return {"message_type": "pre-action", "action": action, "game_id": game_id}
+
+    def test_receive_bet(self):
+        player = GameBetHandlerTest.PlayerMock([{"message_type": "bet", "bet": 50}])
+        bet = self._create_bet_handler().receive_bet(player, 20, 100, time.time() + 1)
+        self.assertEqual(50, bet)
+
+    def test_receive_bet_timeout(self):
+        player = GameBetHandlerTest.PlayerMock([])
+        self.assertIsNone(self._create_bet_handler().receive_bet(player, 20, 100, time.time() + 1))
+        self.assertEqual("error", player.sent_messages[0]["message_type"])
+
+    def test_pre_action_check_fold(self):
+        bet_handler = self._create_bet_handler()
+        player = GameBetHandlerTest.PlayerMock([self._pre_action("check-fold")])
+        self.assertEqual(0, bet_handler.receive_bet(player, 0, 100, time.time() + 1))
+        player.messages = [self._pre_action("check-fold")]
+        self.assertEqual(-1, bet_handler.receive_bet(player, 20, 100, time.time() + 1))
+
+    def test_pre_action_call_any(self):
+        player = GameBetHandlerTest.PlayerMock([self._pre_action("call-any")])
+        self.assertEqual(40, self._create_bet_handler().receive_bet(player, 40, 100, time.time() + 1))
+
+    def test_pre_action_condition_not_holding(self):
+        player = GameBetHandlerTest.PlayerMock([self._pre_action("fold-to-any-bet")])
+        bet_handler = self._create_bet_handler()
+        # Nothing to call: waiting for the player
+        self.assertIsNone(bet_handler.receive_bet(player, 0, 100, time.time() + 1))
+
+    def test_pre_action_cancel(self):
+        player = GameBetHandlerTest.PlayerMock([self._pre_action("call-any"), self._pre_action("cancel")])
+        self.assertIsNone(self._create_bet_handler().receive_bet(player, 40, 100, time.time() + 1))
+
+    def test_pre_action_overridden_by_bet(self):
+        player = GameBetHandlerTest.PlayerMock([self._pre_action("check-fold"), {"message_type": "bet", "bet": 60}])
+        bet_handler = self._create_bet_handler()
+        self.assertEqual(60, bet_handler.receive_bet(player, 40, 100, time.time() + 1))
+        self.assertIsNone(bet_handler.receive_bet(player, 40, 100, time.time() + 1))
+
+    def test_pre_action_from_previous_game_ignored(self):
+        player = GameBetHandlerTest.PlayerMock([self._pre_action("call-any", game_id="game-0")])
+        self.assertIsNone(self._create_bet_handler().receive_bet(player, 40, 100, time.time() + 1))
+
+    def test_pre_action_stored_for_next_turn(self):
+        bet_handler = self._create_bet_handler()
+        player = GameBetHandlerTest.PlayerMock([])
+        bet_handler.set_pre_action(player, self._pre_action("check"))
+        self.assertEqual(0, bet_handler.receive_bet(player, 0, 100, time.time() + 1))
+
+    def test_invalid_pre_action(self):
+        player = GameBetHandlerTest.PlayerMock([self._pre_action("all-in")])
+        self.assertIsNone(self._create_bet_handler().receive_bet(player, 40, 100, time.time() + 1))
 
 
 class GameTest(unittest.TestCase):
@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+
+from redis import exceptions
+
+from poker.game_cluster import GameClusterRegistry
+
+
+class GameClusterRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.redis = mock.Mock()
+        self.claim_room = mock.Mock(return_value=b"node-1")
+        self.player_node = mock.Mock(return_value=None)
+        self.compare_delete = mock.Mock(return_value=1)
+        self.redis.register_script.side_effect = [self.claim_room, self.player_node, self.compare_delete]
+        self.registry = GameClusterRegistry(self.redis, "poker", "node-1", logger=mock.Mock())
+
+    def test_route_private_room_owned(self):
+        self.assertIsNone(self.registry.route({"room_id": "room-1", "player": {"id": "player-1"}}))
+        self.claim_room.assert_called_once_with(keys=["poker:rooms"], args=["room-1", "node-1", "poker:node:"])
+
+    def test_route_private_room_owned_by_other_node(self):
+        self.claim_room.return_value = b"node-2"
+        self.assertEqual("node-2", self.registry.route({"room_id": "room-1", "player": {"id": "player-1"}}))
+
+    def test_route_public_room_player_seated_elsewhere(self):
+        self.player_node.return_value = b"node-2"
+        self.assertEqual("node-2", self.registry.route({"player": {"id": "player-1"}}))
+        self.player_node.assert_called_once_with(
+            keys=["poker:rooms", "poker:players"],
+            args=["player-1", "poker:node:"]
+        )
+
+    def test_route_public_room_new_player(self):
+        self.assertIsNone(self.registry.route({"player": {"id": "player-1"}}))
+
+    def test_route_redis_error(self):
+        self.claim_room.side_effect = exceptions.ConnectionError("Connection lost")
+        self.assertIsNone(self.registry.route({"room_id": "room-1", "player": {"id": "player-1"}}))
+
+    def test_forward(self):
+        self.redis.pipeline.return_value.execute.return_value = [1, True]
+        message = {"room_id": "room-1"}
+        self.registry.forward(message, "node-2")
+        self.assertEqual(1, message["forwards"])
+        self.redis.pipeline.return_value.lpush.assert_called_once()
+        self.assertEqual("poker:node:node-2:inbox", self.redis.pipeline.return_value.lpush.call_args[0][0])
+
+    def test_route_max_forwards(self):
+        self.claim_room.return_value = b"node-2"
+        message = {"room_id": "room-1", "forwards": GameClusterRegistry.MAX_FORWARDS}
+        self.assertIsNone(self.registry.route(message))
+
+    def test_room_event(self):
+        self.registry.room_event("room-1", "player-added", "player-1")
+        self.redis.hset.assert_called_once_with("poker:players", "player-1", "room-1")
+        self.registry.room_event("room-1", "player-removed", "player-1")
+        self.compare_delete.assert_called_once_with(keys=["poker:players"], args=["player-1", "room-1"])
+
+    def test_stop_releases_rooms(self):
+        self.registry.claim_room("room-1")
+        self.registry.stop()
+        self.compare_delete.assert_called_once_with(keys=["poker:rooms"], args=["room-1", "node-1"])
+        self.redis.delete.assert_called_once_with("poker:node:node-1")
+
+    def test_prune(self):
+        pipeline = self.redis.pipeline.return_value
+        pipeline.execute.return_value = [0, [b"node-1"]]
+        self.redis.hscan_iter.side_effect = [
+            iter([(b"room-1", b"node-1"), (b"room-2", b"node-2")]),
+            iter([(b"player-1", b"room-1"), (b"player-2", b"room-2"), (b"player-3", b"room-3")]),
+        ]
+        # room-2 removed in the meantime
+        self.redis.hmget.return_value = [b"node-1", None, None]
+
+        self.assertEqual(3, self.registry.prune())
+        self.assertEqual([
+            mock.call(keys=["poker:rooms"], args=[b"room-2", b"node-2"]),
+            mock.call(keys=["poker:players"], args=[b"player-2", b"room-2"]),
+            mock.call(keys=["poker:players"], args=[b"player-3", b"room-3"]),
+        ], self.compare_delete.call_args_list)
@@ -0,0 +1,62 @@
+import json
+import unittest
+from unittest import mock
+
+from redis import exceptions
+
+from poker.game_event_stream import GameEventPublisher, GAME_EVENTS_STREAM
+
+
+class GameEventPublisherTest(unittest.TestCase):
+    def setUp(self):
+        self.redis = mock.Mock()
+        self.publisher = GameEventPublisher(self.redis, "texas-holdem-poker", logger=mock.Mock(), node_id="node-1")
+
+    def _published(self):
+        stream, fields = self.redis.xadd.call_args[0]
+        self.assertEqual(GAME_EVENTS_STREAM, stream)
+        return json.loads(fields["events"])
+
+    def test_flush(self):
+        self.publisher.game_event("new-game", {"game_id": "game-1", "game_type": "texas-holdem", "players": [{}, {}]})
+        self.publisher.game_event("bet", {"game_id": "game-1", "bet": 40.0})
+        self.publisher.game_event("winner-designation", {"game_id": "game-1", "pot": {"money": 80.0}})
+        self.publisher.room_event("room-1", "player-rejoined", "player-1")
+        self.publisher.flush()
+
+        records = self._published()
+        self.assertEqual(
+            ["new-game", "winner-designation", "player-rejoined", "node"],
+            [record["event"] for record in records]
+        )
+        self.assertEqual(2, records[0]["players"])
+        self.assertEqual(80.0, records[1]["pot"])
+        self.assertEqual({"node": "node-1", "cluster": "texas-holdem-poker", "tables": 1, "dropped": 0},
+                         {key: records[-1][key] for key in ("node", "cluster", "tables", "dropped")})
+        self.assertTrue(self.redis.xadd.call_args[1]["approximate"])
+
+    def test_game_over(self):
+        self.publisher.game_event("new-game", {"game_id": "game-1", "players": []})
+        self.publisher.game_event("game-over", {"game_id": "game-1"})
+        self.publisher.flush()
+        self.assertEqual(0, self._published()[-1]["tables"])
+        # Buffer emptied
+        self.publisher.flush()
+        self.assertEqual(["node"], [record["event"] for record in self._published()])
+
+    def test_overflow(self):
+        with mock.patch.object(GameEventPublisher, "MAX_PENDING", 2):
+            publisher = GameEventPublisher(self.redis, "poker", logger=mock.Mock())
+        for _ in range(3):
+            publisher.game_event("dead-player", {"game_id": "game-1"})
+        self.assertEqual(1, publisher.dropped)
+
+    def test_redis_error(self):
+        self.redis.xadd.side_effect = exceptions.ConnectionError("Connection refused")
+        self.publisher.game_event("game-over", {"game_id": "game-1"})
+        self.publisher.flush()
+        self.assertEqual(1, self.publisher.dropped)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,8 @@ from unittest import mock
 
 from poker.channel import Channel
 from poker.player_server import PlayerServer
-from poker.game_server import GameServer, ConnectedPlayer
+from poker.game_room import GameRoom, GameRoomFactory
+from poker.game_server import GameServer, ConnectedPlayer, GameRoomRegistry, TooManyRoomsException
 
 
 class GameServerTest(unittest.TestCase):
@@ -37,6 +38,142 @@ class GameServerTest(unittest.TestCase):
         time_diff = time.time() - time_start
         self.assertLess(time_diff, 0.3, "It took {} seconds to connect 500 players. Too slow!".format(time_diff))
 
+    def _connected_player(self, player_id, room_id):
+        return ConnectedPlayer(
+            PlayerServer(GameServerTest.NoOpChannel(), mock.Mock(), id=player_id, name=player_id, money=1000.0),
+            room_id
+        )
+
+    def test_remove_idle_rooms(self):
+        server = GameServer(GameRoomFactory(room_size=3, game_factory=mock.Mock()), mock.Mock(), room_ttl=60)
+        server._join_room(self._connected_player("player-1", "room-1"))
+        server._join_room(self._connected_player("player-2", "room-2"))
+        server._rooms.get("room-1").leave("player-1")
+        server.remove_idle_rooms()
+        self.assertEqual(2, len(server._rooms))
+        server.remove_idle_rooms(ttl=0)
+        self.assertIsNone(server._rooms.get("room-1"))
+        self.assertIsNotNone(server._rooms.get("room-2"))
+
+    def test_remove_idle_rooms_with_dead_players(self):
+        server = GameServer(GameRoomFactory(room_size=3, game_factory=mock.Mock()), mock.Mock(), room_ttl=60)
+        connected_player = self._connected_player("player-1", "room-1")
+        server._join_room(connected_player)
+        connected_player.player.disconnect()
+        server.remove_idle_rooms()
+        # The dead player is removed and the room is evicted once idle for the ttl
+        self.assertEqual(0, len(server._rooms.get("room-1").players))
+        server.remove_idle_rooms(ttl=0)
+        self.assertIsNone(server._rooms.get("room-1"))
+
+    def test_max_rooms(self):
+        server = GameServer(GameRoomFactory(room_size=3, game_factory=mock.Mock()), mock.Mock(), max_rooms=1)
+        server._join_room(self._connected_player("player-1", "room-1"))
+        self.assertRaises(TooManyRoomsException, server._join_room, self._connected_player("player-2", "room-2"))
+        # Empty rooms are evicted to make space
+        server._rooms.get("room-1").leave("player-1")
+        server._join_room(self._connected_player("player-2", "room-2"))
+        self.assertIsNone(server._rooms.get("room-1"))
+
+    def test_drain(self):
+        players = [self._connected_player("player-1", "room-1"), self._connected_player("player-2", "room-2")]
+        migrated = []
+
+        class DrainingGameServer(GameServer):
+            def new_players(self):
+                yield players[0]
+                self.drain()
+                yield players[1]
+
+            def migrate_room(self, room):
+                migrated.append(room.export_state())
+
+        game_factory = mock.Mock()
+        server = DrainingGameServer(GameRoomFactory(room_size=3, game_factory=game_factory), mock.Mock())
+        server.start()
+        # The player connected while draining is still seated and migrated
+        self.assertEqual(["room-1", "room-2"], sorted(state["room_id"] for state in migrated))
+        self.assertEqual(0, len(server._rooms))
+        game_factory.create_game.assert_not_called()
+
+    def test_restore_room(self):
+        room = GameRoom("room-1", private=True, game_factory=mock.Mock(), room_size=3, logger=mock.Mock())
+        room.join(self._connected_player("player-1", "room-1").player)
+        room.join(self._connected_player("player-2", "room-1").player)
+        room.leave("player-1")
+        state = room.export_state()
+        self.assertEqual([None, "player-2", None], state["player_ids"])
+
+        server = GameServer(GameRoomFactory(room_size=3, game_factory=mock.Mock()), mock.Mock())
+        player = self._connected_player("player-2", "room-1").player
+        restored = server._restore_room(state, {"player-2": player})
+        self.assertEqual([None, "player-2", None], restored.export_state()["player_ids"])
+        self.assertTrue(restored.private)
+        self.assertIs(restored, server._rooms.get_player_room("player-2"))
+
+
+class GameRoomRegistryTest(unittest.TestCase):
+    def _create_room(self, room_id, room_size=3, private=False):
+        return GameRoom(room_id, private=private, game_factory=mock.Mock(), room_size=room_size, logger=mock.Mock())
+
+    def _create_player(self, player_id):
+        return PlayerServer(GameServerTest.NoOpChannel(), mock.Mock(), id=player_id, name=player_id, money=1000.0)
+
+    def test_get(self):
+        registry = GameRoomRegistry()
+        room = self._create_room("room-1")
+        registry.add(room)
+        self.assertIs(room, registry.get("room-1"))
+        self.assertIsNone(registry.get("room-2"))
+
+    def test_find_public_room_prefers_fullest(self):
+        registry = GameRoomRegistry()
+        room1 = self._create_room("room-1")
+        room2 = self._create_room("room-2")
+        registry.add(room1)
+        registry.add(room2)
+        room2.join(self._create_player("player-1"))
+        self.assertIs(room2, registry.find_public_room())
+        room2.join(self._create_player("player-2"))
+        room2.join(self._create_player("player-3"))
+        # room-2 is now full
+        self.assertIs(room1, registry.find_public_room())
+        room2.leave("player-3")
+        self.assertIs(room2, registry.find_public_room())
+
+    def test_find_public_room_prefers_emptiest(self):
+        registry = GameRoomRegistry(fill_preference=GameRoomRegistry.FILL_EMPTIEST)
+        room1 = self._create_room("room-1")
+        room2 = self._create_room("room-2")
+        registry.add(room1)
+        registry.add(room2)
+        room1.join(self._create_player("player-1"))
+        self.assertIs(room2, registry.find_public_room())
+
+    def test_find_public_room_skips_private_rooms(self):
+        registry = GameRoomRegistry()
+        registry.add(self._create_room("room-1", private=True))
+        self.assertIsNone(registry.find_public_room())
+
+    def test_get_player_room(self):
+        registry = GameRoomRegistry()
+        room = self._create_room("room-1")
+        registry.add(room)
+        room.join(self._create_player("player-1"))
+        self.assertIs(room, registry.get_player_room("player-1"))
+        room.leave("player-1")
+        self.assertIsNone(registry.get_player_room("player-1"))
+
+    def test_remove(self):
+        registry = GameRoomRegistry()
+        room = self._create_room("room-1")
+        registry.add(room)
+        room.join(self._create_player("player-1"))
+        registry.remove(room)
+        self.assertEqual(0, len(registry))
+        self.assertIsNone(registry.find_public_room())
+        self.assertIsNone(registry.get_player_room("player-1"))
+
 
 if __name__ == '__main__':
     unittest.main()
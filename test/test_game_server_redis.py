@@ -0,0 +1,113 @@
+import json
+import time
+import unittest
+from unittest import mock
+
+from redis import exceptions
+
+from poker.game_cluster import GameClusterRegistry
+from poker.game_room import GameRoomFactory
+from poker.game_server_redis import GameServerRedis
+
+
+class GameServerRedisTest(unittest.TestCase):
+    def _connection_message(self, player_id, timeout_epoch=None, reply_to=None):
+        return json.dumps({
+            "timeout_epoch": time.time() + 5 if timeout_epoch is None else timeout_epoch,
+            "session_id": "session-{}".format(player_id),
+            "player": {"id": player_id, "name": player_id, "money": 1000.0},
+            "reply_to": reply_to
+        }).encode("utf-8")
+
+    def _create_server(self, redis):
+        return GameServerRedis(
+            redis=redis,
+            connection_channel="lobby",
+            room_factory=GameRoomFactory(room_size=3, game_factory=mock.Mock()),
+            logger=mock.Mock()
+        )
+
+    def test_new_player_batches(self):
+        redis = mock.Mock()
+        redis.rpop.return_value = [
+            self._connection_message("player-1"),
+            self._connection_message("player-2", timeout_epoch=time.time() - 1),
+            b"not json",
+            self._connection_message("player-3"),
+        ]
+        pipeline = redis.pipeline.return_value
+        pipeline.execute.return_value = [1, True, 1, True]
+
+        batch = next(self._create_server(redis).new_player_batches())
+
+        self.assertEqual(["player-1", "player-3"], [player.player.id for player in batch])
+        redis.rpop.assert_called_once_with("lobby", GameServerRedis.ADMISSION_BATCH_SIZE)
+        # Connections acknowledged in a single round trip
+        pipeline.execute.assert_called_once()
+        self.assertEqual(
+            ["poker5:player-player-1:session-session-player-1:O", "poker5:player-player-3:session-session-player-3:O"],
+            [call[0][0] for call in pipeline.lpush.call_args_list]
+        )
+
+    def test_new_player_batches_failed_acknowledgement(self):
+        redis = mock.Mock()
+        redis.rpop.return_value = [self._connection_message("player-1"), self._connection_message("player-2")]
+        redis.pipeline.return_value.execute.return_value = [exceptions.ResponseError("Error"), True, 1, True]
+
+        batch = next(self._create_server(redis).new_player_batches())
+
+        self.assertEqual(["player-2"], [player.player.id for player in batch])
+
+    def test_new_player_batches_multiplexed(self):
+        redis = mock.Mock()
+        redis.rpop.return_value = [self._connection_message("player-1", reply_to="gateway-1:inbox")]
+        pipeline = redis.pipeline.return_value
+        pipeline.execute.return_value = [1, True]
+
+        server = self._create_server(redis)
+        batch = next(server.new_player_batches())
+
+        self.assertEqual("gateway-1:inbox", batch[0].player.channel.remote_inbox)
+        self.assertEqual("gateway-1:inbox", pipeline.lpush.call_args[0][0])
+        envelope = json.loads(pipeline.lpush.call_args[0][1].decode("utf-8"))
+        self.assertEqual("session-player-1", envelope["session_id"])
+        self.assertEqual("connect", envelope["message"]["message_type"])
+        server.on_shutdown()
+
+    def test_claim_released_when_connection_rejected(self):
+        redis = mock.Mock()
+        claim_room = mock.Mock(side_effect=lambda keys, args: args[1].encode("utf-8"))
+        compare_delete = mock.Mock(return_value=1)
+        redis.register_script.side_effect = lambda script: {
+            GameClusterRegistry.CLAIM_ROOM_SCRIPT: claim_room,
+            GameClusterRegistry.COMPARE_DELETE_SCRIPT: compare_delete,
+        }.get(script, mock.Mock())
+        expired = json.loads(self._connection_message("player-1", timeout_epoch=time.time() - 1))
+        redis.rpop.return_value = [
+            json.dumps(dict(expired, room_id="room-1")).encode("utf-8"),
+            json.dumps(dict(json.loads(self._connection_message("player-2")), room_id="room-2")).encode("utf-8")
+        ]
+        redis.pipeline.return_value.execute.return_value = [1, True]
+        server = GameServerRedis(
+            redis=redis,
+            connection_channel="lobby",
+            room_factory=GameRoomFactory(room_size=3, game_factory=mock.Mock()),
+            logger=mock.Mock(),
+            cluster_name="poker"
+        )
+
+        batch = next(server.new_player_batches())
+
+        self.assertEqual(["player-2"], [player.player.id for player in batch])
+        compare_delete.assert_called_once_with(keys=["poker:rooms"], args=["room-1", server._cluster.node_id])
+
+    def test_admission_rate(self):
+        redis = mock.Mock()
+        server = self._create_server(redis)
+        server._admissions.append((time.time() - 2 * GameServerRedis.ADMISSION_RATE_WINDOW, 100))
+        server._admissions.append((time.time(), 20))
+        self.assertEqual(20 / GameServerRedis.ADMISSION_RATE_WINDOW, server.admission_rate)
+
+
+if __name__ == '__main__':
+    unittest.main()
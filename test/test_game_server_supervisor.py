@@ -0,0 +1,62 @@
+import unittest
+from unittest import mock
+
+import gevent
+from redis import exceptions
+
+from poker.channel import MessageFormatError
+from poker.game_server_supervisor import GameServerSupervisor
+
+
+class GameServerSupervisorTest(unittest.TestCase):
+    def _create_supervisor(self, num_workers=3):
+        return GameServerSupervisor(mock.Mock(), "lobby", ["worker"], num_workers, logger=mock.Mock())
+
+    def test_worker_channel(self):
+        supervisor = self._create_supervisor()
+        self.assertEqual("lobby:worker-2", supervisor.worker_channel(2))
+
+    def test_route_private_room(self):
+        supervisor = self._create_supervisor()
+        worker_id = supervisor.route({"room_id": "room-1", "player": {"id": "player-1"}})
+        for i in range(10):
+            # Every player of a private room goes to the same worker
+            self.assertEqual(worker_id, supervisor.route({"room_id": "room-1", "player": {"id": "player-{}".format(i)}}))
+
+    def test_route_public_room_least_loaded(self):
+        supervisor = self._create_supervisor()
+        supervisor._loads[0] = 10
+        supervisor._loads[1] = 2
+        supervisor._loads[2] = 3
+        self.assertEqual(1, supervisor.route({"player": {"id": "player-1"}}))
+        self.assertEqual(1, supervisor.route({"player": {"id": "player-2"}}))
+        # Taking into account players assigned since the last load report
+        self.assertEqual(2, supervisor.route({"player": {"id": "player-3"}}))
+
+    def test_route_public_room_sticky(self):
+        supervisor = self._create_supervisor()
+        worker_id = supervisor.route({"player": {"id": "player-1"}})
+        supervisor._loads[worker_id] = 100
+        self.assertEqual(worker_id, supervisor.route({"player": {"id": "player-1"}}))
+
+    def test_route_invalid_message(self):
+        supervisor = self._create_supervisor()
+        self.assertRaises(MessageFormatError, supervisor.route, {})
+
+    @mock.patch.object(GameServerSupervisor, "LOAD_REPORT_INTERVAL", 0.01)
+    def test_track_loads_after_redis_error(self):
+        supervisor = self._create_supervisor(num_workers=1)
+        supervisor._workers[0] = mock.Mock()
+        responses = [exceptions.ConnectionError("Connection refused")]
+
+        def hgetall(key):
+            if responses:
+                raise responses.pop()
+            return {b"0": b"3"}
+
+        supervisor._redis.hgetall.side_effect = hgetall
+        tracker = gevent.spawn(supervisor._track_loads)
+        gevent.sleep(0.05)
+        tracker.kill()
+        supervisor._logger.error.assert_called_once()
+        self.assertEqual(3, supervisor._loads[0])
@@ -0,0 +1,193 @@
+import glob
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+from unittest import mock
+
+import gevent
+
+from poker.card import Card
+from poker.hand_history import HandHistoryRecorder, HandHistoryWriter, read_hands, write_varint, read_varint
+
+
+GAME_ID = str(uuid.uuid4())
+
+
+def holdem_events():
+    players = [
+        {"id": "player-1", "name": "Alice", "money": 1000.0},
+        {"id": "player-2", "name": "Bob", "money": 960.5},
+        {"id": "player-3", "name": "Carl", "money": 20.0},
+    ]
+    hole_cards = {
+        "player-1": [Card(14, 3).dto(), Card(14, 2).dto()],
+        "player-2": [Card(9, 1).dto(), Card(2, 0).dto()],
+        "player-3": [Card(13, 3).dto(), Card(12, 3).dto()],
+    }
+    events = [("new-game", {"game_type": "texas-holdem", "players": players, "dealer_id": "player-1",
+                            "big_blind": 40.0, "small_blind": 20.0})]
+    events += [("cards-assignment", {"target": player_id, "cards": cards, "score": {}})
+               for player_id, cards in hole_cards.items()]
+    events += [
+        ("bet", {"player": players[1], "bet": 20.0, "bet_type": "blind", "bets": {}}),
+        ("bet", {"player": players[2], "bet": 20.0, "bet_type": "all-in", "bets": {}}),
+        ("player-action", {"action": "bet", "player": players[0]}),
+        ("bet", {"player": players[0], "bet": 120.0, "bet_type": "raise", "bets": {}}),
+        ("fold", {"player": players[1]}),
+        ("shared-cards", {"cards": [Card(14, 1).dto(), Card(5, 0).dto(), Card(7, 2).dto()]}),
+        ("showdown", {"players": {player_id: {"cards": hole_cards[player_id], "score": {}}
+                                  for player_id in ("player-1", "player-3")}}),
+        ("winner-designation", {"pot": {"money": 60.0, "player_ids": ["player-1", "player-2", "player-3"],
+                                        "winner_ids": ["player-1"], "money_split": 60.0},
+                                "pots": [], "players": {}}),
+        ("game-over", {}),
+    ]
+    return [(event, dict(event_data, event=event, game_id=GAME_ID, event_id=str(uuid.uuid4())))
+            for event, event_data in events]
+
+
+class VarintTest(unittest.TestCase):
+    def test_round_trip(self):
+        for value in (0, 1, 127, 128, 300, 2 ** 40):
+            buffer = bytearray()
+            write_varint(buffer, value)
+            self.assertEqual(value, read_varint(io.BytesIO(bytes(buffer))))
+        buffer = bytearray()
+        write_varint(buffer, 127)
+        self.assertEqual(1, len(buffer))
+
+
+class HandHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.writer = HandHistoryWriter(self.directory, "test", logger=mock.Mock())
+        self.recorder = HandHistoryRecorder(self.writer, logger=mock.Mock())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _hands(self):
+        return [hand for path in sorted(glob.glob(os.path.join(self.directory, "*.hh"))) for hand in read_hands(path)]
+
+    def test_holdem(self):
+        for event, event_data in holdem_events():
+            self.recorder.game_event(event, event_data)
+        self.recorder.close()
+
+        hands = self._hands()
+        self.assertEqual(1, len(hands))
+        hand = hands[0]
+        self.assertEqual(GAME_ID, hand["game_id"])
+        self.assertEqual("texas-holdem", hand["game_type"])
+        self.assertEqual("player-1", hand["dealer_id"])
+        self.assertEqual({"id": "player-2", "name": "Bob", "money": 960.5}, hand["players"][1])
+        self.assertEqual(
+            ["cards-assignment"] * 3 + ["bet", "bet", "bet", "fold", "shared-cards", "showdown", "winner-designation"],
+            [action["action"] for action in hand["actions"]]
+        )
+        self.assertEqual([(14, 3), (14, 2)], hand["actions"][0]["cards"])
+        self.assertEqual({"action": "bet", "player": "player-1", "bet": 120.0, "bet_type": "raise"}, hand["actions"][5])
+        self.assertEqual({"player-1", "player-3"}, set(hand["actions"][8]["players"]))
+        self.assertEqual(
+            {"action": "winner-designation", "pot": 60.0, "money_split": 60.0, "winners": ["player-1"]},
+            hand["actions"][9]
+        )
+
+    def test_traditional_blinds(self):
+        self.recorder.game_event("new-game", {
+            "game_id": "game-1", "game_type": "traditional", "dealer_id": "player-1",
+            "players": [{"id": "player-1", "name": "Alice", "money": 990.0}],
+            "blind_bets": {"player-1": 10.0}
+        })
+        self.recorder.game_event("cards-change", {"game_id": "game-1", "player": {"id": "player-1"}, "num_cards": 3})
+        self.recorder.game_event("game-over", {"game_id": "game-1"})
+        self.recorder.close()
+
+        hand = self._hands()[0]
+        self.assertEqual("game-1", hand["game_id"])
+        self.assertEqual([
+            {"action": "bet", "player": "player-1", "bet": 10.0, "bet_type": "blind"},
+            {"action": "cards-change", "player": "player-1", "num_cards": 3}
+        ], hand["actions"])
+
+    def test_unfinished_hand(self):
+        events = holdem_events()
+        for event, event_data in events[:-1]:
+            self.recorder.game_event(event, event_data)
+        self.recorder.close()
+        self.assertEqual([], self._hands())
+
+    def test_compact(self):
+        events = holdem_events()
+        for event, event_data in events:
+            self.recorder.game_event(event, event_data)
+        self.recorder.close()
+        size = sum(os.path.getsize(path) for path in glob.glob(os.path.join(self.directory, "*.hh")))
+        self.assertLess(size * 10, len(json.dumps(events)))
+
+    def test_rotation(self):
+        writer = HandHistoryWriter(self.directory, "test", max_file_size=1000, logger=mock.Mock())
+        recorder = HandHistoryRecorder(writer)
+        for _ in range(20):
+            for event, event_data in holdem_events():
+                recorder.game_event(event, event_data)
+            writer.flush()
+        recorder.close()
+        self.assertGreater(len(glob.glob(os.path.join(self.directory, "*.hh"))), 1)
+        self.assertEqual(20, len(self._hands()))
+
+    def test_slow_disk(self):
+        write_chunk = self.writer._write_chunk
+
+        def slow_write_chunk(chunk):
+            time.sleep(0.2)
+            write_chunk(chunk)
+
+        self.writer._write_chunk = slow_write_chunk
+        for _ in range(3):
+            for event, event_data in holdem_events():
+                self.recorder.game_event(event, event_data)
+            time_start = time.time()
+            self.writer.flush()
+            gevent.sleep(0)
+            self.assertLess(time.time() - time_start, 0.1)
+        self.recorder.close()
+        self.assertEqual(3, len(self._hands()))
+
+    @mock.patch.object(HandHistoryWriter, "MAX_PENDING_SIZE", 100)
+    def test_pending_overflow(self):
+        self.writer._write_chunk = lambda chunk: time.sleep(0.1)
+        for _ in range(3):
+            for event, event_data in holdem_events():
+                self.recorder.game_event(event, event_data)
+            self.writer.flush()
+        self.recorder.close()
+        self.assertGreater(self.writer.dropped_bytes, 0)
+
+    def test_truncated_file(self):
+        for event, event_data in holdem_events():
+            self.recorder.game_event(event, event_data)
+        self.recorder.close()
+        path = glob.glob(os.path.join(self.directory, "*.hh"))[0]
+        with open(path, "ab") as f:
+            f.write(b"\x7f\x00")
+        self.assertEqual(1, len(list(read_hands(path))))
+
+    def test_invalid_event(self):
+        logger = mock.Mock()
+        recorder = HandHistoryRecorder(self.writer, logger=logger)
+        recorder.game_event("new-game", {"game_id": "game-1", "game_type": "texas-holdem", "players": []})
+        recorder.game_event("fold", {"game_id": "game-1", "player": {"id": "player-1"}})
+        recorder.game_event("game-over", {"game_id": "game-1"})
+        recorder.close()
+        logger.error.assert_called_once()
+        self.assertEqual([], self._hands())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from poker.lobby import LobbyShards
+
+
+class LobbyShardsTest(unittest.TestCase):
+    def test_shard_name(self):
+        self.assertEqual("lobby", LobbyShards("lobby").shard_name(0))
+        self.assertEqual("lobby:shard-3", LobbyShards("lobby", 8).shard_name(3))
+        self.assertEqual(["lobby:shard-0", "lobby:shard-1"], LobbyShards("lobby", 2).shard_names())
+
+    def test_shard_of_private_room(self):
+        lobby = LobbyShards("lobby", 16)
+        shard = lobby.shard_of(player_id="player-1", room_id="room-1")
+        for i in range(20):
+            self.assertEqual(shard, lobby.shard_of(player_id="player-{}".format(i), room_id="room-1"))
+
+    def test_shard_of_public_room(self):
+        lobby = LobbyShards("lobby", 16)
+        shards = {lobby.shard_of(player_id="player-{}".format(i)) for i in range(100)}
+        self.assertGreater(len(shards), 1)
+
+    def test_assigned_shards_partition(self):
+        lobby = LobbyShards("lobby", 32)
+        nodes = ["node-1", "node-2", "node-3"]
+        assigned = [shard for node in nodes for shard in lobby.assigned_shards(node, nodes)]
+        self.assertEqual(list(range(32)), sorted(assigned))
+
+    def test_assigned_shards_rebalance(self):
+        lobby = LobbyShards("lobby", 32)
+        nodes = ["node-1", "node-2", "node-3"]
+        before = {node: set(lobby.assigned_shards(node, nodes)) for node in nodes}
+        # node-3 leaving: the other nodes keep their shards and share the shards of node-3
+        after = {node: set(lobby.assigned_shards(node, nodes[:2])) for node in nodes[:2]}
+        for node in nodes[:2]:
+            self.assertTrue(before[node].issubset(after[node]))
+        self.assertEqual(before["node-3"], (after["node-1"] | after["node-2"]) - before["node-1"] - before["node-2"])
+
+    def test_assigned_shards_unknown_node(self):
+        # A node not registered yet takes part to the assignment anyway
+        lobby = LobbyShards("lobby", 4)
+        self.assertEqual([0, 1, 2, 3], lobby.assigned_shards("node-1", []))
@@ -0,0 +1,80 @@
+import unittest
+
+from poker.metrics import MetricsRegistry, MetricsServer
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter(self):
+        counter = self.registry.counter("hands_total", "Hands", ["game"])
+        counter.labels("texas-holdem").inc()
+        counter.labels("texas-holdem").inc()
+        counter.labels("traditional").inc(3)
+        self.assertEqual(
+            "# HELP hands_total Hands\n"
+            "# TYPE hands_total counter\n"
+            'hands_total{game="texas-holdem"} 2\n'
+            'hands_total{game="traditional"} 3\n',
+            self.registry.render()
+        )
+
+    def test_gauge_function(self):
+        rooms = []
+        self.registry.gauge("rooms", "Rooms").set_function(lambda: len(rooms))
+        rooms.append("room-1")
+        self.assertIn("rooms 1\n", self.registry.render())
+
+    def test_broken_gauge(self):
+        self.registry.gauge("broken", "Broken").set_function(lambda: 1 / 0)
+        self.registry.counter("working", "Working").inc()
+        self.assertIn("working 1\n", self.registry.render())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual(
+            "# HELP latency_seconds Latency\n"
+            "# TYPE latency_seconds histogram\n"
+            'latency_seconds_bucket{le="0.1"} 2\n'
+            'latency_seconds_bucket{le="1.0"} 3\n'
+            'latency_seconds_bucket{le="+Inf"} 4\n'
+            "latency_seconds_sum 2.65\n"
+            "latency_seconds_count 4\n",
+            self.registry.render()
+        )
+
+    def test_labelled_histogram(self):
+        histogram = self.registry.histogram("latency_seconds", "Latency", ["stage"], buckets=(1.0,))
+        histogram.labels("redis").observe(0.5)
+        self.assertIn('latency_seconds_bucket{stage="redis",le="1.0"} 1\n', self.registry.render())
+        self.assertIn('latency_seconds_count{stage="redis"} 1\n', self.registry.render())
+
+    def test_registered_twice(self):
+        counter = self.registry.counter("hands_total", "Hands")
+        self.assertIs(counter, self.registry.counter("hands_total", "Hands"))
+        self.assertRaises(ValueError, self.registry.gauge, "hands_total", "Hands")
+
+    def test_invalid_labels(self):
+        counter = self.registry.counter("hands_total", "Hands", ["game"])
+        self.assertRaises(ValueError, counter.labels, "texas-holdem", "extra")
+
+
+class MetricsServerTest(unittest.TestCase):
+    def _get(self, server, path):
+        status = []
+        body = server._application({"PATH_INFO": path}, lambda code, headers: status.append(code))
+        return status[0], b"".join(body).decode("utf-8")
+
+    def test_scrape(self):
+        registry = MetricsRegistry()
+        registry.counter("hands_total", "Hands").inc()
+        server = MetricsServer(0, metrics=registry)
+        self.assertEqual(("200 OK", registry.render()), self._get(server, "/metrics"))
+        self.assertEqual("404 Not Found", self._get(server, "/")[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
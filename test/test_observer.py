@@ -0,0 +1,132 @@
+import json
+import time
+import unittest
+from unittest import mock
+
+import gevent
+import gevent.socket
+from redis import exceptions
+
+from observer import RollingWindow, GameObserver, GameEventReader, create_metrics
+from poker.metrics import MetricsServer
+
+
+class RollingWindowTest(unittest.TestCase):
+    def test_snapshot(self):
+        window = RollingWindow(window_seconds=60, num_buckets=6)
+        window.add(10.0, at=1000.0)
+        window.add(30.0, at=1015.0)
+        snapshot = window.snapshot(now=1020.0)
+        self.assertEqual(2, snapshot["count"])
+        self.assertEqual(2.0, snapshot["per_minute"])
+        self.assertEqual(20.0, snapshot["average"])
+        self.assertEqual(30.0, snapshot["max"])
+
+    def test_expired_buckets(self):
+        window = RollingWindow(window_seconds=60, num_buckets=6)
+        window.add(10.0, at=1000.0)
+        window.add(30.0, at=1065.0)
+        # Same bucket slot, older value ignored
+        window.add(50.0, at=1001.0)
+        self.assertEqual(1, window.snapshot(now=1065.0)["count"])
+        self.assertEqual(0, window.snapshot(now=2000.0)["count"])
+
+    def test_constant_memory(self):
+        window = RollingWindow(window_seconds=60, num_buckets=6)
+        for second in range(10000):
+            window.add(1.0, at=float(second))
+        self.assertEqual(6, len(window._buckets))
+
+
+class GameObserverTest(unittest.TestCase):
+    def test_stats(self):
+        observer = GameObserver(window_seconds=60, num_buckets=6)
+        for record in (
+            {"event": "new-game", "game_type": "texas-holdem", "players": 4, "time": 1000.0},
+            {"event": "winner-designation", "pot": 200.0, "time": 1001.0},
+            {"event": "winner-designation", "pot": 100.0, "time": 1001.0},
+            {"event": "game-over", "time": 1002.0},
+            {"event": "dead-player", "time": 1002.0},
+            {"event": "player-rejoined", "time": 1003.0},
+            {"event": "node", "node": "node-1", "tables": 3, "dropped": 0, "time": 1003.0},
+            {"event": "node", "node": "node-2", "tables": 2, "dropped": 1, "time": 1004.0},
+        ):
+            observer.observe(record)
+        stats = observer.stats(now=1005.0)
+        self.assertEqual(5, stats["active_tables"])
+        self.assertEqual(1.0, stats["hands_per_minute"])
+        self.assertEqual(150.0, stats["pot_average"])
+        self.assertEqual(200.0, stats["pot_max"])
+        self.assertEqual(1.0, stats["timeouts_per_minute"])
+        self.assertEqual(1.0, stats["reconnects_per_minute"])
+        self.assertEqual(4.0, stats["game_types"]["texas-holdem"]["players_average"])
+        # Nodes no longer publishing
+        self.assertEqual(0, observer.stats(now=1100.0)["active_tables"])
+
+    def test_metrics(self):
+        observer = GameObserver()
+        observer.observe({"event": "node", "node": "node-1", "tables": 3, "time": 9e12})
+        self.assertIn("poker_observer_active_tables 3\n", create_metrics(observer).render())
+
+
+class GameEventReaderTest(unittest.TestCase):
+    def test_read(self):
+        redis = mock.Mock()
+        redis.xread.return_value = [[b"poker5:game-events", [
+            (b"1-0", {b"events": json.dumps([{"event": "game-over", "time": 1000.0}]).encode("utf-8")}),
+            (b"2-0", {b"invalid": b""}),
+        ]]]
+        redis.xrevrange.return_value = [(b"0-5", {})]
+        observer = mock.Mock()
+        reader = GameEventReader(redis, observer, logger=mock.Mock())
+        self.assertEqual(2, reader.read())
+        # Following the stream from its end
+        self.assertEqual({"poker5:game-events": b"0-5"}, redis.xread.call_args[0][0])
+        observer.observe.assert_called_once_with({"event": "game-over", "time": 1000.0})
+        reader.read()
+        self.assertEqual({"poker5:game-events": b"2-0"}, redis.xread.call_args[0][0])
+
+    def test_stats_served_while_reading(self):
+        redis = mock.Mock()
+        redis.xrevrange.return_value = []
+
+        blocking_reads = []
+
+        def xread(streams, count=None, block=None):
+            if block is not None:
+                # Blocking the whole process, as the Redis client is not monkey-patched
+                blocking_reads.append(block)
+                if len(blocking_reads) > 3:
+                    raise exceptions.ConnectionError("Stopping the test")
+                time.sleep(block / 1000)
+            return []
+
+        redis.xread.side_effect = xread
+        observer = GameObserver()
+        server = MetricsServer(0, metrics=create_metrics(observer), routes={
+            "/stats": lambda query: ("application/json", json.dumps(observer.stats()).encode("utf-8"))
+        })
+        server.start()
+        reading = gevent.spawn(GameEventReader(redis, observer, logger=mock.Mock()).run)
+        started_at = time.time()
+        try:
+            with gevent.Timeout(5):
+                connection = gevent.socket.create_connection(server.address[:2])
+                connection.sendall(b"GET /stats HTTP/1.0\r\n\r\n")
+                response = b""
+                while True:
+                    data = connection.recv(4096)
+                    if not data:
+                        break
+                    response += data
+                connection.close()
+        finally:
+            reading.kill()
+            server.stop()
+        self.assertLess(time.time() - started_at, 1)
+        self.assertTrue(response.startswith(b"HTTP/1.1 200"))
+        self.assertIn(b"hands_per_minute", response)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+import time
+import unittest
+from unittest import mock
+
+import gevent
+
+from poker.channel import Channel, ChannelError, MessageTimeout
+from poker.player_server import PlayerServer, PlayerOutbox
+
+
+class PlayerServerTest(unittest.TestCase):
+    class ChannelMock(Channel):
+        def __init__(self, backlog=0, heartbeat=None, received_messages=None):
+            self.messages = []
+            self.received_messages = received_messages if received_messages else []
+            self.backlog = backlog
+            self.heartbeat = heartbeat
+            self.closed = False
+
+        def send_message(self, message):
+            if self.closed:
+                raise ChannelError("Channel closed")
+            self.messages.append(message)
+            return self.backlog
+
+        def outbound_backlog(self):
+            return self.backlog
+
+        def recv_message(self, timeout_epoch=None):
+            if not self.received_messages:
+                raise MessageTimeout("Timed out")
+            return self.received_messages.pop(0)
+
+        def last_heartbeat(self):
+            return self.heartbeat
+
+        def close(self):
+            self.closed = True
+
+    class SlowChannelMock(ChannelMock):
+        def send_message(self, message):
+            gevent.sleep(0.1)
+            return PlayerServerTest.ChannelMock.send_message(self, message)
+
+    def _create_player(self, channel, **kwargs):
+        return PlayerServer(channel, mock.Mock(), id="player-1", name="Player One", money=1000.0, **kwargs)
+
+    def _game_update(self, event, **kwargs):
+        message = {"message_type": "game-update", "event": event}
+        message.update(kwargs)
+        return message
+
+    def test_send_message(self):
+        channel = PlayerServerTest.ChannelMock()
+        player = self._create_player(channel)
+        self.assertTrue(player.send_message({"message_type": "ping"}))
+        player.outbox.flush()
+        self.assertEqual([{"message_type": "ping"}], channel.messages)
+        self.assertEqual(0, player.outbox.depth)
+
+    def test_coalesce_superseded_updates(self):
+        channel = PlayerServerTest.ChannelMock()
+        player = self._create_player(channel, outbox_size=2, outbox_policy=PlayerOutbox.POLICY_COALESCE)
+        player.send_message(self._game_update("pots-update", pots=1))
+        player.send_message(self._game_update("new-game"))
+        self.assertTrue(player.send_message(self._game_update("pots-update", pots=2)))
+        self.assertFalse(player.send_message(self._game_update("bet")))
+        player.outbox.flush()
+        self.assertEqual(["new-game", "pots-update"], [message["event"] for message in channel.messages])
+        self.assertEqual(2, channel.messages[1]["pots"])
+        self.assertEqual(1, player.outbox.metrics["coalesced"])
+        self.assertEqual(1, player.outbox.metrics["dropped"])
+
+    def test_drop_non_critical_updates(self):
+        channel = PlayerServerTest.ChannelMock()
+        player = self._create_player(channel, outbox_size=1, outbox_policy=PlayerOutbox.POLICY_DROP)
+        player.send_message(self._game_update("new-game"))
+        self.assertFalse(player.send_message(self._game_update("pots-update")))
+        self.assertTrue(player.send_message(self._game_update("player-action")))
+        player.outbox.flush()
+        self.assertEqual(["new-game", "player-action"], [message["event"] for message in channel.messages])
+
+    def test_remote_backlog_is_part_of_the_depth(self):
+        channel = PlayerServerTest.ChannelMock(backlog=5)
+        player = self._create_player(channel, outbox_size=5, outbox_policy=PlayerOutbox.POLICY_DROP)
+        player.send_message(self._game_update("new-game"))
+        player.outbox.flush()
+        self.assertEqual(5, player.outbox.depth)
+        self.assertFalse(player.send_message(self._game_update("bet")))
+
+    def test_disconnect_after_backlog_time(self):
+        channel = PlayerServerTest.ChannelMock(backlog=5)
+        player = self._create_player(channel, outbox_size=5, outbox_policy=PlayerOutbox.POLICY_DISCONNECT,
+                                     max_backlog_time=0.1)
+        player.send_message(self._game_update("new-game"))
+        player.outbox.flush()
+        player.send_message(self._game_update("bet"))
+        gevent.sleep(0.2)
+        self.assertFalse(player.try_send_message(self._game_update("bet")))
+        self.assertFalse(player.connected)
+        self.assertTrue(channel.closed)
+        self.assertRaises(ChannelError, player.send_message, self._game_update("bet"))
+
+    def test_disconnect_flushes_pending_messages(self):
+        channel = PlayerServerTest.ChannelMock()
+        player = self._create_player(channel)
+        player.send_message(self._game_update("game-over"))
+        player.disconnect()
+        self.assertFalse(player.connected)
+        gevent.sleep(0.1)
+        self.assertEqual(["game-over", "disconnect"],
+                         [message.get("event", message["message_type"]) for message in channel.messages])
+        self.assertTrue(channel.closed)
+
+    def test_disconnect_does_not_wait(self):
+        channel = PlayerServerTest.SlowChannelMock()
+        player = self._create_player(channel)
+        player.send_message(self._game_update("game-over"))
+        time_start = time.time()
+        player.disconnect()
+        self.assertLess(time.time() - time_start, 0.1)
+        self.assertFalse(player.connected)
+        gevent.sleep(0.5)
+        self.assertEqual(["game-over", "disconnect"],
+                         [message.get("event", message["message_type"]) for message in channel.messages])
+        self.assertTrue(channel.closed)
+
+    def test_update_channel(self):
+        old_channel = PlayerServerTest.SlowChannelMock()
+        player = self._create_player(old_channel)
+        player.send_message(self._game_update("new-game"))
+        new_channel = PlayerServerTest.SlowChannelMock()
+        new_player = self._create_player(new_channel)
+        new_player.send_message({"message_type": "room-snapshot"})
+
+        time_start = time.time()
+        player.update_channel(new_player)
+        self.assertLess(time.time() - time_start, 0.1)
+        self.assertIs(new_channel, player.channel)
+        player.send_message(self._game_update("bet"))
+        gevent.sleep(0.5)
+        # Messages sent to the new player are delivered first, the old channel is flushed and closed
+        self.assertEqual(["room-snapshot", "bet"],
+                         [message.get("event", message["message_type"]) for message in new_channel.messages])
+        self.assertEqual(["new-game", "disconnect"],
+                         [message.get("event", message["message_type"]) for message in old_channel.messages])
+        self.assertTrue(old_channel.closed)
+        self.assertFalse(new_channel.closed)
+        self.assertTrue(player.connected)
+
+    def test_replaced_channel_failure(self):
+        old_channel = PlayerServerTest.SlowChannelMock()
+        player = self._create_player(old_channel)
+        old_channel.closed = True
+        player.send_message(self._game_update("new-game"))
+        new_channel = PlayerServerTest.ChannelMock()
+        player.update_channel(self._create_player(new_channel))
+        gevent.sleep(0.3)
+        # The failure of the old channel does not drop the new connection
+        self.assertTrue(player.connected)
+        self.assertFalse(new_channel.closed)
+
+    def test_is_alive_without_heartbeats(self):
+        player = self._create_player(PlayerServerTest.ChannelMock())
+        self.assertTrue(player.is_alive(timeout=0))
+        player.disconnect()
+        self.assertFalse(player.is_alive(timeout=10))
+
+    def test_is_alive_with_heartbeats(self):
+        channel = PlayerServerTest.ChannelMock(heartbeat=0.0)
+        player = self._create_player(channel)
+        self.assertTrue(player.is_alive(timeout=10))
+        self.assertFalse(player.is_alive(timeout=0))
+        channel.heartbeat = time.time() + 5
+        self.assertTrue(player.is_alive(timeout=1))
+        self.assertEqual(channel.heartbeat, player.last_seen)
+
+    def test_wait_ack(self):
+        channel = PlayerServerTest.ChannelMock(received_messages=[
+            {"message_type": "ack", "event_id": 3},
+            {"message_type": "pre-action", "action": "check"},
+            {"message_type": "ack", "event_id": 5},
+        ])
+        player = self._create_player(channel)
+        self.assertTrue(player.wait_ack(4, time.time() + 1))
+        # Messages received while waiting are not lost
+        self.assertEqual("pre-action", player.recv_message()["message_type"])
+        self.assertTrue(player.wait_ack(5, time.time() + 1))
+        self.assertFalse(player.wait_ack(6, time.time() + 1))
+
+    def test_recv_message_skips_acks(self):
+        channel = PlayerServerTest.ChannelMock(received_messages=[
+            {"message_type": "ack", "event_id": 3},
+            {"message_type": "bet", "bet": 10},
+        ])
+        player = self._create_player(channel)
+        self.assertEqual("bet", player.recv_message()["message_type"])
+        self.assertTrue(player.wait_ack(3, time.time()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import json
+import time
+import unittest
+from unittest import mock
+
+import gevent
+
+from poker.channel_memory import ChannelMemory
+from poker.metrics import MetricsRegistry, MetricsServer
+from poker.player_server import PlayerServer
+from poker.profiling import RoomAccounting, SamplingProfiler, ProfilerBusyException, approximate_size, admin_routes
+
+
+def burn_cpu(seconds: float):
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        sum(range(1000))
+        gevent.sleep(0)
+
+
+class RoomAccountingTest(unittest.TestCase):
+    def setUp(self):
+        self.accounting = RoomAccounting()
+
+    def tearDown(self):
+        self.accounting.disable()
+
+    def _play(self, room_id, seconds):
+        with self.accounting.hand(room_id):
+            self.assertEqual(room_id, self.accounting.room_id())
+            burn_cpu(seconds)
+
+    def test_hand(self):
+        self.accounting.enable()
+        gevent.joinall([gevent.spawn(self._play, "room-1", 0.2), gevent.spawn(burn_cpu, 0.2)])
+        usage = self.accounting.usage("room-1")
+        self.assertEqual(1, usage.hands)
+        self.assertGreater(usage.switches, 10)
+        # The other greenlet is not charged
+        self.assertGreater(usage.cpu_seconds, 0.02)
+        self.assertLess(usage.cpu_seconds, 0.19)
+        self.assertIsNone(self.accounting.room_id())
+
+    def test_adopted_greenlets(self):
+        self.accounting.enable()
+        lingering = []
+
+        def play():
+            with self.accounting.hand("room-1"):
+                worker = gevent.spawn(burn_cpu, 0.2)
+                self.accounting.adopt(worker)
+                lingering.append(gevent.spawn(burn_cpu, 0.1))
+                self.accounting.adopt(lingering[0])
+                worker.join()
+
+        gevent.joinall([gevent.spawn(play), gevent.spawn(burn_cpu, 0.2)])
+        # Greenlets still running after the hand are not charged anymore
+        self.assertIsNone(self.accounting.room_id(lingering[0]))
+        # The room greenlet only waits: the time is charged for the worker
+        usage = self.accounting.usage("room-1")
+        self.assertGreater(usage.cpu_seconds, 0.02)
+        self.assertLess(usage.cpu_seconds, 0.19)
+
+    def test_disabled(self):
+        gevent.spawn(self._play, "room-1", 0.05).join()
+        self.assertEqual(0, self.accounting.usage("room-1").hands)
+
+    def test_forget(self):
+        self.accounting.enable()
+        gevent.spawn(self._play, "room-1", 0.01).join()
+        self.accounting.forget("room-1")
+        self.assertEqual(0, self.accounting.usage("room-1").hands)
+
+
+class ApproximateSizeTest(unittest.TestCase):
+    def test_size(self):
+        small = approximate_size([{"event": "bet"}])
+        large = approximate_size([{"event": "bet", "bets": {str(i): float(i) for i in range(100)}}])
+        self.assertGreater(large, small + 5000)
+
+    def test_channel_excluded(self):
+        player = PlayerServer(ChannelMemory.pair()[0], mock.Mock(), id="player-1", name="Player 1", money=1000.0)
+        self.assertEqual(approximate_size(player), approximate_size(player))
+        self.assertLess(approximate_size(player), 100000)
+
+
+class SamplingProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.accounting = RoomAccounting()
+        self.profiler = SamplingProfiler(self.accounting, interval=0.001)
+
+    def _profile(self, room_id):
+        def play():
+            with self.accounting.hand("room-1"):
+                burn_cpu(0.3)
+        player = gevent.spawn(play)
+        samples = self.profiler.profile(0.2, room_id)
+        player.join()
+        return samples
+
+    def test_process(self):
+        samples = self._profile(None)
+        self.assertTrue(any("burn_cpu (test_profiling.py:" in stack for stack in samples))
+        self.assertTrue(all(isinstance(count, int) for count in samples.values()))
+
+    def test_room(self):
+        self.assertTrue(all("play (test_profiling.py:" in stack for stack in self._profile("room-1")))
+        self.assertEqual({}, self._profile("room-2"))
+
+    def test_busy(self):
+        profile = gevent.spawn(self.profiler.profile, 0.1)
+        gevent.sleep(0)
+        self.assertRaises(ProfilerBusyException, self.profiler.profile, 0.1)
+        profile.join()
+
+    def test_render(self):
+        self.assertEqual("a;b 2\na;c 1\n", SamplingProfiler.render({"a;c": 1, "a;b": 2}))
+
+
+class AdminRoutesTest(unittest.TestCase):
+    def _get(self, server, path, query=""):
+        status = []
+        body = server._application({"PATH_INFO": path, "QUERY_STRING": query}, lambda code, headers: status.append(code))
+        return status[0], b"".join(body).decode("utf-8")
+
+    def test_rooms(self):
+        room = mock.Mock(id="room-1", players=[])
+        room.memory_usage.return_value = {"players": 0, "event_log": 56, "scores": 0}
+        game_server = mock.Mock(rooms=[room])
+        server = MetricsServer(0, metrics=MetricsRegistry(), routes=admin_routes(game_server))
+        status, body = self._get(server, "/rooms", "limit=5")
+        self.assertEqual("200 OK", status)
+        self.assertEqual("room-1", json.loads(body)["rooms"][0]["room_id"])
+        self.assertEqual(56, json.loads(body)["rooms"][0]["memory"]["event_log"])
+
+    def test_invalid_command(self):
+        server = MetricsServer(0, metrics=MetricsRegistry(), logger=mock.Mock(), routes=admin_routes(mock.Mock()))
+        self.assertEqual("400 Bad Request", self._get(server, "/profile", "seconds=-1")[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from unittest import mock
+
+import gevent.queue
+
+from poker.channel_redis import MessageQueue
+from poker.redis_shards import HashRing, RedisShards, create_redis
+
+
+class HashRingTest(unittest.TestCase):
+    def test_balanced(self):
+        ring = HashRing(["redis-1", "redis-2", "redis-3"])
+        counts = [0, 0, 0]
+        for key in range(3000):
+            counts[ring.node_of("session-{}".format(key))] += 1
+        self.assertTrue(all(700 < count < 1300 for count in counts), counts)
+
+    def test_node_added(self):
+        ring = HashRing(["redis-1", "redis-2", "redis-3"])
+        new_ring = HashRing(["redis-1", "redis-2", "redis-3", "redis-4"])
+        keys = ["session-{}".format(key) for key in range(1000)]
+        moved = [key for key in keys if ring.node_of(key) != new_ring.node_of(key)]
+        # Only the keys of the new node are moved
+        self.assertTrue(all(new_ring.node_of(key) == 3 for key in moved))
+        self.assertLess(len(moved), 400)
+
+
+class RedisShardsTest(unittest.TestCase):
+    def setUp(self):
+        self.clients = [mock.Mock(), mock.Mock()]
+        self.shards = RedisShards(self.clients, ["redis-1", "redis-2"])
+
+    def _key_of(self, shard):
+        return next("session-{}".format(key) for key in range(100) if self.shards.client("session-{}".format(key)) is self.clients[shard])
+
+    def test_routing(self):
+        key = self._key_of(1)
+        self.clients[1].llen.return_value = 3
+        self.assertEqual(3, MessageQueue(self.shards, key).size())
+        self.clients[1].llen.assert_called_once_with(key)
+        self.clients[0].llen.assert_not_called()
+
+    def test_xreadgroup(self):
+        key = self._key_of(0)
+        self.shards.xreadgroup("group", "consumer", {key: ">"}, count=10)
+        self.clients[0].xreadgroup.assert_called_once_with("group", "consumer", {key: ">"}, count=10)
+        self.assertRaises(ValueError, self.shards.xreadgroup, "group", "consumer", {key: ">", self._key_of(1): ">"})
+
+    def test_pipeline(self):
+        key1, key2 = self._key_of(1), self._key_of(0)
+        self.clients[0].pipeline.return_value.execute.return_value = [1, True]
+        self.clients[1].pipeline.return_value.execute.return_value = [2, False]
+
+        pipeline = self.shards.pipeline(transaction=False)
+        MessageQueue(self.shards, key1).pipeline_push(pipeline, {"id": 1})
+        MessageQueue(self.shards, key2).pipeline_push(pipeline, {"id": 2})
+
+        # Results in the order of the commands, one round trip per shard
+        self.assertEqual([2, False, 1, True], pipeline.execute(raise_on_error=False))
+        self.clients[0].pipeline.return_value.execute.assert_called_once_with(raise_on_error=False)
+        self.clients[1].pipeline.return_value.lpush.assert_called_once_with(key1, b'{"id": 1}')
+
+
+class CreateRedisTest(unittest.TestCase):
+    def test_connection_pool(self):
+        redis = create_redis("redis://localhost:6379/0", max_connections=5, health_check_interval=10)
+        pool = redis.connection_pool
+        self.assertEqual(5, pool.max_connections)
+        self.assertIs(gevent.queue.LifoQueue, pool.queue_class)
+        self.assertEqual(10, pool.connection_kwargs["health_check_interval"])
+
+
+if __name__ == '__main__':
+    unittest.main()
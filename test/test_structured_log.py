@@ -0,0 +1,34 @@
+import unittest
+from unittest import mock
+
+from poker.structured_log import LogPayload, LogSampler
+
+
+class LogPayloadTest(unittest.TestCase):
+    def test_fields_are_evaluated_lazily(self):
+        seats = mock.Mock(return_value="p1, p2")
+        payload = LogPayload(room="room-1", seats=seats)
+        seats.assert_not_called()
+        self.assertEqual({"room": "room-1", "seats": "p1, p2"}, payload.fields)
+        seats.assert_called_once()
+
+    def test_str(self):
+        payload = LogPayload(game="game-1", event="bet")
+        self.assertIn("GAME: game-1\nEVENT: bet", str(payload))
+
+
+class LogSamplerTest(unittest.TestCase):
+    def test_sample(self):
+        sampler = LogSampler({"pots-update": 3})
+        self.assertEqual(
+            [True, False, False, True, False, False, True],
+            [sampler.sample("pots-update") for _ in range(7)]
+        )
+
+    def test_sample_unknown_key(self):
+        sampler = LogSampler({"pots-update": 3})
+        self.assertTrue(all(sampler.sample("bet") for _ in range(5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
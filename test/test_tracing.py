@@ -0,0 +1,94 @@
+import time
+import unittest
+
+from poker.tracing import Tracer, GatewayTracer, TRACE_STAGE_TIME, INBOUND, OUTBOUND
+
+
+class TracerTest(unittest.TestCase):
+    def test_disabled(self):
+        tracer = Tracer()
+        self.assertFalse(tracer.enabled)
+        self.assertFalse(any(tracer.sample() for _ in range(100)))
+
+    def test_sample(self):
+        tracer = Tracer(sample_every=10)
+        self.assertEqual(10, sum(1 for _ in range(100) if tracer.sample()))
+
+    def test_stamp(self):
+        message = {"message_type": "game-update", "trace": {"raised": 1.0}}
+        stamped = Tracer.stamp(message, "pushed")
+        # Shared messages are left untouched
+        self.assertEqual({"raised": 1.0}, message["trace"])
+        self.assertEqual({"raised", "pushed"}, set(stamped["trace"]))
+
+    def test_observe(self):
+        count = TRACE_STAGE_TIME.labels(OUTBOUND, "broker").count
+        gateway_count = TRACE_STAGE_TIME.labels(OUTBOUND, "gateway").count
+        Tracer.observe({"raised": 1.0, "pushed": 1.5, "popped": 2.5}, OUTBOUND)
+        self.assertEqual(count + 1, TRACE_STAGE_TIME.labels(OUTBOUND, "broker").count)
+        # Stage not reached
+        self.assertEqual(gateway_count, TRACE_STAGE_TIME.labels(OUTBOUND, "gateway").count)
+
+    def test_invalid_trace(self):
+        Tracer.observe({"received": "now", "pushed": None}, INBOUND)
+
+
+class GatewayTracerTest(unittest.TestCase):
+    def test_client_message_sampled(self):
+        session_tracer = GatewayTracer("player-1", Tracer(sample_every=2))
+        self.assertNotIn("trace", session_tracer.client_message({"message_type": "bet", "bet": 10}))
+        message = session_tracer.client_message({"message_type": "cards-change", "cards": [0]})
+        self.assertEqual({"received", "pushed"}, set(message["trace"]))
+
+    def test_client_message_pushed(self):
+        session_tracer = GatewayTracer("player-1", Tracer(sample_every=1))
+        gateway_count = TRACE_STAGE_TIME.labels(INBOUND, "gateway").count
+        gateway_sum = TRACE_STAGE_TIME.labels(INBOUND, "gateway").sum
+        received_at = time.time() - 0.5
+        message = session_tracer.client_message({"message_type": "bet", "bet": 10}, received_at)
+        self.assertEqual(received_at, message["trace"]["received"])
+        # Observed by the gateway once the push returns, not by the game service
+        Tracer.finish(message, "popped", INBOUND)
+        self.assertEqual(gateway_count, TRACE_STAGE_TIME.labels(INBOUND, "gateway").count)
+        session_tracer.client_message_pushed(message)
+        self.assertEqual(gateway_count + 1, TRACE_STAGE_TIME.labels(INBOUND, "gateway").count)
+        self.assertGreaterEqual(TRACE_STAGE_TIME.labels(INBOUND, "gateway").sum - gateway_sum, 0.5)
+        # Not traced
+        session_tracer.client_message_pushed({"message_type": "ack"})
+        self.assertEqual(gateway_count + 1, TRACE_STAGE_TIME.labels(INBOUND, "gateway").count)
+
+    def test_client_message_not_an_action(self):
+        session_tracer = GatewayTracer("player-1", Tracer(sample_every=2))
+        for message_type in ("ack", "pre-action", "disconnect"):
+            self.assertNotIn("trace", session_tracer.client_message({"message_type": message_type}))
+        # Not counted by the sampler
+        self.assertNotIn("trace", session_tracer.client_message({"message_type": "bet", "bet": 10}))
+        self.assertIn("trace", session_tracer.client_message({"message_type": "bet", "bet": 10}))
+
+    def test_server_message(self):
+        session_tracer = GatewayTracer("player-1", Tracer())
+        message = {"message_type": "game-update", "event": "bet", "trace": {"raised": 1.0, "pushed": 1.1}}
+        client_message, trace = session_tracer.server_message(message)
+        self.assertNotIn("trace", client_message)
+        self.assertIn("popped", trace)
+        self.assertEqual((client_message, None), session_tracer.server_message(client_message))
+
+    def test_bet_after_traced_action(self):
+        session_tracer = GatewayTracer("player-1", Tracer())
+        client_count = TRACE_STAGE_TIME.labels(INBOUND, "client").count
+        action, trace = session_tracer.server_message({
+            "message_type": "game-update",
+            "event": "player-action",
+            "player": {"id": "player-1"},
+            "trace": {"raised": 1.0}
+        })
+        session_tracer.server_message_written(action, trace)
+        message = session_tracer.client_message({"message_type": "bet", "bet": 10})
+        # Traced even if not sampled
+        self.assertIn("trace", message)
+        self.assertEqual(client_count + 1, TRACE_STAGE_TIME.labels(INBOUND, "client").count)
+        self.assertNotIn("trace", session_tracer.client_message({"message_type": "bet", "bet": 10}))
+
+
+if __name__ == '__main__':
+    unittest.main()
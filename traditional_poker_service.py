@@ -1,10 +1,46 @@
+import gevent
 import logging
-import redis
 import os
+import signal
+import sys
+from typing import List, Optional
 
+from poker.game_event_stream import GameEventPublisher
 from poker.game_server_redis import GameServerRedis
+from poker.game_server_supervisor import GameServerSupervisor
 from poker.game_room import GameRoomFactory
+from poker.hand_history import HandHistoryRecorder, HandHistoryWriter
+from poker.poker_game import GamePacer, GameSubscriber
 from poker.poker_game_traditional import TraditionalPokerGameFactory
+from poker.metrics import MetricsServer
+from poker.profiling import accounting, admin_routes
+from poker.redis_shards import RedisShards, create_redis
+from poker.tracing import tracer
+
+
+def create_room_factory(logger, game_subscribers: Optional[List[GameSubscriber]] = None) -> GameRoomFactory:
+    return GameRoomFactory(
+        room_size=5,
+        game_factory=TraditionalPokerGameFactory(blind=10.0, logger=logger, game_subscribers=game_subscribers),
+        pacer=GamePacer.create(os.environ.get("PACING", "fixed"))
+    )
+
+
+def create_server(redis_client, connection_channel: str, logger, lobby_shards: int = 1,
+                  session_redis: Optional[RedisShards] = None,
+                  event_publisher: Optional[GameEventPublisher] = None,
+                  game_subscribers: Optional[List[GameSubscriber]] = None) -> GameServerRedis:
+    game_subscribers = list(game_subscribers or []) + ([event_publisher] if event_publisher is not None else [])
+    return GameServerRedis(
+        redis=redis_client,
+        connection_channel=connection_channel,
+        room_factory=create_room_factory(logger, game_subscribers or None),
+        logger=logger,
+        lobby_shards=lobby_shards,
+        session_redis=session_redis,
+        event_publisher=event_publisher,
+        cluster_name="traditional-poker"
+    )
 
 
 if __name__ == '__main__':
@@ -12,14 +48,64 @@ if __name__ == '__main__':
     logger = logging.getLogger()
 
     redis_url = os.environ["REDIS_URL"]
+    redis_client = create_redis(redis_url)
+    # Player sessions spread over several Redis endpoints
+    session_redis = RedisShards.from_urls(os.environ["REDIS_SHARD_URLS"].split(",")) \
+        if "REDIS_SHARD_URLS" in os.environ else None
+    connection_channel = "traditional-poker:lobby"
+    workers = int(os.environ.get("WORKERS", 1))
+    lobby_shards = int(os.environ.get("LOBBY_SHARDS", 1))
+    # One game event traced every TRACE_SAMPLING
+    tracer.set_sampling(int(os.environ.get("TRACE_SAMPLING", 0)))
+    # CPU time and greenlet switches of every room
+    if os.environ.get("ROOM_ACCOUNTING"):
+        accounting.enable()
+    # Summary of the game events published for the observers (observer.py)
+    event_publisher = GameEventPublisher(redis_client, "traditional-poker", logger) \
+        if os.environ.get("PUBLISH_GAME_EVENTS") else None
+    # Binary history of every hand played (poker/hand_history.py)
+    hand_recorder = HandHistoryRecorder(
+        HandHistoryWriter(os.environ["HAND_HISTORY_DIR"], "traditional-poker", logger=logger), logger
+    ) if "HAND_HISTORY_DIR" in os.environ else None
+    game_subscribers = [hand_recorder] if hand_recorder is not None else None
+    if hand_recorder is not None:
+        hand_recorder.start()
 
-    server = GameServerRedis(
-        redis=redis.from_url(redis_url),
-        connection_channel="traditional-poker:lobby",
-        room_factory=GameRoomFactory(
-            room_size=5,
-            game_factory=TraditionalPokerGameFactory(blind=10.0, logger=logger)
-        ),
-        logger=logger
-    )
-    server.start()
+    if "WORKER_ID" in os.environ:
+        # Worker process owning a shard of the rooms
+        server = create_server(redis_client, os.environ["WORKER_CHANNEL"], logger, session_redis=session_redis,
+                               event_publisher=event_publisher, game_subscribers=game_subscribers)
+        if "METRICS_PORT" in os.environ:
+            # One endpoint per worker
+            MetricsServer(
+                int(os.environ["METRICS_PORT"]) + int(os.environ["WORKER_ID"]), logger=logger, routes=admin_routes(server)
+            ).start()
+        # Rooms are handed over to the next process once their current hand is over
+        gevent.signal_handler(signal.SIGTERM, server.drain)
+        GameServerSupervisor.run_worker(
+            server=server,
+            redis=redis_client,
+            connection_channel=connection_channel,
+            worker_id=int(os.environ["WORKER_ID"]),
+            logger=logger
+        )
+        if hand_recorder is not None:
+            hand_recorder.close()
+    elif workers > 1:
+        GameServerSupervisor(
+            redis=redis_client,
+            connection_channel=connection_channel,
+            worker_command=[sys.executable] + sys.argv,
+            num_workers=workers,
+            logger=logger,
+            lobby_shards=lobby_shards
+        ).start()
+    else:
+        server = create_server(redis_client, connection_channel, logger, lobby_shards, session_redis, event_publisher,
+                               game_subscribers)
+        if "METRICS_PORT" in os.environ:
+            MetricsServer(int(os.environ["METRICS_PORT"]), logger=logger, routes=admin_routes(server)).start()
+        gevent.signal_handler(signal.SIGTERM, server.drain)
+        server.start()
+        if hand_recorder is not None:
+            hand_recorder.close()